@@ -86,12 +86,14 @@ def db_container(state):
 def db_ddl(action, environment):
     app = make_app(environment)
     from app.main import db
-    from app.main.model import blacklist, user
+    from app.main.model import blacklist, email_outbox, refresh_token, user
     from tests.helpers import set_up_database, tear_down_database
     # To allow flask_migrate to find models these are imported but not used. To avoid them being
     # auto removed by PyCharm when using 'Optimize Imports', pop them here so they are "used".
     simple_namespace = SimpleNamespace()
     simple_namespace.blacklist = blacklist
+    simple_namespace.email_outbox = email_outbox
+    simple_namespace.refresh_token = refresh_token
     simple_namespace.user = user
     Migrate(app, db)
     if action == 'init':
@@ -106,7 +108,116 @@ def db_ddl(action, environment):
         tear_down_database(db)
 
 
+@cli.command()
+@click.option('--environment', '-e', required=True, type=click.Choice(ENVIRONMENTS.keys()))
+@click.option('--batch-size', '-b', type=int, help='Rows deleted per transaction')
+def prune_blacklist(environment, batch_size):
+    """Delete blacklisted JWTs which have expired, and expired or revoked refresh tokens"""
+    make_app(environment)
+    from app.main.service.blacklist import prune_blacklist as prune
+    from app.main.service.refresh_token import prune_refresh_tokens
+    deleted = prune(batch_size=batch_size)
+    click.echo(f'Pruned {deleted} expired blacklisted tokens')
+    deleted = prune_refresh_tokens(batch_size=batch_size)
+    click.echo(f'Pruned {deleted} expired or revoked refresh tokens')
+
+
+@cli.command()
+@click.option('--environment', '-e', required=True, type=click.Choice(ENVIRONMENTS.keys()))
+@click.option('--batch-size', '-b', type=int, help='Rows deleted per transaction')
+def prune_outbox(environment, batch_size):
+    """Delete queued emails which were sent or given up on longer than the retention period ago"""
+    make_app(environment)
+    from app.main.service.email_outbox import prune_outbox as prune
+    deleted = prune(batch_size=batch_size)
+    click.echo(f'Pruned {deleted} sent or abandoned emails')
+
+
+@cli.command()
+@click.option('--environment', '-e', required=True, type=click.Choice(ENVIRONMENTS.keys()))
+@click.option('--file', '-f', 'path', required=True, type=click.Path(exists=True, dir_okay=False),
+              help='NDJSON or CSV file with email, username and password fields')
+@click.option('--format', 'file_format', type=click.Choice(['ndjson', 'csv']),
+              help="Defaults to the file's extension")
+@click.option('--batch-size', '-b', type=int, help='Users inserted per transaction')
+@click.option('--workers', '-w', type=int, help='Processes hashing passwords, 0 hashes inline')
+@click.option('--confirmed', is_flag=True, help="Treat the users' email addresses as confirmed")
+@click.option('--rejected', 'rejected_path', type=click.Path(dir_okay=False),
+              help='File rejected records are appended to, defaults to <file>.rejected.ndjson')
+def import_users(environment, path, file_format, batch_size, workers, confirmed, rejected_path):
+    """Import users in bulk, resuming from the last checkpoint if a previous run was interrupted"""
+    make_app(environment)
+    from app.main.service.user_import import import_users as run_import
+
+    def progress(totals):
+        click.echo(f"{totals['imported']} imported, {totals['rejected']} rejected "
+                   f"({totals['rate']:.0f} users/s)")
+
+    totals = run_import(
+        path, file_format=file_format, batch_size=batch_size, workers=workers,
+        confirmed=confirmed, rejected_path=rejected_path, progress=progress,
+    )
+    click.echo(f"Imported {totals['imported']} users in {totals['seconds']:.1f} s "
+               f"({totals['rate']:.0f} users/s); rejected {totals['rejected']}, "
+               f"skipped {totals['skipped']} already imported")
+
+
+@cli.command()
+@click.option('--environment', '-e', required=True, type=click.Choice(ENVIRONMENTS.keys()))
+@click.option('--workers', '-w', type=int, help='Threads sending emails')
+@click.option('--batch-size', '-b', type=int, help='Most emails claimed at once')
+@click.option('--poll-interval', '-p', type=float, help='Seconds between checks of an empty outbox')
+@click.option('--once', is_flag=True, help='Stop once there are no more emails due')
+def mail_worker(environment, workers, batch_size, poll_interval, once):
+    """Send the emails queued in the email outbox, retrying those which fail"""
+    make_app(environment)
+    from app.main.service.email_outbox import run_mail_worker
+    sent, failed = run_mail_worker(
+        workers=workers, batch_size=batch_size, poll_interval=poll_interval, once=once
+    )
+    click.echo(f'Sent {sent} queued emails, {failed} failed and will be retried')
+
+
+@cli.command()
+@click.option('--environment', '-e', required=True, type=click.Choice(ENVIRONMENTS.keys()))
+@click.option('--since', required=True, type=click.DateTime(),
+              help='Resend to unconfirmed users last emailed at or after this UTC time')
+@click.option('--batch-size', '-b', type=int, help='Users queued per transaction')
+@click.option('--sessions', '-s', type=int, help='SMTP sessions sending in parallel')
+@click.option('--queue-only', is_flag=True, help='Leave the emails for the mail-worker to send')
+def resend_confirmations(environment, since, batch_size, sessions, queue_only):
+    """Resend confirmation emails to the users who have not yet confirmed their email address"""
+    make_app(environment)
+    from app.main.service.confirmation_resend import resend_confirmations as run_resend
+
+    def progress(totals):
+        click.echo(f"{totals['queued']} queued, {totals['sent']} sent")
+
+    totals = run_resend(
+        since, batch_size=batch_size, sessions=sessions, send=not queue_only, progress=progress,
+    )
+    click.echo(f"Queued {totals['queued']} confirmation emails in {totals['seconds']:.1f} s; "
+               f"sent {totals['sent']}, {totals['failed']} failed and will be retried")
+
+
 # App Commands
+@cli.command()
+@click.option('--environment', '-e', required=True, type=click.Choice(ENVIRONMENTS.keys()))
+@click.option('--algorithm', '-a', type=click.Choice(['bcrypt', 'argon2id']),
+              help='Defaults to the configured PASSWORD_HASH_ALGORITHM')
+@click.option('--target-ms', '-t', default=250, show_default=True, type=int,
+              help='Hashing time to aim for on this machine')
+def calibrate_hash(environment, algorithm, target_ms):
+    """Pick password hashing costs which hit a target latency on this machine"""
+    app = make_app(environment)
+    from app.hashing import calibrate, make_hasher
+    hasher, elapsed = calibrate(make_hasher(app.config, algorithm), target_ms / 1000)
+    click.echo(f'# {hasher.algorithm} hashes in {elapsed * 1000:.0f} ms on this machine')
+    click.echo(f'PASSWORD_HASH_ALGORITHM={hasher.algorithm}')
+    for name, value in hasher.config().items():
+        click.echo(f'{name}={value}')
+
+
 @cli.command()
 @click.option('--environment', '-e', required=True, type=click.Choice(ENVIRONMENTS.keys()))
 def run(environment):
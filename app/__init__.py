@@ -10,10 +10,14 @@ import logging
 
 from flask import Blueprint
 from flask_restx import Api
-from werkzeug.exceptions import BadRequest, Conflict, InternalServerError, NotFound, Unauthorized
+from werkzeug.exceptions import (
+    BadRequest, Conflict, InternalServerError, NotFound, ServiceUnavailable, TooManyRequests,
+    Unauthorized,
+)
 
-from app.main.data.dto import EmailDto, PasswordDto, ResponseDto
+from app.main.data.dto import EmailDto, PasswordDto, RefreshDto, ResponseDto
 from app.main.routes.auth import api as auth_ns
+from app.main.routes.metrics import api as metrics_ns
 from app.main.routes.user import api as user_ns
 from app.responses import responder
 
@@ -39,9 +43,11 @@ api = Api(
 
 api.add_namespace(EmailDto.api)
 api.add_namespace(PasswordDto.api)
+api.add_namespace(RefreshDto.api)
 api.add_namespace(ResponseDto.api)
 api.add_namespace(auth_ns, path='/auth')
 api.add_namespace(user_ns, path='/users')
+api.add_namespace(metrics_ns, path='/metrics')
 
 
 @api.errorhandler(Conflict)
@@ -60,6 +66,20 @@ def fail_handler(error):
     return responder(code=error.code, data={error.name.lower(): str(error.description)})
 
 
+@api.errorhandler(TooManyRequests)
+def throttled_handler(error):
+    """
+    A client making too many requests i.e. HTTP 429 is caught by this handler. For example, after
+    repeated failed logins. A Retry-After header tells the client when it may try again.
+    :param error: werkzeug.exceptions object thrown by the application
+    :return: dict containing the HTTP error code and the failure, then the Retry-After header
+    """
+    logger.warning(f"Error code: {error.code}")
+    logger.warning(f"Error description: {str(error.description)}")
+    data, code = responder(code=error.code, data={error.name.lower(): str(error.description)})
+    return data, code, {'Retry-After': str(getattr(error, 'retry_after', 1))}
+
+
 @api.errorhandler(InternalServerError)
 def error_handler(error):
     """
@@ -71,3 +91,17 @@ def error_handler(error):
     logger.critical(f"Error code: {error.code}")
     logger.critical(f"Error description: {str(error.description)}")
     return responder(code=error.code, data={error.name.lower(): str(error.description)})
+
+
+@api.errorhandler(ServiceUnavailable)
+def unavailable_handler(error):
+    """
+    The app is temporarily too busy i.e. HTTP 503 is caught by this handler. For example, when the
+    password hashing pool is saturated. A Retry-After header tells the client when to try again.
+    :param error: werkzeug.exceptions object thrown by the application
+    :return: dict containing the HTTP error code and message, then the Retry-After header
+    """
+    logger.warning(f"Error code: {error.code}")
+    logger.warning(f"Error description: {str(error.description)}")
+    data, code = responder(code=error.code)
+    return data, code, {'Retry-After': str(getattr(error, 'retry_after', 1))}
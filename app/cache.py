@@ -0,0 +1,509 @@
+# pylint: disable=missing-function-docstring
+
+"""
+In-process caching primitives. A Bloom filter gives fast "definitely not present" answers and a
+bounded TTL cache with LRU eviction holds recently confirmed values. Both are per worker process
+and thread safe. The BlacklistCache combines them in front of the JWT blacklist table so the common
+case, a token which has never been blacklisted, is answered without a database query. The
+ClaimsCache saves verifying the same JWT on every request and the TokenGenerationCache saves
+looking up each user's token generation on every request. The UserCache holds recently read users,
+optionally backed by a SQLite file which every worker on the node shares.
+"""
+
+import datetime
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from app.metrics import metrics
+
+BITS_PER_BYTE = 8
+DIGEST_SIZE = 16
+HALF_DIGEST = DIGEST_SIZE // 2
+SQLITE_TIMEOUT = 5
+# Shared caches drop expired entries, then their oldest if still over size, every this many writes.
+TRIM_EVERY = 1000
+# A rebuilt Bloom filter has room for this many times the rows it is built from, so it does not
+# overflow again straight away.
+BLOOM_HEADROOM = 2
+
+
+class BloomFilter:
+    """
+    Probabilistic set membership. A negative answer is always correct, a positive answer is wrong
+    with roughly the configured error rate once the filter holds its capacity. Items cannot be
+    removed, so the filter is rebuilt when it overflows.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.num_bits = math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.num_hashes = max(round(self.num_bits / self.capacity * math.log(2)), 1)
+        self.count = 0
+        self._bits = bytearray(math.ceil(self.num_bits / BITS_PER_BYTE))
+        self._lock = threading.Lock()
+
+    def _positions(self, item):
+        if isinstance(item, str):
+            item = item.encode('utf-8')
+        digest = hashlib.blake2b(item, digest_size=DIGEST_SIZE).digest()
+        first = int.from_bytes(digest[:HALF_DIGEST], 'big')
+        second = int.from_bytes(digest[HALF_DIGEST:], 'big') | 1
+        return [(first + idx * second) % self.num_bits for idx in range(self.num_hashes)]
+
+    def add(self, item):
+        positions = self._positions(item)
+        with self._lock:
+            if self._is_set(positions):
+                return  # Already present: re-adding would overstate how full the filter is.
+            for position in positions:
+                self._bits[position // BITS_PER_BYTE] |= 1 << (position % BITS_PER_BYTE)
+            self.count += 1
+
+    def clear(self):
+        with self._lock:
+            self._bits = bytearray(len(self._bits))
+            self.count = 0
+
+    @property
+    def overflowed(self):
+        return self.count > self.capacity
+
+    def _is_set(self, positions):
+        return all(
+            self._bits[position // BITS_PER_BYTE] & (1 << (position % BITS_PER_BYTE))
+            for position in positions
+        )
+
+    def __contains__(self, item):
+        return self._is_set(self._positions(item))
+
+
+class TTLCache:
+    """
+    Bounded mapping where entries expire after a time to live and the least recently used entry is
+    evicted once the cache is full. Hit, miss and eviction counts are kept for observability.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = max(int(maxsize), 1)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry and entry[1] > time.monotonic() else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return dict(
+            size=len(self._data), hits=self.hits, misses=self.misses, evictions=self.evictions,
+        )
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteConnections:
+    """
+    Connections to a SQLite file, one per thread and re-opened after a fork, each in autocommit mode
+    so every statement is its own short transaction. WAL journaling lets readers carry on while
+    another process writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def execute(self, sql, parameters=()):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection.execute(sql, parameters)
+
+
+class SQLiteTTLCache:
+    """
+    Bounded mapping of JSON serialisable values with a time to live, held in a SQLite file so every
+    worker process on the node shares it. The oldest entries are dropped once it is over size.
+    """
+
+    def __init__(self, path, maxsize, ttl):
+        self.maxsize = max(int(maxsize), 1)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._writes = 0
+        self._connections = SQLiteConnections(path)
+        self._connections.execute(
+            'CREATE TABLE IF NOT EXISTS cache '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)'
+        )
+        self._connections.execute('CREATE INDEX IF NOT EXISTS ix_cache_expires ON cache (expires)')
+
+    def get(self, key, default=None):
+        row = self._connections.execute(
+            'SELECT value FROM cache WHERE key = ? AND expires > ?', (key, time.time())
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self._connections.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (key, json.dumps(value), time.time() + ttl),
+        )
+        self._writes += 1
+        if self._writes % TRIM_EVERY == 0:
+            self._trim()
+
+    def pop(self, key, default=None):
+        # Read and deleted in one transaction, so only one process gets the value.
+        self._connections.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._connections.execute(
+                'SELECT value, expires FROM cache WHERE key = ?', (key,)
+            ).fetchone()
+            self._connections.execute('DELETE FROM cache WHERE key = ?', (key,))
+        except sqlite3.Error:
+            self._connections.execute('ROLLBACK')
+            raise
+        self._connections.execute('COMMIT')
+        return json.loads(row[0]) if row and row[1] > time.time() else default
+
+    def clear(self):
+        self._connections.execute('DELETE FROM cache')
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+    def _trim(self):
+        self._connections.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        (size,) = self._connections.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if size > self.maxsize:
+            self._connections.execute(
+                'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)',
+                (size - self.maxsize,),
+            )
+            self.evictions += size - self.maxsize
+
+
+class BlacklistCache:
+    """
+    Flask extension which keeps a per worker view of the JWT blacklist. Every blacklisted key is
+    added to a Bloom filter, so a key missing from the filter is known to be valid without asking
+    the database. Keys the filter reports as present are confirmed against the database once and the
+    result is kept in a TTL cache. Rows written by other workers are picked up by periodically
+    syncing new rows into the filter, which bounds how stale a worker can be. A full reload builds
+    a new filter off to the side and swaps it in, so lookups meanwhile keep using the old one.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.sync_interval = 0
+        self.bloom = None
+        self.confirmed = None
+        self.hits = 0
+        self.misses = 0
+        self.syncs = 0
+        self._last_sync = None
+        self._watermark = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['BLACKLIST_CACHE_ENABLED']
+        self.sync_interval = app.config['BLACKLIST_CACHE_SYNC_INTERVAL']
+        self.bloom = BloomFilter(
+            app.config['BLACKLIST_BLOOM_CAPACITY'], app.config['BLACKLIST_BLOOM_ERROR_RATE']
+        )
+        self.confirmed = TTLCache(
+            app.config['BLACKLIST_CACHE_SIZE'], app.config['BLACKLIST_CACHE_TTL']
+        )
+        self.reset()
+        app.extensions['blacklist-cache'] = self
+        metrics.register('blacklist_cache', self.stats)
+
+    def reset(self):
+        with self._lock:
+            self.bloom = BloomFilter(self.bloom.capacity, self.bloom.error_rate)
+            self.confirmed.clear()
+            self._last_sync = None
+            self._watermark = None
+
+    def sync(self, loader):
+        """
+        Add rows blacklisted since the last sync to the Bloom filter. The first sync, and any sync
+        after the filter overflows its capacity, loads every row into a new filter with room for
+        them, which then replaces the old one. A thread arriving while another syncs skips its sync
+        rather than waiting.
+        :param loader: callable taking a datetime or None and returning (key, blacklisted_on) rows
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if self._last_sync is not None and now - self._last_sync < self.sync_interval:
+            return
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            if self._last_sync is None or self.bloom.overflowed:
+                self._reload(loader)
+            else:
+                # Overlap the window so rows committed slightly out of order are not missed.
+                overlap = datetime.timedelta(seconds=max(self.sync_interval, 1) * 2)
+                since = self._watermark - overlap if self._watermark else None
+                for key, blacklisted_on in loader(since):
+                    self.bloom.add(key)
+                    if self._watermark is None or blacklisted_on > self._watermark:
+                        self._watermark = blacklisted_on
+            self._last_sync = now
+            self.syncs += 1
+        finally:
+            self._lock.release()
+
+    def _reload(self, loader):
+        rows = list(loader(None))
+        bloom = BloomFilter(
+            max(self.bloom.capacity, len(rows) * BLOOM_HEADROOM), self.bloom.error_rate
+        )
+        for key, _ in rows:
+            bloom.add(key)
+        # One assignment, so a lookup sees either the old filter or the new one, both complete.
+        # Anything added to the old filter since the load is in the next sync's window.
+        self.bloom = bloom
+        self._watermark = max((blacklisted_on for _, blacklisted_on in rows), default=None)
+
+    def get(self, key):
+        """
+        :param key: blacklist key of a JWT
+        :return: True or False if the cache can answer, None if the database must be asked
+        """
+        if not self.enabled:
+            return None
+        if self.confirmed.get(key):
+            self.hits += 1
+            return True
+        if key not in self.bloom:
+            self.hits += 1
+            return False
+        self.misses += 1
+        return None
+
+    def add(self, key):
+        if not self.enabled:
+            return
+        self.bloom.add(key)
+        self.confirmed.set(key, True)
+
+    def stats(self):
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            syncs=self.syncs,
+            size=len(self.confirmed) if self.confirmed is not None else 0,
+            evictions=self.confirmed.evictions if self.confirmed is not None else 0,
+        )
+
+
+class ClaimsCache:
+    """
+    Flask extension which keeps the verified claims of recently seen JWTs, keyed by token digest.
+    A client sending the same token again skips signature verification and claim parsing. Entries
+    expire with their token, or sooner after the configured TTL, and are evicted as soon as the
+    token is blacklisted.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.claims = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['JWT_CLAIMS_CACHE_ENABLED']
+        self.claims = TTLCache(
+            app.config['JWT_CLAIMS_CACHE_SIZE'], app.config['JWT_CLAIMS_CACHE_TTL']
+        )
+        app.extensions['claims-cache'] = self
+        metrics.register('claims_cache', self.stats)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        return self.claims.get(key)
+
+    def set(self, key, claims):
+        if not self.enabled:
+            return
+        ttl = claims.get('exp', 0) - time.time()
+        if ttl > 0:
+            self.claims.set(key, claims, ttl=ttl)
+
+    def evict(self, key):
+        self.claims.pop(key)
+
+    def clear(self):
+        self.claims.clear()
+
+    def stats(self):
+        return self.claims.stats() if self.claims is not None else dict()
+
+
+class TokenGenerationCache:
+    """
+    Flask extension which keeps each user's current token generation, keyed by public id. Every
+    authenticated request compares its JWT's generation claim against this, so entries are kept for
+    a short TTL to spare the database. The TTL bounds how long another worker can keep accepting
+    tokens after a user's generation is bumped; the worker which bumps it updates its own entry.
+    """
+
+    def __init__(self, app=None):
+        self.generations = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.generations = TTLCache(
+            app.config['TOKEN_GENERATION_CACHE_SIZE'], app.config['TOKEN_GENERATION_CACHE_TTL']
+        )
+        app.extensions['token-generation-cache'] = self
+        metrics.register('token_generation_cache', self.stats)
+
+    def get(self, public_id, loader):
+        """
+        :param public_id: string of the user's public id
+        :param loader: callable taking the public id and returning the generation, or None if the
+        user does not exist, when it is not cached
+        :return: int of the user's current token generation or None
+        """
+        generation = self.generations.get(public_id)
+        if generation is None:
+            generation = loader(public_id)
+            if generation is not None:
+                self.generations.set(public_id, generation)
+        return generation
+
+    def set(self, public_id, generation):
+        self.generations.set(public_id, generation)
+
+    def clear(self):
+        self.generations.clear()
+
+    def stats(self):
+        return self.generations.stats() if self.generations is not None else dict()
+
+
+class UserCache:
+    """
+    Flask extension which keeps recently read users, keyed by public id and by email. Values are
+    dicts of JSON friendly column values rather than ORM instances, so they can be shared between
+    processes and attached to any session. Entries live in a per worker LRU and, when
+    USER_CACHE_SHARED_PATH names a SQLite file, in a second tier every worker on the node shares.
+    Writing a user through save_changes evicts its entries from both. Entries carry the row's
+    version, which User.lookup checks before using one, so an entry another worker's write has
+    outdated is never served.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.local = None
+        self.shared = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['USER_CACHE_ENABLED']
+        size, ttl = app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL']
+        self.local = TTLCache(size, ttl)
+        path = app.config['USER_CACHE_SHARED_PATH']
+        self.shared = SQLiteTTLCache(path, size, ttl) if path else None
+        app.extensions['user-cache'] = self
+        metrics.register('user_cache', self.stats)
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        value = self.local.get(key)
+        if value is None and self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        self.local.set(key, value)
+        if self.shared is not None:
+            self.shared.set(key, value)
+
+    def evict(self, *keys):
+        for key in keys:
+            self.local.pop(key)
+            if self.shared is not None:
+                self.shared.pop(key)
+
+    def clear(self):
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def stats(self):
+        if self.local is None:
+            return dict()
+        stats = self.local.stats()
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+        # Count a local miss answered by the shared tier as a hit.
+        shared_hits = self.shared.hits if self.shared is not None else 0
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['hits'] + shared_hits) / lookups if lookups else 0.0
+        return stats
@@ -48,13 +48,108 @@ class Config:
     ERROR_INCLUDE_MESSAGE = False
     BABEL_TRANSLATION_DIRECTORIES = f'{BASEDIR}/i18n/translations'
     LANGUAGES = ['en', 'en_AU']
-    JWT_EXPIRES = datetime.timedelta(days=1)
+    # Access JWTs are short lived. Clients keep a session going by exchanging their refresh token
+    # for a new access JWT. Access JWTs are only checked against the blacklist, on every request,
+    # when JWT_ACCESS_REVOCATION is set; otherwise verifying the signature is enough.
+    JWT_EXPIRES = datetime.timedelta(minutes=int(os.environ.get('JWT_EXPIRES_MINUTES') or 15))
+    JWT_ACCESS_REVOCATION = os.environ.get('JWT_ACCESS_REVOCATION') is not None
+    REFRESH_TOKEN_EXPIRES = datetime.timedelta(
+        days=int(os.environ.get('REFRESH_TOKEN_EXPIRES_DAYS') or 30)
+    )
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMIN = os.environ.get('ADMIN_EMAIL')
+    # Each worker keeps up to SMTP_POOL_SIZE SMTP connections open. One idle for more than
+    # SMTP_POOL_CHECK_AFTER seconds is checked before reuse, and after SMTP_POOL_IDLE_TIMEOUT it is
+    # closed, which should be shorter than the mail server's own idle timeout.
+    SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE') or 4)
+    SMTP_POOL_CHECK_AFTER = float(os.environ.get('SMTP_POOL_CHECK_AFTER') or 5)
+    SMTP_POOL_IDLE_TIMEOUT = float(os.environ.get('SMTP_POOL_IDLE_TIMEOUT') or 60)
+    # Emails are queued in the email_outbox table, with the change they are about, and sent by the
+    # mail-worker command: EMAIL_OUTBOX_WORKERS threads sending up to EMAIL_OUTBOX_BATCH_SIZE at a
+    # time. A failed email is retried after EMAIL_OUTBOX_BACKOFF seconds, doubling each time up to
+    # EMAIL_OUTBOX_BACKOFF_MAX, until it has been tried EMAIL_OUTBOX_MAX_ATTEMPTS times. A worker's
+    # claim on a batch lapses after EMAIL_OUTBOX_LEASE seconds. With EMAIL_OUTBOX_INLINE set, emails
+    # are instead sent before the response, for testing or running without a worker. prune-outbox
+    # deletes emails sent or given up on more than EMAIL_OUTBOX_RETENTION seconds ago.
+    EMAIL_OUTBOX_INLINE = os.environ.get('EMAIL_OUTBOX_INLINE') is not None
+    EMAIL_OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS') or 4)
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE') or 50)
+    EMAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get('EMAIL_OUTBOX_POLL_INTERVAL') or 1)
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS') or 8)
+    EMAIL_OUTBOX_BACKOFF = int(os.environ.get('EMAIL_OUTBOX_BACKOFF') or 30)
+    EMAIL_OUTBOX_BACKOFF_MAX = int(os.environ.get('EMAIL_OUTBOX_BACKOFF_MAX') or 3600)
+    EMAIL_OUTBOX_LEASE = int(os.environ.get('EMAIL_OUTBOX_LEASE') or 300)
+    EMAIL_OUTBOX_RETENTION = int(os.environ.get('EMAIL_OUTBOX_RETENTION') or 7 * 24 * 3600)
+    EMAIL_OUTBOX_PRUNE_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_PRUNE_BATCH_SIZE') or 1000)
+    # resend-confirmations reads, queues and marks this many unconfirmed users per transaction.
+    CONFIRMATION_RESEND_BATCH_SIZE = int(os.environ.get('CONFIRMATION_RESEND_BATCH_SIZE') or 500)
+    # Admins list users a page at a time. Clients may ask for up to USERS_PAGE_MAX_SIZE per page.
+    USERS_PAGE_SIZE = int(os.environ.get('USERS_PAGE_SIZE') or 20)
+    USERS_PAGE_MAX_SIZE = int(os.environ.get('USERS_PAGE_MAX_SIZE') or 100)
+    # POST /users/lookup resolves at most this many public ids per request.
+    USERS_LOOKUP_MAX_SIZE = int(os.environ.get('USERS_LOOKUP_MAX_SIZE') or 100)
+    # Exports stream users from the database this many rows at a time.
+    USERS_EXPORT_CHUNK_SIZE = int(os.environ.get('USERS_EXPORT_CHUNK_SIZE') or 1000)
+    # Per worker cache in front of the JWT blacklist table. The sync interval (seconds) bounds how
+    # long a token blacklisted by another worker can still be accepted by this one.
+    BLACKLIST_CACHE_ENABLED = os.environ.get('BLACKLIST_CACHE_DISABLED') is None
+    BLACKLIST_CACHE_SIZE = int(os.environ.get('BLACKLIST_CACHE_SIZE') or 10000)
+    BLACKLIST_CACHE_TTL = int(os.environ.get('BLACKLIST_CACHE_TTL') or 300)
+    BLACKLIST_CACHE_SYNC_INTERVAL = int(os.environ.get('BLACKLIST_CACHE_SYNC_INTERVAL') or 5)
+    BLACKLIST_BLOOM_CAPACITY = int(os.environ.get('BLACKLIST_BLOOM_CAPACITY') or 100000)
+    BLACKLIST_BLOOM_ERROR_RATE = float(os.environ.get('BLACKLIST_BLOOM_ERROR_RATE') or 0.001)
+    # Each user's token generation is cached per worker for TOKEN_GENERATION_CACHE_TTL seconds.
+    # Bumping a generation revokes all of the user's JWTs, but other workers may still accept them
+    # until their cached value expires.
+    TOKEN_GENERATION_CACHE_SIZE = int(os.environ.get('TOKEN_GENERATION_CACHE_SIZE') or 10000)
+    TOKEN_GENERATION_CACHE_TTL = int(os.environ.get('TOKEN_GENERATION_CACHE_TTL') or 30)
+    # Recently read users are cached per worker for USER_CACHE_TTL seconds and evicted when written.
+    # Each hit is checked against the row's version, so another worker's write is never missed.
+    # USER_CACHE_SHARED_PATH can name a SQLite file, e.g. on /dev/shm, which every worker on the
+    # node then shares as a second tier.
+    USER_CACHE_ENABLED = os.environ.get('USER_CACHE_DISABLED') is None
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 10000)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+    USER_CACHE_SHARED_PATH = os.environ.get('USER_CACHE_SHARED_PATH')
+    # Logins are rejected once an email or client IP has failed this many times within the window
+    # (seconds). Counters are per worker unless LOGIN_THROTTLE_STORE_PATH names a SQLite file, e.g.
+    # on /dev/shm, which every worker on the node then shares.
+    LOGIN_THROTTLE_ENABLED = os.environ.get('LOGIN_THROTTLE_DISABLED') is None
+    LOGIN_THROTTLE_WINDOW = int(os.environ.get('LOGIN_THROTTLE_WINDOW') or 900)
+    LOGIN_THROTTLE_MAX_PER_EMAIL = int(os.environ.get('LOGIN_THROTTLE_MAX_PER_EMAIL') or 5)
+    LOGIN_THROTTLE_MAX_PER_IP = int(os.environ.get('LOGIN_THROTTLE_MAX_PER_IP') or 100)
+    LOGIN_THROTTLE_STORE_PATH = os.environ.get('LOGIN_THROTTLE_STORE_PATH')
+    # Optional per worker cache of verified JWT claims, keyed by token digest. An entry lives until
+    # its token expires or for JWT_CLAIMS_CACHE_TTL seconds, whichever is sooner.
+    JWT_CLAIMS_CACHE_ENABLED = os.environ.get('JWT_CLAIMS_CACHE_ENABLED') is not None
+    JWT_CLAIMS_CACHE_SIZE = int(os.environ.get('JWT_CLAIMS_CACHE_SIZE') or 10000)
+    JWT_CLAIMS_CACHE_TTL = int(os.environ.get('JWT_CLAIMS_CACHE_TTL') or 300)
+    # Expired blacklist rows are deleted in batches of this size. The sweeper runs in the app every
+    # BLACKLIST_SWEEP_INTERVAL seconds when set; otherwise use the prune-blacklist command.
+    BLACKLIST_PRUNE_BATCH_SIZE = int(os.environ.get('BLACKLIST_PRUNE_BATCH_SIZE') or 1000)
+    BLACKLIST_SWEEP_INTERVAL = int(os.environ.get('BLACKLIST_SWEEP_INTERVAL') or 0)
+    BLACKLIST_PARTITION_DAYS_AHEAD = int(os.environ.get('BLACKLIST_PARTITION_DAYS_AHEAD') or 7)
+    # Password hashing runs in a pool of this many processes (0 hashes on the request thread). At
+    # most HASH_WORKERS + HASH_QUEUE_SIZE jobs are in flight; beyond that requests get a HTTP 503
+    # with a Retry-After of HASH_RETRY_AFTER seconds.
+    HASH_WORKERS = int(os.environ.get('HASH_WORKERS') or os.cpu_count() or 1)
+    HASH_QUEUE_SIZE = int(os.environ.get('HASH_QUEUE_SIZE') or 32)
+    HASH_RETRY_AFTER = int(os.environ.get('HASH_RETRY_AFTER') or 1)
+    # New passwords are hashed with PASSWORD_HASH_ALGORITHM: 'bcrypt' or 'argon2id'. The algorithm
+    # and costs are stored in each hash, so changing them rehashes a user's password at their next
+    # login. Use the calibrate-hash command to pick costs for the hardware.
+    PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM') or 'bcrypt'
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS') or 12)
+    ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST') or 3)
+    ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST') or 65536)  # KiB
+    ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM') or 4)
+    # The import-users command inserts this many users per transaction, hashing their passwords
+    # across HASH_WORKERS processes.
+    USER_IMPORT_BATCH_SIZE = int(os.environ.get('USER_IMPORT_BATCH_SIZE') or 1000)
 
 
 @dataclasses.dataclass(frozen=True)
@@ -68,6 +163,7 @@ class DevelopmentConfig(Config):
 class TestingConfig(Config):
     PROPAGATE_EXCEPTIONS = False
     TESTING = True
+    EMAIL_OUTBOX_INLINE = True
 
 
 @dataclasses.dataclass(frozen=True)
@@ -15,3 +15,5 @@ SEVEN_ITEMS = 7
 SPECIAL_CHARACTERS = r"""!@$%^&*()_-+={}[]|\,.></?~`"':;"""
 
 JSON_INDENT = 4
+
+TOKEN_DIGEST_SIZE = 32  # SHA-256
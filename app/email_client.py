@@ -2,75 +2,198 @@
 # pylint: disable=missing-function-docstring
 
 """
-Module for creating, formatting and sending email. Also intercepts emails in testing mode. These
-are instead written to a local file. In development mode, emails are sent to a local email server
-which can be found in the tools directory: email_server.py.
+Module for creating, formatting and sending email. Emails are not sent while the client waits but
+queued in the email outbox, in the same transaction as the change they are about, for the mail
+worker to compose and send over pooled SMTP connections. Links are signed as the email is composed,
+so their tokens last MAX_TOKEN_AGE from when the email is sent. Each email's subject and bodies are
+rendered once per template and locale, with a marker where the link goes, so composing an email
+only splices its link into the cached fragments. Also intercepts emails in testing mode. These are
+instead written to a local file. In development mode, emails are sent to a local email server which
+can be found in the tools directory: email_server.py.
 """
 
+import dataclasses
+import datetime
 import json
 import logging
 import os
 
 from flask import current_app, render_template, url_for
+from flask_babel import force_locale, get_locale
 from flask_mail import Message
 from itsdangerous import URLSafeTimedSerializer
+from markupsafe import escape
 
 from app.constants import FIRST, JSON_INDENT
 from app.i18n.base import (
     EMAIL_CONFIRM, PASSWORD_RESET, PLAINTEXT_EMAIL_CONFIRMATION_BODY, PLAINTEXT_PASSWORD_RESET_BODY,
 )
-from app.main import mail
+from app.main import db, mail, smtp_pool
+from app.main.model.email_outbox import EmailOutbox
 from tools.email_server import SECOND
 
-logger = logging.getLogger('api-skeleton')
-
-
-def send_confirmation_email(user_email):
-    logger.info(f"Sending confirmation email to: {user_email}")
-
-    attributes = dict(
-        base_url='users_email_confirm',
-        user_email=user_email,
-        salt=current_app.config['EMAIL_CONFIRMATION_SALT'],
-        template='email_confirmation',
-        plain_body=PLAINTEXT_EMAIL_CONFIRMATION_BODY,
-    )
-    html, plain = _compose_email(**attributes)
-    _send_email(EMAIL_CONFIRM, current_app.config['ADMIN'], [user_email], html, plain)
-
+# Rendered in place of the link, then split on. Escaping and formatting leave it unchanged.
+URL_MARKER = '\x00url\x00'
 
-def send_password_reset_email(user_email):
-    logger.info(f"Sending password reset email to: {user_email}")
+# Each email's template, subject and plain text body.
+EMAIL_TEMPLATES = (
+    ('email_confirmation', EMAIL_CONFIRM, PLAINTEXT_EMAIL_CONFIRMATION_BODY),
+    ('password_reset', PASSWORD_RESET, PLAINTEXT_PASSWORD_RESET_BODY),
+)
+# Each email's endpoint its link points at and the config key of the salt its token is signed with.
+EMAIL_LINKS = dict(
+    email_confirmation=('users_email_confirm', 'EMAIL_CONFIRMATION_SALT'),
+    password_reset=('auth_password_reset_confirm', 'PASSWORD_RESET_SALT'),
+)
 
-    attributes = dict(
-        base_url='auth_password_reset_confirm',
-        user_email=user_email,
-        salt=current_app.config['PASSWORD_RESET_SALT'],
-        template='password_reset',
-        plain_body=PLAINTEXT_PASSWORD_RESET_BODY,
-    )
-    html, plain = _compose_email(**attributes)
-    _send_email(PASSWORD_RESET, current_app.config['ADMIN'], [user_email], html, plain)
+logger = logging.getLogger('api-skeleton')
 
 
-def _compose_email(base_url, user_email, salt, template, plain_body):
+@dataclasses.dataclass(frozen=True)
+class EmailFragments:
+    """An email rendered for one locale, with its bodies split where the link goes."""
+    subject: str
+    html: tuple
+    plain: tuple
+
+
+def queue_confirmation_email(user_email):
+    """
+    Add a confirmation email to the session's outbox. It is sent once the session is committed.
+    :return: EmailOutbox row
+    """
+    logger.info(f"Queueing confirmation email to: {user_email}")
+    return _queue_email('email_confirmation', user_email)
+
+
+def queue_confirmation_emails(user_emails):
+    """
+    Add confirmation emails for many users to the outbox with one insert, in the session's
+    transaction, as for bulk imports and resends. They are written in the default locale.
+    :param user_emails: iterable of string email addresses
+    :return: list of the new rows' ids
+    """
+    now = datetime.datetime.utcnow()
+    rows = [
+        dict(kind='email_confirmation', recipient=user_email, locale=None, created_on=now,
+             attempts=0, next_attempt_at=now)
+        for user_email in user_emails
+    ]
+    logger.info(f"Queueing {len(rows)} confirmation email(s)")
+    if not rows:
+        return []
+    db.session.execute(EmailOutbox.__table__.insert(), rows)
+    # A bulk insert returns no ids. The rows are not yet committed, so no worker has claimed them
+    # and they are found by their next_attempt_at, on its index.
+    return [email_id for email_id, in db.session.query(EmailOutbox.id).filter(
+        EmailOutbox.next_attempt_at == now,
+        EmailOutbox.kind == 'email_confirmation',
+        EmailOutbox.recipient.in_([row['recipient'] for row in rows]),
+    )]
+
+
+def queue_password_reset_email(user_email):
+    """
+    Add a password reset email to the session's outbox. It is sent once the session is committed.
+    :return: EmailOutbox row
+    """
+    logger.info(f"Queueing password reset email to: {user_email}")
+    return _queue_email('password_reset', user_email)
+
+
+def compose_emails(emails):
+    """
+    Compose queued emails as they are about to be sent, each in the locale of the request which
+    queued it. One token serialiser signs all of their links.
+    :param emails: EmailOutbox rows
+    :return: list of dicts of send_email arguments, in the order of the rows
+    """
     timed_serialiser = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
+    templates = {template: (subject, plain) for template, subject, plain in EMAIL_TEMPLATES}
+    messages = []
+    # force_locale only takes effect within a request, which the mail worker does not have.
+    with current_app.test_request_context():
+        for email in emails:
+            base_url, salt = EMAIL_LINKS[email.kind]
+            subject, plain_body = templates[email.kind]
+            with force_locale(email.locale or current_app.config['BABEL_DEFAULT_LOCALE']):
+                subject, html, plain = _compose_email(
+                    base_url=base_url,
+                    user_email=email.recipient,
+                    salt=current_app.config[salt],
+                    template=email.kind,
+                    subject=subject,
+                    plain_body=plain_body,
+                    timed_serialiser=timed_serialiser,
+                )
+            messages.append(dict(
+                subject=subject,
+                sender=current_app.config['ADMIN'],
+                recipients=[email.recipient],
+                html_body=html,
+                plain_body=plain,
+            ))
+    return messages
+
+
+def precompile_email_templates(app):
+    """
+    Pass the Flask app at startup to compile its email templates and render their fragments for
+    every supported locale, so no request pays for it.
+    :param app: Flask application
+    """
+    with app.test_request_context():
+        for locale in app.config['LANGUAGES']:
+            with force_locale(locale):
+                for template, subject, plain_body in EMAIL_TEMPLATES:
+                    _fragments(template, subject, plain_body)
+
+
+def _compose_email(base_url, user_email, salt, template, subject, plain_body,
+                   timed_serialiser=None):
+    timed_serialiser = timed_serialiser or URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
     url = url_for(
         f'api.{base_url}',
         token=timed_serialiser.dumps(user_email, salt=salt),
         _external=True
     )
-    html = render_template(f'{template}.html', url=url)
-    plain = plain_body.format(url=url, email=current_app.config['ADMIN'])
-    return html, plain
-
-
-def _send_email(subject, sender, recipients, html_body, plain_body):
+    fragments = _fragments(template, subject, plain_body)
+    return fragments.subject, str(escape(url)).join(fragments.html), url.join(fragments.plain)
+
+
+def _fragments(template, subject, plain_body):
+    """
+    :return: EmailFragments of the template in the current locale, rendered on first use
+    """
+    cache = current_app.extensions.setdefault('email-fragments', dict())
+    key = template, str(get_locale())
+    fragments = cache.get(key)
+    if fragments is None:
+        html = render_template(f'{template}.html', url=URL_MARKER)
+        plain = str(plain_body).format(url=URL_MARKER, email=current_app.config['ADMIN'])
+        fragments = EmailFragments(
+            subject=str(subject),
+            html=tuple(html.split(URL_MARKER)),
+            plain=tuple(plain.split(URL_MARKER)),
+        )
+        cache[key] = fragments
+    return fragments
+
+
+def _queue_email(kind, recipient):
+    # The request's locale is kept for the worker, which has none of its own.
+    locale = get_locale()
+    email = EmailOutbox(kind=kind, recipient=recipient, locale=str(locale) if locale else None)
+    db.session.add(email)
+    return email
+
+
+def send_email(subject, sender, recipients, html_body, plain_body):
     testing = current_app.config['TESTING']
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.html = html_body
     msg.body = plain_body
-    mail.send(msg) if not testing else _intercept_test_mail(msg, recipients)
+    smtp_pool.send(msg) if not testing else _intercept_test_mail(msg, recipients)
 
 
 def _intercept_test_mail(msg, recipients):
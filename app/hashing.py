@@ -0,0 +1,310 @@
+# pylint: disable=logging-fstring-interpolation, missing-function-docstring
+
+"""
+Password hashing. Hashes are made by a pluggable backend, bcrypt or argon2id, which encodes its
+algorithm and cost parameters in the hash itself. Existing hashes can therefore always be verified,
+and ones made with another algorithm or out of date costs are detected so they can be rehashed.
+
+Hashing and verifying passwords is deliberately slow, so a burst of logins would otherwise tie up
+every request thread and starve cheap endpoints. Work is handed to a process pool sized to the
+cores, with a bounded number of jobs allowed in flight. When the pool is saturated, callers are
+turned away immediately with a HTTP 503 and a Retry-After header instead of queueing behind the
+burst.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+from app.i18n.base import HASHING_BUSY
+from app.metrics import metrics
+
+try:
+    import argon2
+except ImportError:  # argon2-cffi is only needed when argon2id hashing is configured.
+    argon2 = None
+
+logger = logging.getLogger('api-skeleton')
+
+CALIBRATION_PASSWORD = 'Calibrati0n-Passw0rd!'
+BCRYPT_MIN_ROUNDS = 4
+BCRYPT_MAX_ROUNDS = 31
+ARGON2_MAX_TIME_COST = 100
+
+
+class BcryptHasher:
+    """
+    bcrypt, configured with Flask-Bcrypt's settings. The cost is the log2 of the number of rounds,
+    e.g. $2b$12$... Passwords over bcrypt's 72 byte limit may be pre-hashed with SHA-256.
+    """
+
+    algorithm = 'bcrypt'
+    prefixes = ('$2a$', '$2b$', '$2y$')
+
+    def __init__(self, rounds, handle_long_passwords=False):
+        self.rounds = rounds
+        self.handle_long_passwords = handle_long_passwords
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            rounds=config.get('BCRYPT_LOG_ROUNDS'),
+            handle_long_passwords=config.get('BCRYPT_HANDLE_LONG_PASSWORDS', False),
+        )
+
+    def config(self):
+        return dict(BCRYPT_LOG_ROUNDS=self.rounds)
+
+    def identifies(self, password_hash):
+        return password_hash.startswith(self.prefixes)
+
+    def hash(self, password):
+        return bcrypt.hashpw(self._encode(password), bcrypt.gensalt(self.rounds)).decode('utf-8')
+
+    def verify(self, password_hash, password):
+        try:
+            return bcrypt.checkpw(self._encode(password), password_hash.encode('utf-8'))
+        except ValueError:
+            return False
+
+    def needs_rehash(self, password_hash):
+        if not self.identifies(password_hash):
+            return True
+        return int(password_hash.split('$')[2]) != self.rounds
+
+    def with_cost(self, cost):
+        return type(self)(cost, self.handle_long_passwords)
+
+    def _encode(self, password):
+        password = password.encode('utf-8')
+        if self.handle_long_passwords:
+            password = hashlib.sha256(password).hexdigest().encode('utf-8')
+        return password
+
+
+class Argon2Hasher:
+    """
+    argon2id via argon2-cffi. Memory cost is in KiB and time cost is the number of passes, e.g.
+    $argon2id$v=19$m=65536,t=3,p=4$...
+    """
+
+    algorithm = 'argon2id'
+    prefixes = ('$argon2id$',)
+
+    def __init__(self, time_cost, memory_cost, parallelism):
+        if argon2 is None:
+            raise ValueError('argon2id hashing needs the argon2-cffi package installed')
+        self.time_cost = time_cost
+        self.memory_cost = memory_cost
+        self.parallelism = parallelism
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            time_cost=config.get('ARGON2_TIME_COST'),
+            memory_cost=config.get('ARGON2_MEMORY_COST'),
+            parallelism=config.get('ARGON2_PARALLELISM'),
+        )
+
+    def config(self):
+        return dict(
+            ARGON2_TIME_COST=self.time_cost,
+            ARGON2_MEMORY_COST=self.memory_cost,
+            ARGON2_PARALLELISM=self.parallelism,
+        )
+
+    def identifies(self, password_hash):
+        return password_hash.startswith(self.prefixes)
+
+    def hash(self, password):
+        return self._hasher().hash(password)
+
+    def verify(self, password_hash, password):
+        try:
+            return self._hasher().verify(password_hash, password)
+        except (argon2.exceptions.VerificationError, argon2.exceptions.InvalidHashError):
+            return False
+
+    def needs_rehash(self, password_hash):
+        if not self.identifies(password_hash):
+            return True
+        return self._hasher().check_needs_rehash(password_hash)
+
+    def with_cost(self, cost):
+        return type(self)(cost, self.memory_cost, self.parallelism)
+
+    def _hasher(self):
+        # Built on use rather than held, so the backend stays picklable for the process pool.
+        return argon2.PasswordHasher(
+            time_cost=self.time_cost,
+            memory_cost=self.memory_cost,
+            parallelism=self.parallelism,
+            type=argon2.Type.ID,
+        )
+
+
+HASHERS = {hasher.algorithm: hasher for hasher in (BcryptHasher, Argon2Hasher)}
+COST_LIMITS = dict(
+    bcrypt=(BCRYPT_MIN_ROUNDS, BCRYPT_MAX_ROUNDS),
+    argon2id=(1, ARGON2_MAX_TIME_COST),
+)
+
+
+def make_hasher(config, algorithm=None):
+    """
+    Pass the app config and optionally an algorithm to get a configured hashing backend.
+    :raise: ValueError: if the algorithm is unknown or its package is not installed
+    """
+    algorithm = algorithm or config.get('PASSWORD_HASH_ALGORITHM')
+    if algorithm not in HASHERS:
+        raise ValueError(f'Unknown password hash algorithm: {algorithm}')
+    return HASHERS[algorithm].from_config(config)
+
+
+def calibrate(hasher, target_seconds):
+    """
+    Find the highest cost at which the backend hashes a password within the target time on this
+    machine. Cost is raised one step at a time: for bcrypt each step doubles the work and for
+    argon2id each step adds a pass over the memory. Memory and parallelism are left as configured.
+    :param hasher: backend from make_hasher
+    :param target_seconds: hashing time to aim for
+    :return: tuple of the calibrated backend and the time in seconds it took to hash
+    """
+    lowest, highest = COST_LIMITS[hasher.algorithm]
+    best, best_elapsed = None, None
+    for cost in range(lowest, highest + 1):
+        candidate = hasher.with_cost(cost)
+        elapsed = _time_hash(candidate)
+        if elapsed > target_seconds and best is not None:
+            break
+        best, best_elapsed = candidate, elapsed
+        if elapsed > target_seconds:
+            break  # Even the cheapest cost is over target: it is the best available.
+    return best, best_elapsed
+
+
+def _time_hash(hasher, samples=3):
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        hasher.hash(CALIBRATION_PASSWORD)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+class HashingExecutor:
+    """
+    Flask extension which owns the password hashing backends and the process pool they run in. New
+    hashes use the configured backend while existing hashes are verified by whichever backend made
+    them. The pool is created lazily in each process that uses it, so workers forked by an
+    application server each get their own. With zero workers configured, hashing runs inline on the
+    calling thread.
+    """
+
+    def __init__(self, app=None):
+        self.hasher = None
+        self.verifiers = []
+        self.workers = 0
+        self.queue_size = 0
+        self.retry_after = 1
+        self._slots = None
+        self._pool = None
+        self._pid = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.hasher = make_hasher(app.config)
+        # Other algorithms are kept to verify older hashes, if their packages are installed.
+        self.verifiers = [self.hasher]
+        for algorithm in HASHERS.keys() - {self.hasher.algorithm}:
+            try:
+                self.verifiers.append(make_hasher(app.config, algorithm))
+            except ValueError:
+                logger.info(f"Password hash algorithm unavailable for verifying: {algorithm}")
+        self.workers = app.config['HASH_WORKERS']
+        self.queue_size = app.config['HASH_QUEUE_SIZE']
+        self.retry_after = app.config['HASH_RETRY_AFTER']
+        self._slots = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+        self.shutdown()
+        app.extensions['hashing-executor'] = self
+        metrics.register('hashing', self.stats)
+
+    def hash_password(self, password):
+        return self.run(self.hasher.hash, password)
+
+    def check_password(self, password_hash, password):
+        verifier = next((each for each in self.verifiers if each.identifies(password_hash)), None)
+        if verifier is None:
+            logger.error("No password hash backend recognises a stored hash")
+            return False
+        return self.run(verifier.verify, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """
+        :return: True if the hash was made by another algorithm or with different costs than those
+        configured, so should be replaced the next time the password is known
+        """
+        return self.hasher.needs_rehash(password_hash)
+
+    def run(self, func, *args):
+        """
+        Pass a picklable function and its arguments to run them in the pool and wait for the result.
+        :param func: module level function or bound method of a picklable object
+        :return: the result of the function
+        :raise: werkzeug.ServiceUnavailable: if the pool has no free slot or has broken
+        """
+        if not self._slots.acquire(blocking=False):
+            metrics.increment('hashing_rejected')
+            logger.warning("Hashing pool saturated: rejecting request")
+            raise self._unavailable()
+
+        self._track(1)
+        try:
+            if not self.workers:
+                return func(*args)
+            return self._executor().submit(func, *args).result()
+        except BrokenProcessPool:
+            logger.critical("Hashing pool broken: recreating", exc_info=True)
+            self.shutdown()
+            raise self._unavailable() from None
+        finally:
+            self._track(-1)
+            self._slots.release()
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+            self._pid = None
+
+    def stats(self):
+        return dict(workers=self.workers, queue_size=self.queue_size, in_flight=self._in_flight)
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _track(self, delta):
+        with self._lock:
+            self._in_flight += delta
+            in_flight = self._in_flight
+        metrics.gauge('hashing_queue_depth', max(in_flight - max(self.workers, 1), 0))
+
+    def _unavailable(self):
+        error = ServiceUnavailable(HASHING_BUSY)
+        error.retry_after = self.retry_after
+        return error
@@ -15,8 +15,12 @@ ERROR = _('error')
 # 2xx
 LOGIN_SUCCESS = _('Successfully logged in')
 LOGOUT_SUCCESS = _('Successfully logged out')
+LOGOUT_ALL_SUCCESS = _('Successfully logged out of all sessions')
 USER_LIST_SUCCESS = _('Successfully listed user')
 USERS_LIST_SUCCESS = _('Successfully listed users')
+USERS_EXPORT_SUCCESS = _('Successfully exported users')
+USERS_LOOKUP_SUCCESS = _('Successfully looked up users')
+USERS_SEARCH_SUCCESS = _('Successfully searched users')
 USER_CREATE_SUCCESS = _('Successfully created user')
 EMAIL_CONFIRMED = _('Email confirmed')
 EMAIL_RESENT = _('Email confirmation resent')
@@ -26,21 +30,34 @@ PASSWORD_UPDATED = _('Your password has been updated')
 PASSWORD_RESET_REQUEST_SUCCESS = _('Successfully requested password reset')
 PASSWORD_RESET_SUCCESS = _('Successfully reset password')
 PASSWORD_CHANGE_SUCCESS = _('Successfully changed password')
+METRICS_SUCCESS = _('Successfully listed metrics')
+REFRESH_SUCCESS = _('Successfully refreshed tokens')
+
+# 3xx
+UNCHANGED = _('Not modified since the ETag given in If-None-Match')
 
 # Fail
 # 4xx
 MALFORMED = _('Request malformed')
+CURSOR_INVALID = _('Page cursor is invalid')
+FIELDS_INVALID = _('Requested fields are invalid')
+LOOKUP_TOO_LARGE = _('Too many public ids to look up at once')
+SEARCH_INVALID = _('Search query must not be blank')
 EMAIL_PASSWORD = _('Email and password do not match')
 EMAIL_NOT_CONFIRMED = _('Email address not confirmed')
 EMAIL_NOT_CONFIRMED_RESET = _('Email address must be confirmed before attempting a password reset')
 EMAIL_INVALID = _('Email address is invalid')
 EMAIL_ALREADY_EXISTS = _('Email address already exists')
 CANNOT_VIEW_OTHERS = _('Non-admin users can only view themselves')
+ADMIN_REQUIRED = _('Admin privileges required')
+LOGIN_THROTTLED = _('Too many failed logins: try again later')
 JWT_ERROR = _('JWT error')
 JWT_EXPIRED = _('JWT signature expired: log in again')
 JWT_INVALID = _('JWT invalid: log in again')
 JWT_BLACKLISTED = _('JWT blacklisted: log in again')
+JWT_REVOKED = _('JWT revoked: log in again')
 JWT_UNPROCESSABLE = _('JWT malformed')
+REFRESH_INVALID = _('Refresh token invalid or expired: log in again')
 JWT_REQUIRED = _('JWT token with admin privileges required to create admin')
 JWT_INSUFFICIENT = _('User has insufficient privilege to create to create admin')
 CONFIRMATION_FAILED = _('Email confirmation failed')
@@ -59,6 +76,10 @@ GETTING_USERS = _('Error getting all users')
 ENCODING_JWT = _('Error encoding JWT token')
 SAVING_TO_DATABASE = _('Error saving to database')
 TOKEN_BLACKLIST = _('Error getting token blacklist')
+GETTING_REFRESH_TOKEN = _('Error getting refresh token')
+GETTING_EMAILS = _('Error getting queued emails')
+HASHING_BUSY = _('Too many password requests in progress')
+UNAVAILABLE = _('Service busy: try again shortly')
 
 # Email
 EMAIL_CONFIRM = _('Confirm Your Email Address')
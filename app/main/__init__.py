@@ -1,38 +1,48 @@
-# pylint: disable=invalid-name, method-hidden
+# pylint: disable=invalid-name, method-hidden, import-outside-toplevel
 
 """
 Initialisation module for Flask. Creates a Flask application and initialises a number of extensions
-such as SQLAlchemy and Bcrypt. Defines a number functions which adjust certain Flask behaviours. For
+such as SQLAlchemy and Babel. Defines a number functions which adjust certain Flask behaviours. For
 example how to handle specific values when converting to JSON.
 """
 
 import datetime
+import uuid
 
-from flask import current_app, Flask, request
+from flask import current_app, Flask, has_request_context, request
 from flask._compat import text_type
 from flask.json import JSONEncoder as BaseEncoder
 from flask_babel import Babel
-from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_jwt_simple import JWTManager
 from flask_mail import Mail
 from flask_sqlalchemy import SQLAlchemy
 from speaklater import _LazyString
 
+from app.cache import BlacklistCache, ClaimsCache, TokenGenerationCache, UserCache
 from app.config import CONFIG_BY_NAME
+from app.hashing import HashingExecutor
 from app.logger import init_logging
+from app.smtp import SMTPPool
+from app.throttle import LoginThrottle
 
 db = SQLAlchemy()
 jwt = JWTManager()
-flask_bcrypt = Bcrypt()
 babel = Babel()
 mail = Mail()
+smtp_pool = SMTPPool()
+blacklist_cache = BlacklistCache()
+claims_cache = ClaimsCache()
+token_generations = TokenGenerationCache()
+user_cache = UserCache()
+hashing = HashingExecutor()
+login_throttle = LoginThrottle()
 
 
 def create_app(config_name):
     """
     Creates a Flask app based on the environment name passed to it. For example dev or prod.
-    Initialises a number of Flask extensions.
+    Initialises a number of Flask extensions and, if configured, the blacklist sweeper.
     :param config_name: string containing the config to load
     :return: initialised Flask application
     """
@@ -40,12 +50,25 @@ def create_app(config_name):
     app.config.from_object(CONFIG_BY_NAME[config_name])
     db.init_app(app)
     jwt.init_app(app)
-    flask_bcrypt.init_app(app)
+    hashing.init_app(app)
+    login_throttle.init_app(app)
     babel.init_app(app)
     app.json_encoder = JSONEncoder
     init_logging(config_name)
     mail.init_app(app)
+    smtp_pool.init_app(app)
+    blacklist_cache.init_app(app)
+    claims_cache.init_app(app)
+    token_generations.init_app(app)
+    user_cache.init_app(app)
     CORS(app)
+    # Imported here because the email client depends on the extensions initialised in this module.
+    from app.email_client import precompile_email_templates
+    precompile_email_templates(app)
+    if app.config['BLACKLIST_SWEEP_INTERVAL']:
+        # Imported here because the service depends on the extensions initialised in this module.
+        from app.main.service.blacklist import start_sweeper
+        start_sweeper(app)
     return app
 
 
@@ -54,23 +77,32 @@ def add_claims_to_access_token(identity):
     """
     Uses a decorator in Flask JWT Simple to override existing claims on a JWT token. This is
     necessary to update a user role from standard to admin. The process is not additive so all
-    values must be set again.
+    values must be set again. A unique 'jti' claim is added so no two tokens are ever identical,
+    even when issued to the same user in the same second. Access tokens issued for a login session
+    carry the session's id as a 'sid' claim so logging out can end the session. The user's token
+    generation is carried as a 'gen' claim: bumping the user's generation revokes all their tokens.
     https://flask-jwt-simple.readthedocs.io/en/latest/change_jwt_claims.html
-    :param identity: SQLAlchemy model representing a user object
+    :param identity: SQLAlchemy model representing a user object, or a tuple of it and a session id
     :return: dict with updated JWT claims
     """
+    user, session_id = identity if isinstance(identity, tuple) else (identity, None)
     roles = 'user'
-    if identity.admin:
+    if user.admin:
         roles = 'admin'
 
     now = datetime.datetime.utcnow()
-    return {
+    claims = {
         'exp': now + current_app.config['JWT_EXPIRES'],
         'iat': now,
         'nbf': now,
-        'sub': identity.public_id,
-        'roles': roles
+        'sub': user.public_id,
+        'roles': roles,
+        'jti': uuid.uuid4().hex,
+        'gen': user.token_generation or 0,
     }
+    if session_id is not None:
+        claims['sid'] = session_id
+    return claims
 
 
 @babel.localeselector
@@ -83,6 +115,8 @@ def get_locale():
     https://flask-babel.tkte.ch/#configuration
     :return: String of supported locale or None
     """
+    if not has_request_context():
+        return None  # Outside a request, such as in a command, the default locale is used.
     return request.accept_languages.best_match(current_app.config['LANGUAGES'])
 
 
@@ -6,24 +6,116 @@ Data Access Object helper functions to interact with the database.
 
 import logging
 
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from werkzeug.exceptions import InternalServerError
 
 from app.i18n.base import SAVING_TO_DATABASE
-from app.main import db
+from app.main import db, user_cache
 
 logger = logging.getLogger('api-skeleton')
 
 
 def save_changes(data):
     """
-    Pass in data to be saved to the database.
+    Pass in data to be saved to the database. Models which are cached, such as users, are evicted
+    from the cache once the change is committed.
     :param data: SQLAlchemy model representing data
     :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
     """
+    cache_keys = data.cache_keys() if hasattr(data, 'cache_keys') else []
     try:
         db.session.add(data)
         db.session.commit()
     except SQLAlchemyError as err:
         logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
         raise InternalServerError(SAVING_TO_DATABASE) from None
+    finally:
+        user_cache.evict(*cache_keys)
+
+
+def insert_unique(data, *columns):
+    """
+    Pass in data to be inserted as a new row, and the columns whose unique constraints mean the row
+    already exists. Duplicates are left to those constraints to reject, so there is no race between
+    a check and the insert. Postgres does it in one INSERT ... ON CONFLICT (first column) DO NOTHING
+    RETURNING statement; it takes one conflict target, so a clash on the others is an
+    IntegrityError as elsewhere. Anything else added to the session is committed with the row, or
+    discarded with it if it clashed.
+    :param data: SQLAlchemy model representing data
+    :param columns: strings naming the unique columns, at least one
+    :return: boolean of whether the row was inserted, False if it clashed on one of the columns
+    :raise: werkzeug.InternalServerError: if any other SQLAlchemyError is caught
+    """
+    table = data.__table__
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            values = {
+                column.columns[0]: getattr(data, column.key)
+                for column in inspect(data).mapper.column_attrs
+                if getattr(data, column.key) is not None  # Leave unset columns to their defaults.
+            }
+            statement = postgresql.insert(table).values(values).on_conflict_do_nothing(
+                index_elements=[table.columns[columns[0]]]
+            )
+            inserted = db.session.execute(statement.returning(*table.primary_key.columns)).first()
+            if inserted is None:
+                db.session.rollback()
+                return False
+            db.session.commit()
+            return True
+        db.session.add(data)
+        db.session.commit()
+        return True
+    except IntegrityError as err:
+        db.session.rollback()
+        if not _clashed_on(err, table, columns):
+            logger.critical(f"IntegrityError: {err}", exc_info=True)
+            raise InternalServerError(SAVING_TO_DATABASE) from None
+        logger.info(f"IntegrityError: {err.orig}")
+        return False
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(SAVING_TO_DATABASE) from None
+
+
+def _clashed_on(err, table, columns):
+    diag = getattr(err.orig, 'diag', None)
+    if diag is not None and diag.constraint_name:
+        # psycopg2 names the constraint, which Postgres names <table>_<column>_key by default.
+        return diag.constraint_name in {f'{table.name}_{column}_key' for column in columns}
+    # SQLite says "UNIQUE constraint failed: user.email", MySQL "... for key 'user.email'".
+    message = str(err.orig)
+    return any(f'{table.name}.{column}' in message or f"'{column}'" in message
+               for column in columns)
+
+
+def delete_in_batches(model, criterion, batch_size):
+    """
+    Delete the rows of a model matching a criterion in bounded batches, each committed in its own
+    transaction, so locks are held only briefly.
+    :param model: SQLAlchemy model class with an 'id' primary key
+    :param criterion: SQLAlchemy filter expression selecting the rows to delete
+    :param batch_size: int maximum rows deleted per transaction
+    :return: int number of rows deleted
+    :raise: SQLAlchemyError: for the caller to handle, after rolling back the current batch
+    """
+    deleted = 0
+    try:
+        while True:
+            batch = db.session.query(model.id).filter(criterion).limit(batch_size).all()
+            if not batch:
+                break
+            model.query.filter(model.id.in_([row_id for (row_id,) in batch])).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+            deleted += len(batch)
+            if len(batch) < batch_size:
+                break
+    except SQLAlchemyError:
+        db.session.rollback()
+        raise
+    return deleted
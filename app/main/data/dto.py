@@ -12,7 +12,7 @@ https://flask-restx.readthedocs.io/en/latest/swagger.html#the-api-marshal-with-d
 
 import dataclasses
 
-from flask_restx import Namespace, fields
+from flask_restx import Namespace, fields, inputs, reqparse
 
 USERNAME_EMAIL_MINIMUM_LENGTH = 6
 COMMON = dict(
@@ -50,6 +50,21 @@ class PasswordDto:
     password = api.model('password', dict(password=COMMON.get('password')))
 
 
+@dataclasses.dataclass(frozen=True)
+class RefreshDto:
+    api = Namespace('refresh', description='Refresh token object')
+    refresh = api.model(
+        'refresh',
+        dict(
+            refresh_token=fields.String(
+                required=True,
+                allow_null=False,
+                description='Refresh token returned at login or by the last refresh'
+            ),
+        )
+    )
+
+
 @dataclasses.dataclass(frozen=True)
 class AuthDto:
     api = Namespace('auth', description='Authentication related operations')
@@ -62,6 +77,49 @@ class UserDto:
     api = Namespace('users', description='User related operations')
     user = AuthDto.auth.inherit('user', USERNAME)
     api.add_model('user', user)
+    lookup = api.model(
+        'lookup',
+        dict(
+            public_ids=fields.List(
+                fields.String,
+                required=True,
+                min_items=1,
+                description='Public ids of the users to look up'
+            ),
+        )
+    )
+    projection = reqparse.RequestParser()
+    projection.add_argument(
+        'fields', type=str, location='args',
+        help='Comma separated fields to return: username, public_id, email, registered_on and '
+             'email_confirmed. Defaults to username, public_id and email'
+    )
+    page = projection.copy()
+    page.add_argument(
+        'limit', type=inputs.positive, location='args', help='Maximum users in the page'
+    )
+    page.add_argument(
+        'cursor', type=str, location='args', help='Cursor returned as next with the previous page'
+    )
+    search = page.copy()
+    search.add_argument(
+        'q', type=str, required=True, location='args',
+        help='Start of the usernames or emails to match, ignoring case'
+    )
+    export = reqparse.RequestParser()
+    export.add_argument(
+        'format', choices=('ndjson', 'csv'), default='ndjson', location='args',
+        help='ndjson or csv'
+    )
+    export.add_argument(
+        'since', type=inputs.datetime_from_iso8601, location='args',
+        help='Only export users registered at or after this ISO 8601 time, UTC unless given'
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class MetricsDto:
+    api = Namespace('metrics', description='Operational metrics of this worker')
 
 
 @dataclasses.dataclass(frozen=True)
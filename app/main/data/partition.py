@@ -0,0 +1,106 @@
+# pylint: disable=logging-fstring-interpolation
+
+"""
+Helper functions for managing Postgres tables which are range partitioned by day on a timestamp
+column. Partitions are named '<table>_pYYYYMMDD' and hold one day each, so once a day has passed the
+whole partition can be dropped instead of deleting its rows one at a time. Other databases have no
+partitions and these helpers do nothing for them.
+"""
+
+import datetime
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.main import db
+
+PARTITION_DATE_FORMAT = '%Y%m%d'
+ONE_DAY = datetime.timedelta(days=1)
+
+logger = logging.getLogger('api-skeleton')
+
+
+def is_partitioned(table_name):
+    """
+    Pass a table name to find out if it is a partitioned Postgres table.
+    :param table_name: string of the parent table name
+    :return: boolean of partitioned state
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    query = text(
+        'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+        'WHERE c.relname = :table_name'
+    )
+    return db.session.execute(query, dict(table_name=table_name)).first() is not None
+
+
+def list_partitions(table_name):
+    """
+    Pass a partitioned table name to get its daily partitions.
+    :param table_name: string of the parent table name
+    :return: dict of partition name to the date it holds, ignoring the default partition
+    """
+    query = text(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :table_name'
+    )
+    partitions = dict()
+    prefix = f'{table_name}_p'
+    for (name,) in db.session.execute(query, dict(table_name=table_name)):
+        if name.startswith(prefix):
+            day = datetime.datetime.strptime(name[len(prefix):], PARTITION_DATE_FORMAT).date()
+            partitions[name] = day
+    return partitions
+
+
+def ensure_partitions(table_name, start, days):
+    """
+    Create any missing daily partitions from the start date onwards. A day whose rows have already
+    landed in the default partition cannot be given its own partition; it is skipped and those rows
+    are left for batched deletes.
+    :param table_name: string of the parent table name
+    :param start: date of the first partition
+    :param days: int number of daily partitions to have from the start date
+    :return: int number of partitions created
+    """
+    existing = set(list_partitions(table_name).values())
+    created = 0
+    for offset in range(days):
+        day = start + offset * ONE_DAY
+        if day in existing:
+            continue
+        name = f'{table_name}_p{day.strftime(PARTITION_DATE_FORMAT)}'
+        statement = text(
+            f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table_name} '
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{(day + ONE_DAY).isoformat()}')"
+        )
+        savepoint = db.session.begin_nested()
+        try:
+            db.session.execute(statement)
+            savepoint.commit()
+            created += 1
+        except SQLAlchemyError as err:
+            savepoint.rollback()
+            logger.warning(f"Could not create partition {name}: {err}")
+    db.session.commit()
+    return created
+
+
+def drop_partitions_before(table_name, before):
+    """
+    Drop every daily partition which only holds rows earlier than the passed time.
+    :param table_name: string of the parent table name
+    :param before: datetime before which rows are no longer needed
+    :return: int number of partitions dropped
+    """
+    dropped = 0
+    for name, day in list_partitions(table_name).items():
+        if datetime.datetime.combine(day + ONE_DAY, datetime.time()) <= before:
+            db.session.execute(text(f'DROP TABLE IF EXISTS {name}'))
+            dropped += 1
+    db.session.commit()
+    if dropped:
+        logger.info(f"Dropped {dropped} expired partition(s) of {table_name}")
+    return dropped
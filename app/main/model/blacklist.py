@@ -3,18 +3,24 @@
 """
 Creates a SQLAlchemy model for blacklisting JWT tokens and checking if tokens are blacklisted.
 Initialising the object with a JWT will blacklist it. For example, when a user logs out, their token
-is blacklisted. A method is provided to check if a passed token is blacklisted.
+is blacklisted. A method is provided to check if a passed token is blacklisted. Tokens are stored
+and compared as a fixed width SHA-256 digest rather than in full. Lookups go through the per worker
+blacklist cache first so most requests never reach the database. Each row records when its token
+expires, after which the row is useless and can be pruned.
 """
 
 import dataclasses
 import datetime
 import logging
 
+from flask import current_app
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.exceptions import InternalServerError
 
+from app.constants import TOKEN_DIGEST_SIZE
 from app.i18n.base import TOKEN_BLACKLIST
-from app.main import db
+from app.main import blacklist_cache, db
+from app.security import digest_token
 
 logger = logging.getLogger('api-skeleton')
 
@@ -22,32 +28,56 @@ logger = logging.getLogger('api-skeleton')
 @dataclasses.dataclass
 class BlacklistToken(db.Model):
     """
-    Pass a JWT to initialise an object and the token will be added to the blacklist_tokens database
-    table.
+    Pass a JWT, and optionally when it expires, to initialise an object and the digest of the token
+    will be added to the blacklist_tokens database table. Without an expiry, the longest lifetime a
+    JWT can have is assumed.
     """
     __tablename__ = 'blacklist_tokens'
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    token = db.Column(db.String(500), unique=True, nullable=False)
+    token_digest = db.Column(db.LargeBinary(TOKEN_DIGEST_SIZE), unique=True, nullable=False)
     blacklisted_on = db.Column(db.DateTime, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
 
-    def __init__(self, token):
-        self.token = token
+    def __init__(self, token, expires_at=None):
+        self.token_digest = digest_token(token)
         self.blacklisted_on = datetime.datetime.utcnow()
+        self.expires_at = expires_at or self.blacklisted_on + current_app.config['JWT_EXPIRES']
 
     @classmethod
     def check_blacklist(cls, auth_token):
         """
         Pass a JWT to check if it has been blacklisted i.e. is it in the blacklist_tokens database
-        table.
+        table. The blacklist cache answers first and the database is only queried when the cache's
+        Bloom filter reports a possible match.
         :param auth_token: string containing a JWT token
         :return: boolean of blacklist state
         :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
         """
+        digest = digest_token(auth_token)
         try:
-            blacklisted = BlacklistToken.query.filter_by(token=str(auth_token)).first()
+            blacklist_cache.sync(cls.blacklisted_since)
+            cached = blacklist_cache.get(digest)
+            if cached is not None:
+                return cached
+            blacklisted = BlacklistToken.query.filter_by(token_digest=digest).first()
         except SQLAlchemyError as err:
             logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
             raise InternalServerError(TOKEN_BLACKLIST) from None
         else:
+            if blacklisted:
+                blacklist_cache.add(digest)
             return bool(blacklisted)
+
+    @classmethod
+    def blacklisted_since(cls, since=None):
+        """
+        Pass a datetime to get the tokens blacklisted from then onwards, or None to get all of them.
+        Used by the blacklist cache to keep its Bloom filter up to date.
+        :param since: datetime or None
+        :return: list of (token_digest, blacklisted_on) tuples
+        """
+        query = db.session.query(cls.token_digest, cls.blacklisted_on)
+        if since is not None:
+            query = query.filter(cls.blacklisted_on >= since)
+        return query.all()
@@ -0,0 +1,42 @@
+# pylint: disable=invalid-name
+
+"""
+Creates a SQLAlchemy model for the email outbox. Emails are written here, as their kind, recipient
+and locale, in the same transaction as the change they are about, then rendered and sent by the mail
+worker. Any link's token is signed as the email is sent, so a delayed or retried email does not
+carry one which has already expired. A row is pending while it has a next_attempt_at: it is cleared
+once the email is sent or given up on, which is recorded in sent_on or abandoned_on.
+"""
+
+import dataclasses
+import datetime
+
+from app.main import db
+
+
+@dataclasses.dataclass
+class EmailOutbox(db.Model):
+    """
+    Pass the kind of email, such as 'email_confirmation', its recipient and the locale it is to be
+    written in to initialise an object. It is due to be sent straight away.
+    """
+    __tablename__ = 'email_outbox'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(32), nullable=False)
+    recipient = db.Column(db.String(255), nullable=False)
+    locale = db.Column(db.String(16), nullable=True)
+    created_on = db.Column(db.DateTime, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    next_attempt_at = db.Column(db.DateTime, nullable=True, index=True)
+    sent_on = db.Column(db.DateTime, nullable=True)
+    abandoned_on = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    def __init__(self, kind, recipient, locale=None):
+        self.kind = kind
+        self.recipient = recipient
+        self.locale = locale
+        self.created_on = datetime.datetime.utcnow()
+        self.attempts = 0
+        self.next_attempt_at = self.created_on
@@ -0,0 +1,60 @@
+# pylint: disable=invalid-name
+
+"""
+Creates a SQLAlchemy model for refresh tokens. A refresh token is a long lived, opaque secret given
+to a user at login which can be exchanged for a new short lived access JWT. Only a fixed width
+SHA-256 digest of each token is stored. Each row is a login session: access JWTs carry its id as
+their 'sid' claim. Revoking the row ends the session, as no further access tokens can be refreshed
+from it. The digests of the tokens a session has rotated away from are kept, so presenting one again
+is recognised as reuse, for example of a stolen token.
+"""
+
+import dataclasses
+import datetime
+
+from app.constants import TOKEN_DIGEST_SIZE
+from app.main import db
+from app.security import digest_token
+
+
+@dataclasses.dataclass
+class RefreshToken(db.Model):
+    """
+    Pass a refresh token, the id of the user it belongs to and when it expires to initialise an
+    object. The digest of the token is stored rather than the token.
+    """
+    __tablename__ = 'refresh_tokens'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    token_digest = db.Column(db.LargeBinary(TOKEN_DIGEST_SIZE), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_on = db.Column(db.DateTime, nullable=True)
+
+    def __init__(self, token, user_id, expires_at):
+        self.token_digest = digest_token(token)
+        self.user_id = user_id
+        self.expires_at = expires_at
+
+    @property
+    def is_active(self):
+        return self.revoked_on is None and self.expires_at > datetime.datetime.utcnow()
+
+
+@dataclasses.dataclass
+class RotatedRefreshToken(db.Model):
+    """
+    Pass the digest of a refresh token which has just been rotated and the id of its session to
+    initialise an object.
+    """
+    __tablename__ = 'rotated_refresh_tokens'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    token_digest = db.Column(db.LargeBinary(TOKEN_DIGEST_SIZE), unique=True, nullable=False)
+    session_id = db.Column(
+        db.Integer, db.ForeignKey('refresh_tokens.id'), nullable=False, index=True
+    )
+
+    def __init__(self, token_digest, session_id):
+        self.token_digest = token_digest
+        self.session_id = session_id
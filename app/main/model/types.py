@@ -0,0 +1,46 @@
+"""
+Column types shared by the SQLAlchemy models.
+"""
+
+import uuid
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+UUID_BYTES = 16
+
+
+class GUID(TypeDecorator):
+    """
+    Stores a UUID compactly: as a native UUID on Postgres and as 16 bytes elsewhere, rather than as
+    its 36 character text. Values are still given and returned as the usual hyphenated strings, so
+    nothing outside the database sees the change. Pass values through parse_guid first when they
+    come from a client, as one which is not a UUID cannot be bound.
+    """
+    impl = LargeBinary(UUID_BYTES)
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
+        return dialect.type_descriptor(LargeBinary(UUID_BYTES))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        value = value if isinstance(value, uuid.UUID) else uuid.UUID(value)
+        return value if dialect.name == 'postgresql' else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return str(value if isinstance(value, uuid.UUID) else uuid.UUID(bytes=bytes(value)))
+
+
+def parse_guid(value):
+    """
+    :return: the canonical string form of the value if it is a UUID, else None
+    """
+    try:
+        return str(uuid.UUID(value))
+    except (AttributeError, TypeError, ValueError):
+        return None
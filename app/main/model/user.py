@@ -1,17 +1,26 @@
 # pylint: disable=logging-fstring-interpolation, missing-class-docstring, missing-function-docstring
 
 """
-Class which defines a SQLAlchemy user object.
+Class which defines a SQLAlchemy user object. Password hashing and checking run in the hashing
+process pool rather than on the request thread, using the configured hashing backend. Users looked
+up by public id or email are read through the user cache. A cached user is only used while its
+version is still the row's, so a change made by another worker is seen straight away.
 """
 
+import datetime
 import logging
 
 from flask_jwt_simple import get_jwt
+from sqlalchemy import event, inspect, or_
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import make_transient_to_detached, undefer
 from werkzeug.exceptions import InternalServerError, Unauthorized
 
 from app.i18n.base import FINDING_USER, JWT_INSUFFICIENT, JWT_REQUIRED
-from app.main import db, flask_bcrypt
+from app.main import db, hashing, user_cache
+from app.main.model.types import GUID
+
+CACHE_KEYS = ('public_id', 'email')
 
 logger = logging.getLogger('api-skeleton')
 
@@ -23,12 +32,20 @@ class User(db.Model):
     email = db.Column(db.String(255), unique=True, nullable=False)
     registered_on = db.Column(db.DateTime, nullable=False)
     admin = db.Column(db.Boolean, nullable=False, default=False)
-    public_id = db.Column(db.String(100), unique=True)
+    public_id = db.Column(GUID(), unique=True)
     username = db.Column(db.String(50), unique=True)
-    password_hash = db.Column(db.String(100))
+    # Only needed to check a password, so not loaded with the rest of the row unless asked for.
+    password_hash = db.deferred(db.Column(db.String(255)))
     email_confirmation_sent_on = db.Column(db.DateTime, nullable=True)
     email_confirmed = db.Column(db.Boolean, nullable=True, default=False)
     email_confirmed_on = db.Column(db.DateTime, nullable=True)
+    token_generation = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Bumped by every update of the row, so it identifies the row's current state for ETags.
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    # Once a user exists one always will, unless the table is dropped or truncated, so each worker
+    # stops asking once it has seen one.
+    users_seen = False
 
     @property
     def password(self):
@@ -36,22 +53,104 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = flask_bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = hashing.hash_password(password)
 
     def check_password(self, password):
-        return flask_bcrypt.check_password_hash(self.password_hash, password)
+        return hashing.check_password(self.password_hash, password)
 
-    def find_user(self, filter_by):
+    def password_needs_rehash(self):
+        return hashing.needs_rehash(self.password_hash)
+
+    def find_user(self, filter_by, with_password=False):
+        query = self.query.options(undefer('password_hash')) if with_password else self.query
         try:
-            user = self.query.filter_by(**filter_by).first()
+            if not with_password and len(filter_by) == 1 and set(filter_by) <= set(CACHE_KEYS):
+                user = self.lookup(**filter_by)
+            else:
+                user = query.filter_by(**filter_by).first()
         except SQLAlchemyError as err:
             logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
             raise InternalServerError(f"{FINDING_USER}: {filter_by}") from None
         return user
 
+    @classmethod
+    def lookup(cls, **filter_by):
+        """
+        Pass a public_id or email to get the user from the cache, attached to the current session,
+        or else from the database, caching it. A cached user costs only a query of its row's
+        version by primary key. If the version has moved on, as after a write by another worker,
+        which only evicts that worker's entries, the user is reloaded. So checks of flags such as
+        admin and email_confirmed never see stale values.
+        :return: User or None
+        :raise: SQLAlchemyError: for the caller to handle
+        """
+        (column, value), = filter_by.items()
+        values = user_cache.get(f'{column}:{value}')
+        # An email entry whose user has since changed email is stale, so is ignored.
+        if values is not None and values.get(column) == value and cls._current(values):
+            return cls._from_cache(values)
+        user = cls.query.filter_by(**filter_by).first()
+        if user is not None:
+            values = user.cache_values()
+            for key in CACHE_KEYS:
+                user_cache.set(f'{key}:{values[key]}', values)
+        return user
+
+    def cache_keys(self):
+        """
+        :return: list of the user's cache keys, including for any email it is being changed from
+        """
+        emails = {self.email, *inspect(self).attrs.email.history.deleted} - {None}
+        return [f'public_id:{self.public_id}', *(f'email:{email}' for email in emails)]
+
+    def cache_values(self):
+        return {
+            column.key: _jsonable(getattr(self, column.key))
+            for column in inspect(User).column_attrs if column.key != 'password_hash'
+        }
+
+    @classmethod
+    def _current(cls, values):
+        version = db.session.query(cls.version).filter(cls.id == values['id']).scalar()
+        return version == values['version']
+
+    @classmethod
+    def _from_cache(cls, values):
+        user = cls(**{key: _from_jsonable(key, value) for key, value in values.items()})
+        # Treat it as though just loaded: the password hash, left out of the cache, loads on use.
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    @classmethod
+    def users_exist(cls):
+        if not cls.users_seen:
+            try:
+                cls.users_seen = db.session.query(cls.query.exists()).scalar()
+            except SQLAlchemyError as err:
+                logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+                raise InternalServerError(FINDING_USER) from None
+        return cls.users_seen
+
+    @classmethod
+    def taken(cls, email, username):
+        """
+        Pass an email and username to check whether either belongs to an existing user, with one
+        EXISTS on their unique indexes, before the cost of hashing a new user's password.
+        :param email: string email
+        :param username: string username
+        :return: boolean of whether the email or username is taken
+        :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+        """
+        try:
+            return db.session.query(
+                cls.query.filter(or_(cls.email == email, cls.username == username)).exists()
+            ).scalar()
+        except SQLAlchemyError as err:
+            logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+            raise InternalServerError(FINDING_USER) from None
+
     def should_create_admin(self, data):
-        users_exist = self.query.all()
-        if not users_exist:
+        if not self.users_exist():
             should_create = True  # First user becomes Admin by default
         else:
             should_create = data.get('admin', False)
@@ -62,3 +161,34 @@ class User(db.Model):
                 if jwt_data.get('roles') != 'admin':
                     raise Unauthorized(JWT_INSUFFICIENT)
         return should_create
+
+
+# Case-insensitive prefix searches match on these. Postgres also has trigram indexes on the same
+# expressions, see the add user search indexes migration.
+db.Index('ix_user_username_lower', db.func.lower(User.username))
+db.Index('ix_user_email_lower', db.func.lower(User.email))
+
+DATETIME_COLUMNS = {
+    column.key for column in inspect(User).column_attrs
+    if isinstance(column.columns[0].type, db.DateTime)
+}
+
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def _from_jsonable(key, value):
+    return datetime.datetime.fromisoformat(value) if value and key in DATETIME_COLUMNS else value
+
+
+@event.listens_for(User, 'before_update')
+def bump_version(_mapper, _connection, target):
+    # Incremented in SQL so concurrent updates each count.
+    target.version = User.version + 1
+
+
+@event.listens_for(User.__table__, 'after_drop')
+def forget_users(*_args, **_kwargs):
+    User.users_seen = False
+    user_cache.clear()
@@ -11,19 +11,18 @@ import logging
 
 from flask import request
 from flask._compat import text_type as _
-from flask_jwt_simple import jwt_required
 from flask_restx import Resource
 
-from app.constants import SECOND
 from app.i18n.base import (
-    EMAIL_PASSWORD, JWT_ERROR,
-    JWT_UNPROCESSABLE, LOGIN_SUCCESS, LOGOUT_SUCCESS, MALFORMED, PASSWORD_CHANGE_SUCCESS,
-    PASSWORD_RESET_REQUEST_SUCCESS, PASSWORD_RESET_SUCCESS, PASSWORD_UPDATE_FAILED, RESET_FAILED,
+    EMAIL_PASSWORD, JWT_ERROR, JWT_UNPROCESSABLE, LOGIN_SUCCESS, LOGIN_THROTTLED,
+    LOGOUT_ALL_SUCCESS, LOGOUT_SUCCESS, MALFORMED, PASSWORD_CHANGE_SUCCESS,
+    PASSWORD_RESET_REQUEST_SUCCESS, PASSWORD_RESET_SUCCESS, PASSWORD_UPDATE_FAILED, REFRESH_INVALID,
+    REFRESH_SUCCESS, RESET_FAILED,
 )
-from app.main.data.dto import AuthDto, EmailDto, PasswordDto, ResponseDto
-from app.main.service.auth import Auth, jwt_valid
+from app.main.data.dto import AuthDto, EmailDto, PasswordDto, RefreshDto, ResponseDto
+from app.main.service.auth import Auth, jwt_authenticated
 from app.responses import (
-    BAD_REQUEST, INTERNAL_SERVER_ERROR, UNAUTHORIZED, UNKNOWN,
+    BAD_REQUEST, INTERNAL_SERVER_ERROR, TOO_MANY_REQUESTS, UNAUTHORIZED, UNKNOWN,
     UNPROCESSABLE_ENTITY,
 )
 from app.security import remove
@@ -33,6 +32,7 @@ api = AuthDto.api
 auth = AuthDto.auth
 email = EmailDto.email
 password = PasswordDto.password
+refresh = RefreshDto.refresh
 response = ResponseDto.response
 
 
@@ -42,6 +42,7 @@ class UserLogin(Resource):
 
     @api.doc('/auth/login')
     @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
+    @api.response(TOO_MANY_REQUESTS, _(LOGIN_THROTTLED))
     @api.response(UNAUTHORIZED, _(EMAIL_PASSWORD))
     @api.response(BAD_REQUEST, _(MALFORMED))
     @api.expect(auth)
@@ -52,12 +53,27 @@ class UserLogin(Resource):
         return Auth.login_user(request.json)
 
 
+@api.route('/refresh')
+class TokenRefresh(Resource):
+    """Token Refresh Resource"""
+
+    @api.doc('/auth/refresh')
+    @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
+    @api.response(UNAUTHORIZED, _(REFRESH_INVALID))
+    @api.response(BAD_REQUEST, _(MALFORMED))
+    @api.expect(refresh)
+    @api.marshal_with(response, description=_(REFRESH_SUCCESS), skip_none=True)
+    def post(self):
+        """Exchange a refresh token for a new auth token and refresh token"""
+        logger.info("Refreshing tokens")
+        return Auth.refresh_tokens(request.json.get('refresh_token'))
+
+
 @api.route('/logout')
 class UserLogout(Resource):
     """User Logout Resource"""
 
-    @jwt_required
-    @jwt_valid
+    @jwt_authenticated
     @api.doc('/auth/logout')
     @api.doc(security='bearer')
     @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
@@ -75,8 +91,24 @@ class UserLogout(Resource):
         # Upon error, 'message' is returned correctly and 'data' is not returned.
         # Status is ever present.
         logger.info("Logging out user")
-        auth_token = request.headers.get('Authorization').split('Bearer ')[SECOND]
-        return Auth.logout_user(auth_token)
+        return Auth.logout_user()
+
+
+@api.route('/logout/all')
+class UserLogoutAll(Resource):
+    """User Logout Everywhere Resource"""
+
+    @jwt_authenticated
+    @api.doc('/auth/logout/all')
+    @api.doc(security='bearer')
+    @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
+    @api.response(UNPROCESSABLE_ENTITY, _(JWT_UNPROCESSABLE))
+    @api.response(UNAUTHORIZED, _(JWT_ERROR))
+    @api.marshal_with(response, description=_(LOGOUT_ALL_SUCCESS), mask='status,data')
+    def post(self):
+        """Log the user out of every session by revoking all their tokens"""
+        logger.info("Logging out user everywhere")
+        return Auth.logout_all()
 
 
 @api.route('/password/reset/request')
@@ -115,8 +147,7 @@ class PasswordResetConfirm(Resource):
 class PasswordChange(Resource):
     """Password Change Resource"""
 
-    @jwt_required
-    @jwt_valid
+    @jwt_authenticated
     @api.doc('/auth/password/change')
     @api.doc(security='bearer')
     @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
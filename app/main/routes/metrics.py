@@ -0,0 +1,41 @@
+# pylint: disable=invalid-name, no-self-use
+
+"""
+Flask API routes for reading operational metrics such as login latency, hashing queue depth and
+cache hit ratios. As a Flask-RESTX application, a number of decorators are used. For example, to
+document and enforce data marshalling. Only admin users may read metrics.
+"""
+
+import logging
+
+from flask._compat import text_type as _
+from flask_restx import Resource
+
+from app.i18n.base import (
+    ADMIN_REQUIRED, JWT_ERROR, JWT_UNPROCESSABLE, METRICS_SUCCESS,
+)
+from app.main.data.dto import MetricsDto, ResponseDto
+from app.main.service.auth import jwt_authenticated
+from app.main.service.metrics import get_metrics
+from app.responses import INTERNAL_SERVER_ERROR, UNAUTHORIZED, UNKNOWN, UNPROCESSABLE_ENTITY
+
+logger = logging.getLogger('api-skeleton')
+api = MetricsDto.api
+response = ResponseDto.response
+
+
+@api.route('')
+class Metrics(Resource):
+    """Metrics Resource"""
+
+    @jwt_authenticated
+    @api.doc('/metrics')
+    @api.doc(security='bearer')
+    @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
+    @api.response(UNPROCESSABLE_ENTITY, _(JWT_UNPROCESSABLE))
+    @api.response(UNAUTHORIZED, f'{_(JWT_ERROR)} / {_(ADMIN_REQUIRED)}')
+    @api.marshal_with(response, description=_(METRICS_SUCCESS), skip_none=True)
+    def get(self):
+        """List this worker's metrics"""
+        logger.info("Getting metrics")
+        return get_metrics()
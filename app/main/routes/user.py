@@ -11,30 +11,37 @@ import logging
 
 from flask import request
 from flask._compat import text_type as _
-from flask_jwt_simple import jwt_optional, jwt_required
+from flask_jwt_simple import jwt_optional
 from flask_restx import Resource
 from werkzeug.exceptions import NotFound
 
 from app.i18n.base import (
-    ACCOUNT_ALREADY_CONFIRMED, CONFIRMATION_FAILED, EMAIL_ALREADY_EXISTS, EMAIL_CONFIRMED,
-    EMAIL_RESENT, EMAIL_UPDATED, JWT_ERROR, JWT_INSUFFICIENT, JWT_UNPROCESSABLE, MALFORMED,
-    USER_CREATE_SUCCESS, USER_EXISTS, USER_LIST_SUCCESS, USER_NOT_FOUND, USERS_LIST_SUCCESS,
+    ACCOUNT_ALREADY_CONFIRMED, ADMIN_REQUIRED, CANNOT_VIEW_OTHERS, CONFIRMATION_FAILED,
+    CURSOR_INVALID, EMAIL_ALREADY_EXISTS, EMAIL_CONFIRMED, EMAIL_RESENT, EMAIL_UPDATED,
+    FIELDS_INVALID, JWT_ERROR, JWT_INSUFFICIENT, JWT_UNPROCESSABLE, LOOKUP_TOO_LARGE, MALFORMED,
+    SEARCH_INVALID, UNCHANGED, USER_CREATE_SUCCESS, USER_EXISTS, USER_LIST_SUCCESS, USER_NOT_FOUND,
+    USERS_EXPORT_SUCCESS, USERS_LIST_SUCCESS, USERS_LOOKUP_SUCCESS, USERS_SEARCH_SUCCESS,
 )
 from app.main.data.dto import EmailDto, ResponseDto, UserDto
-from app.main.service.auth import jwt_valid
+from app.main.service.auth import jwt_authenticated
 from app.main.service.user import (
-    confirm_email, get_all_users, get_user_by_id, resend_confirmation_email, save_new_user,
-    update_email,
+    confirm_email, export_users, get_all_users, get_user_by_id, lookup_users,
+    resend_confirmation_email, save_new_user, search_users, update_email,
 )
 from app.responses import (
-    BAD_REQUEST, CONFLICT, INTERNAL_SERVER_ERROR, NOT_FOUND, UNAUTHORIZED, UNKNOWN,
-    UNPROCESSABLE_ENTITY,
+    BAD_REQUEST, CONFLICT, INTERNAL_SERVER_ERROR, NOT_FOUND, NOT_MODIFIED, OK, UNAUTHORIZED,
+    UNKNOWN, UNPROCESSABLE_ENTITY, conditional,
 )
 from app.security import remove
 
 logger = logging.getLogger('api-skeleton')
 api = UserDto.api
 user = UserDto.user
+page = UserDto.page
+projection = UserDto.projection
+export = UserDto.export
+lookup = UserDto.lookup
+search = UserDto.search
 email = EmailDto.email
 response = ResponseDto.response
 
@@ -43,18 +50,24 @@ response = ResponseDto.response
 class UserList(Resource):
     """Users Resource"""
 
-    @jwt_required
-    @jwt_valid
+    @jwt_authenticated
+    @conditional
     @api.doc('/users')
     @api.doc(security='bearer')
+    @api.expect(page)
+    @api.response(NOT_MODIFIED, _(UNCHANGED))
     @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
     @api.response(UNPROCESSABLE_ENTITY, _(JWT_UNPROCESSABLE))
     @api.response(UNAUTHORIZED, _(JWT_ERROR))
+    @api.response(BAD_REQUEST, _(CURSOR_INVALID))
     @api.marshal_with(response, description=_(USERS_LIST_SUCCESS), skip_none=True)
     def get(self):
-        """List all users"""
+        """List all users, a page at a time"""
         logger.info("Getting all users")
-        return get_all_users()
+        args = page.parse_args()
+        return get_all_users(
+            limit=args.get('limit'), cursor=args.get('cursor'), fields=args.get('fields')
+        )
 
     @jwt_optional
     @api.doc('/users')
@@ -71,24 +84,90 @@ class UserList(Resource):
         return save_new_user(request.json)
 
 
-@api.route('/<public_id>')
+@api.route('/export')
+class UserExport(Resource):
+    """User Export Resource"""
+
+    @jwt_authenticated
+    @api.doc('/users/export')
+    @api.doc(security='bearer')
+    @api.expect(export)
+    @api.produces(['application/x-ndjson', 'text/csv'])
+    @api.response(OK, _(USERS_EXPORT_SUCCESS))
+    @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
+    @api.response(UNPROCESSABLE_ENTITY, _(JWT_UNPROCESSABLE))
+    @api.response(UNAUTHORIZED, f'{_(JWT_ERROR)} / {_(ADMIN_REQUIRED)}')
+    @api.response(BAD_REQUEST, _(MALFORMED))
+    def get(self):
+        """Stream all users as NDJSON or CSV"""
+        args = export.parse_args()
+        return export_users(args.get('format'), since=args.get('since'))
+
+
+@api.route('/search')
+class UserSearch(Resource):
+    """User Search Resource"""
+
+    @jwt_authenticated
+    @api.doc('/users/search')
+    @api.doc(security='bearer')
+    @api.expect(search)
+    @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
+    @api.response(UNPROCESSABLE_ENTITY, _(JWT_UNPROCESSABLE))
+    @api.response(UNAUTHORIZED, f'{_(JWT_ERROR)} / {_(ADMIN_REQUIRED)}')
+    @api.response(BAD_REQUEST, f'{_(SEARCH_INVALID)} / {_(CURSOR_INVALID)}')
+    @api.marshal_with(response, description=_(USERS_SEARCH_SUCCESS), skip_none=True)
+    def get(self):
+        """Search users by the start of their username or email, a page at a time"""
+        args = search.parse_args()
+        logger.info(f"Searching users for: {args.get('q')}")
+        return search_users(
+            args.get('q'), limit=args.get('limit'), cursor=args.get('cursor'),
+            fields=args.get('fields'),
+        )
+
+
+@api.route('/lookup')
+class UserLookup(Resource):
+    """User Lookup Resource"""
+
+    @jwt_authenticated
+    @api.doc('/users/lookup')
+    @api.doc(security='bearer')
+    @api.expect(lookup, projection)
+    @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
+    @api.response(UNPROCESSABLE_ENTITY, _(JWT_UNPROCESSABLE))
+    @api.response(UNAUTHORIZED, f'{_(JWT_ERROR)} / {_(CANNOT_VIEW_OTHERS)}')
+    @api.response(BAD_REQUEST, f'{_(MALFORMED)} / {_(LOOKUP_TOO_LARGE)}')
+    @api.marshal_with(response, description=_(USERS_LOOKUP_SUCCESS), skip_none=True)
+    def post(self):
+        """Look up a batch of users by their identifiers"""
+        public_ids = request.json.get('public_ids')
+        logger.info(f"Looking up {len(public_ids)} users")
+        return lookup_users(public_ids, fields=projection.parse_args().get('fields'))
+
+
+@api.route('/<uuid:public_id>')
 @api.param('public_id', description='User identifier')
 class User(Resource):
     """User Resource"""
 
-    @jwt_required
-    @jwt_valid
+    @jwt_authenticated
+    @conditional
     @api.doc('/users/:public_id')
     @api.doc(security='bearer')
+    @api.expect(projection)
+    @api.response(NOT_MODIFIED, _(UNCHANGED))
     @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
     @api.response(UNPROCESSABLE_ENTITY, _(JWT_UNPROCESSABLE))
     @api.response(NOT_FOUND, _(USER_NOT_FOUND))
     @api.response(UNAUTHORIZED, _(JWT_ERROR))
+    @api.response(BAD_REQUEST, _(FIELDS_INVALID))
     @api.marshal_with(response, description=_(USER_LIST_SUCCESS), skip_none=True)
     def get(self, public_id):
         """Get a user given their identifier."""
         logger.info(f"Getting user with public_id: {public_id}")
-        user_to_get = get_user_by_id(public_id)
+        user_to_get = get_user_by_id(str(public_id), fields=projection.parse_args().get('fields'))
         if not user_to_get:
             raise NotFound(USER_NOT_FOUND)
         return user_to_get
@@ -131,8 +210,7 @@ class ResendEmailConfirm(Resource):
 class EmailChange(Resource):
     """Email Change Resource"""
 
-    @jwt_required
-    @jwt_valid
+    @jwt_authenticated
     @api.doc('/users/email/change')
     @api.doc(security='bearer')
     @api.response(INTERNAL_SERVER_ERROR, _(UNKNOWN))
@@ -5,30 +5,42 @@
 Module for performing authentication related operations.
 """
 
+import datetime
 import logging
 from functools import wraps
 
-from flask import current_app, request
+from flask import _app_ctx_stack as ctx_stack, current_app, request
 from flask._compat import text_type as _
 from flask_jwt_simple import create_jwt, decode_jwt, get_jwt
-from flask_jwt_simple.exceptions import FlaskJWTException
+from flask_jwt_simple.config import config as jwt_config
+from flask_jwt_simple.exceptions import (
+    FlaskJWTException, InvalidHeaderError, NoAuthorizationError,
+)
 from jwt import DecodeError, ExpiredSignatureError
-from werkzeug.exceptions import BadRequest, InternalServerError, Unauthorized
+from werkzeug.exceptions import BadRequest, InternalServerError, ServiceUnavailable, Unauthorized
 
-from app.constants import SECOND
-from app.email_client import send_password_reset_email
+from app.constants import FIRST, SECOND
+from app.email_client import queue_password_reset_email
 from app.i18n.base import (
     CHECK_EMAIL, EMAIL_INVALID, EMAIL_NOT_CONFIRMED, EMAIL_NOT_CONFIRMED_RESET, EMAIL_PASSWORD,
-    ENCODING_JWT, JWT_BLACKLISTED, JWT_EXPIRED, JWT_INVALID, MALFORMED, PASSWORD_UPDATE_FAILED,
+    ENCODING_JWT, JWT_BLACKLISTED, JWT_EXPIRED, JWT_INVALID, JWT_REVOKED, PASSWORD_UPDATE_FAILED,
     PASSWORD_UPDATED, RESET_FAILED,
 )
+from app.main import claims_cache, db, login_throttle, token_generations
 from app.main.data.dao import save_changes
 from app.main.model.blacklist import BlacklistToken
 from app.main.model.user import User
 from app.main.service.blacklist import blacklist_token
-from app.main.service.common import get_user_by_email, lookup_user_by_id, timed_serialiser
+from app.main.service.common import (
+    get_token_generation, get_user_by_email, lookup_user_by_id, timed_serialiser,
+)
+from app.main.service.email_outbox import deliver_inline
+from app.main.service.refresh_token import (
+    issue_refresh_token, revoke_session, revoke_user_sessions, rotate_refresh_token,
+)
+from app.metrics import metrics
 from app.responses import OK, responder
-from app.security import PasswordValidator
+from app.security import PasswordValidator, digest_token
 
 logger = logging.getLogger('api-skeleton')
 
@@ -36,37 +48,82 @@ logger = logging.getLogger('api-skeleton')
 class Auth:
 
     @classmethod
+    @metrics.timed('login')
     def login_user(cls, data):
-        user = User().find_user(dict(email=data.get('email')))
+        email = data.get('email')
+        login_throttle.check(email, request.remote_addr)
+
+        user = User().find_user(dict(email=email), with_password=True)
 
         if not user or not user.check_password(data.get('password')):
+            login_throttle.record_failure(email, request.remote_addr)
             raise Unauthorized(EMAIL_PASSWORD)
+        login_throttle.reset(email)
 
         if not user.email_confirmed:
             raise Unauthorized(EMAIL_NOT_CONFIRMED)
 
+        if user.password_needs_rehash():
+            cls._rehash_password(user, data.get('password'))
+
         try:
-            token = Auth.encode_auth_token(user)
+            refresh_token, session_id = issue_refresh_token(user)
+            token = Auth.encode_auth_token(user, session_id)
         except InternalServerError:
             raise
         else:
             logger.info(f"Logged in user with public_id: {user.public_id}")
-            return responder(code=OK, data=dict(token=token))
+            return responder(code=OK, data=dict(token=token, refresh_token=refresh_token))
 
     @classmethod
-    def logout_user(cls, auth_token):
+    def refresh_tokens(cls, refresh_token):
         try:
-            public_id = Auth.decode_auth_token(auth_token)
-        except Unauthorized:
+            user, refresh_token, session_id = rotate_refresh_token(refresh_token)
+            token = Auth.encode_auth_token(user, session_id)
+        except (Unauthorized, InternalServerError):
             raise
         else:
-            logger.info(f"Logged out user with public_id: {public_id}")
-            return blacklist_token(token=auth_token)
+            logger.info(f"Refreshed tokens of user with public_id: {user.public_id}")
+            return responder(code=OK, data=dict(token=token, refresh_token=refresh_token))
 
     @classmethod
-    def encode_auth_token(cls, user):
+    def _rehash_password(cls, user, password):
+        # The password has just been verified, so this is the one chance to upgrade its hash. A
+        # failure only defers the upgrade to a later login so must not fail this one.
         try:
-            token = create_jwt(identity=user)
+            user.password = password
+            save_changes(user)
+        except (ServiceUnavailable, InternalServerError):
+            db.session.rollback()
+            logger.warning(f"Deferred password rehash of user with public_id: {user.public_id}")
+        else:
+            logger.info(f"Rehashed password of user with public_id: {user.public_id}")
+
+    @classmethod
+    def logout_user(cls):
+        payload = get_jwt()
+        auth_token = get_auth_token()
+        if not current_app.config['JWT_ACCESS_REVOCATION']:
+            # Not checked by jwt_authenticated, but a token can still only log out once.
+            cls.validate_token_blacklist(auth_token)
+        if payload.get('sid') is not None:
+            revoke_session(payload['sid'])
+        logger.info(f"Logged out user with public_id: {payload['sub']}")
+        expires_at = datetime.datetime.utcfromtimestamp(payload['exp'])
+        return blacklist_token(token=auth_token, expires_at=expires_at)
+
+    @classmethod
+    def logout_all(cls):
+        user = lookup_user_by_id(get_jwt().get('sub'))
+        cls._revoke_all_tokens(user)
+        logger.info(f"Logged out all sessions of user with public_id: {user.public_id}")
+        return responder(code=OK)
+
+    @classmethod
+    def encode_auth_token(cls, user, session_id=None):
+        identity = (user, session_id) if session_id is not None else user
+        try:
+            token = create_jwt(identity=identity)
         except FlaskJWTException as err:
             logger.critical(f"FlaskJWTException: {err}", exc_info=True)
             raise InternalServerError(ENCODING_JWT) from None
@@ -75,6 +132,10 @@ class Auth:
 
     @classmethod
     def decode_auth_token(cls, auth_token):
+        return cls.decode_auth_payload(auth_token)['sub']
+
+    @classmethod
+    def decode_auth_payload(cls, auth_token):
         try:
             payload = decode_jwt(auth_token)
         except ExpiredSignatureError:
@@ -82,7 +143,7 @@ class Auth:
         except DecodeError:
             raise Unauthorized(JWT_INVALID) from None
         else:
-            return payload['sub']
+            return payload
 
     @classmethod
     def request_password_reset(cls, email):
@@ -94,9 +155,10 @@ class Auth:
         if not user.email_confirmed:
             raise Unauthorized(EMAIL_NOT_CONFIRMED_RESET)
 
-        send_password_reset_email(user.email)
-
         logger.info(f"Password reset request of user with public_id: {user.public_id}")
+        email_queued = queue_password_reset_email(user.email)
+        save_changes(email_queued)
+        deliver_inline(email_queued)
         return responder(code=OK, data=dict(check=_(CHECK_EMAIL)))
 
     @classmethod
@@ -120,19 +182,62 @@ class Auth:
         if password_invalid:
             raise BadRequest(password_invalid)
         user.password = password
-        save_changes(user)
+        cls._revoke_all_tokens(user)
 
         logger.info(f"Updating password of user with public_id: {user.public_id}")
         return responder(code=OK, data=dict(updated=_(PASSWORD_UPDATED)))
 
     @classmethod
-    def validate_token_format(cls, auth_token):
-        try:
-            auth_token = auth_token.split('Bearer ')[SECOND]
-        except (AttributeError, IndexError):
-            raise BadRequest(MALFORMED) from None
-        else:
-            return auth_token
+    def _revoke_all_tokens(cls, user):
+        # Incremented in SQL so concurrent bumps are not lost. Saves any other pending changes too.
+        user.token_generation = User.token_generation + 1
+        save_changes(user)
+        token_generations.set(user.public_id, user.token_generation)
+        revoke_user_sessions(user.id)
+
+    @classmethod
+    def parse_auth_header(cls, auth_header):
+        """
+        Pass the Authorization header to get the JWT from it. Failures raise the same exceptions as
+        flask_jwt_simple so its error handlers respond to them.
+        :raise: NoAuthorizationError: if the header is missing
+        :raise: InvalidHeaderError: if the header is not 'Bearer <JWT>'
+        """
+        if not auth_header:
+            raise NoAuthorizationError(f"Missing {jwt_config.header_name} Header")
+        parts = auth_header.split()
+        if len(parts) != 2 or parts[FIRST] != jwt_config.header_type:
+            raise InvalidHeaderError(
+                f"Bad {jwt_config.header_name} header. "
+                f"Expected value '{jwt_config.header_type} <JWT>'"
+            )
+        return parts[SECOND]
+
+    @classmethod
+    def verify_auth_token(cls, auth_token):
+        """
+        Pass a JWT to verify it and get its claims. Claims of a token verified by an earlier request
+        are served from the claims cache, if enabled. Failures raise the PyJWT exceptions which
+        flask_jwt_simple's error handlers respond to.
+        :return: dict of the JWT claims
+        """
+        digest = digest_token(auth_token)
+        claims = claims_cache.get(digest)
+        if claims is None:
+            claims = decode_jwt(auth_token)
+            claims_cache.set(digest, claims)
+        return claims
+
+    @classmethod
+    def validate_token_generation(cls, claims):
+        """
+        Pass the claims of a JWT to check it was issued since its user's tokens were last revoked.
+        Tokens issued before generation claims were added count as generation 0.
+        :raise: werkzeug.Unauthorized: if the JWT is from an older generation or the user is gone
+        """
+        generation = token_generations.get(claims.get('sub'), get_token_generation)
+        if generation is None or claims.get('gen', 0) < generation:
+            raise Unauthorized(JWT_REVOKED)
 
     @classmethod
     def validate_token_blacklist(cls, auth_token):
@@ -141,11 +246,31 @@ class Auth:
             raise Unauthorized(JWT_BLACKLISTED)
 
 
-def jwt_valid(func):
+def jwt_authenticated(func):
+    """
+    Authenticates a request in a single pass. The Authorization header is parsed once and the JWT
+    is verified once. Its generation is compared with the user's current one, which is cached, so
+    all of a user's tokens can be revoked at once. Access JWTs are short lived, so they are only
+    checked against the blacklist when JWT_ACCESS_REVOCATION is set. The claims are then kept on the
+    app context, where get_jwt finds them, along with the raw token for get_auth_token. Services
+    read from there rather than decoding the token again.
+    """
     @wraps(func)
-    def token_validator(*args, **kwargs):
-        auth_token = Auth.validate_token_format(request.headers.get('Authorization'))
-        Auth.validate_token_blacklist(auth_token)
+    def authenticator(*args, **kwargs):
+        auth_token = Auth.parse_auth_header(request.headers.get(jwt_config.header_name))
+        claims = Auth.verify_auth_token(auth_token)
+        Auth.validate_token_generation(claims)
+        if current_app.config['JWT_ACCESS_REVOCATION']:
+            Auth.validate_token_blacklist(auth_token)
+        ctx_stack.top.jwt = claims
+        ctx_stack.top.auth_token = auth_token
         return func(*args, **kwargs)
 
-    return token_validator
+    return authenticator
+
+
+def get_auth_token():
+    """
+    :return: the raw JWT of the request authenticated by jwt_authenticated, otherwise None
+    """
+    return getattr(ctx_stack.top, 'auth_token', None)
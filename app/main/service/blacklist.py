@@ -1,32 +1,122 @@
-# pylint: disable=try-except-raise
+# pylint: disable=try-except-raise, logging-fstring-interpolation
 
 """
-Uses the SQLAlchemy model for blacklisting JWT tokens.
+Uses the SQLAlchemy model for blacklisting JWT tokens. Keeps the per worker blacklist cache in step
+with the rows this worker writes. Also prunes rows whose tokens have expired, either on demand or
+from an optional background sweeper thread.
 """
 
+import datetime
+import logging
+import threading
+
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.exceptions import InternalServerError
 
-from app.main.data.dao import save_changes
+from app.i18n.base import SAVING_TO_DATABASE
+from app.main import blacklist_cache, claims_cache, db
+from app.main.data.dao import delete_in_batches, save_changes
+from app.main.data.partition import drop_partitions_before, ensure_partitions, is_partitioned
 from app.main.model.blacklist import BlacklistToken
+from app.main.service.refresh_token import prune_refresh_tokens
 from app.responses import OK, responder
 
+logger = logging.getLogger('api-skeleton')
+
 
-def blacklist_token(token):
+def blacklist_token(token, expires_at=None):
     """
     Pass a JWT and it will initialise a BlacklistToken SQLAlchemy object and then write the changes
-    to the database.
+    to the database. Once written, the token is added to the blacklist cache and its claims are
+    evicted from the claims cache.
     :param token: string containing a JWT token
+    :param expires_at: datetime the JWT expires, after which the row can be pruned
     :return: dict containing the HTTP success code
     :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
     """
     try:
-        token = BlacklistToken(token=token)
+        blacklisted = BlacklistToken(token=token, expires_at=expires_at)
     except InternalServerError:
         raise
 
     try:
-        save_changes(token)
+        save_changes(blacklisted)
     except InternalServerError:
         raise
     else:
+        blacklist_cache.add(blacklisted.token_digest)
+        claims_cache.evict(blacklisted.token_digest)
         return responder(code=OK)
+
+
+def prune_blacklist(batch_size=None, now=None):
+    """
+    Delete blacklisted tokens which have expired. On a partitioned Postgres table, whole days which
+    have passed are dropped and partitions for the coming days are created. Remaining expired rows
+    are deleted in bounded batches, each in its own transaction, so locks are held only briefly.
+    :param batch_size: int maximum rows deleted per transaction, defaults to the configured size
+    :param now: datetime to compare expiry against, defaults to the current UTC time
+    :return: int number of rows deleted, not counting rows in dropped partitions
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    batch_size = batch_size or current_app.config['BLACKLIST_PRUNE_BATCH_SIZE']
+    now = now or datetime.datetime.utcnow()
+    table_name = BlacklistToken.__tablename__
+    try:
+        if is_partitioned(table_name):
+            drop_partitions_before(table_name, now)
+            ensure_partitions(
+                table_name, now.date(), current_app.config['BLACKLIST_PARTITION_DAYS_AHEAD']
+            )
+        deleted = delete_in_batches(BlacklistToken, BlacklistToken.expires_at < now, batch_size)
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(SAVING_TO_DATABASE) from None
+
+    logger.info(f"Pruned {deleted} expired blacklisted token(s)")
+    return deleted
+
+
+class BlacklistSweeper(threading.Thread):
+    """
+    Daemon thread which prunes expired blacklisted tokens and refresh tokens on an interval. Started
+    by the app when BLACKLIST_SWEEP_INTERVAL is set. Failures are logged and retried on the next
+    interval.
+    """
+
+    def __init__(self, app, interval):
+        super().__init__(name='blacklist-sweeper', daemon=True)
+        self.app = app
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            with self.app.app_context():
+                try:
+                    prune_blacklist()
+                    prune_refresh_tokens()
+                except InternalServerError:
+                    logger.error("Blacklist sweep failed: retrying next interval")
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_sweeper(app):
+    """
+    Start a background sweeper for the app if one is configured.
+    :param app: Flask application
+    :return: the running BlacklistSweeper or None when sweeping is disabled
+    """
+    interval = app.config['BLACKLIST_SWEEP_INTERVAL']
+    if not interval:
+        return None
+    sweeper = BlacklistSweeper(app, interval)
+    sweeper.start()
+    app.extensions['blacklist-sweeper'] = sweeper
+    return sweeper
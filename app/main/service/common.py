@@ -4,18 +4,32 @@
 Module for functions which are common to other services. Created to prevent circular import errors.
 """
 
+import datetime
+import hashlib
 import logging
 
 from flask import current_app
-from itsdangerous import BadData, URLSafeTimedSerializer
+from itsdangerous import BadData, URLSafeSerializer, URLSafeTimedSerializer
 from sqlalchemy.exc import SQLAlchemyError
-from werkzeug.exceptions import InternalServerError, Unauthorized
+from werkzeug.exceptions import BadRequest, InternalServerError, Unauthorized
 
-from app.constants import FIRST
+from app.constants import SECOND
 from app.i18n.base import GETTING_USER
+from app.main import db
 from app.main.model.user import User
 
 MAX_TOKEN_AGE = 600
+CURSOR_SALT = 'page-cursor'
+ETAG_DIGEST_SIZE = 16
+# Columns of a user which can be requested with a fields query parameter, by name.
+USER_FIELDS = dict(
+    username=User.username,
+    public_id=User.public_id,
+    email=User.email,
+    registered_on=User.registered_on,
+    email_confirmed=User.email_confirmed,
+)
+DEFAULT_USER_FIELDS = ('username', 'public_id', 'email')
 
 logger = logging.getLogger('api-skeleton')
 
@@ -32,10 +46,29 @@ def timed_serialiser(token, salt, error_message):
         return email
 
 
+def encode_cursor(position):
+    """
+    Pass the position of the last row of a page to get an opaque, signed cursor for the next page.
+    """
+    return URLSafeSerializer(current_app.config['SECRET_KEY']).dumps(position, salt=CURSOR_SALT)
+
+
+def decode_cursor(cursor, error_message):
+    """
+    Pass a cursor from encode_cursor to get back the position it was made from.
+    :raise: werkzeug.BadRequest: if the cursor has been tampered with or is not a cursor
+    """
+    try:
+        return URLSafeSerializer(current_app.config['SECRET_KEY']).loads(cursor, salt=CURSOR_SALT)
+    except BadData as err:
+        logger.error(f"BadData: {err}")
+        raise BadRequest(error_message) from None
+
+
 # User
 def get_user_by_email(email):
     try:
-        user = User.query.filter_by(email=email).first()
+        user = User.lookup(email=email)
     except SQLAlchemyError as err:
         logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
         raise InternalServerError(GETTING_USER) from None
@@ -43,19 +76,62 @@ def get_user_by_email(email):
         return user
 
 
-def lookup_user_by_id(public_id, deserialise=False):
+def lookup_user_by_id(public_id):
     try:
-        user = User.query.filter_by(public_id=public_id).first()
+        user = User.lookup(public_id=public_id)
     except SQLAlchemyError as err:
         logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
         raise InternalServerError(GETTING_USER) from None
     else:
-        if deserialise:
-            return serialise_users([user])[FIRST] if user else None
         return user
 
 
-def serialise_users(users):
+def get_token_generation(public_id):
+    try:
+        generation = db.session.query(User.token_generation).filter_by(public_id=public_id).scalar()
+    except SQLAlchemyError as err:
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(GETTING_USER) from None
+    else:
+        return generation
+
+
+def make_etag(*parts):
+    """
+    Pass the values which identify a representation to get a strong ETag for it.
+    """
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=ETAG_DIGEST_SIZE).hexdigest()
+
+
+def parse_user_fields(fields, error_message):
+    """
+    Pass the value of a fields query parameter, a comma separated list of names from USER_FIELDS,
+    to get the names as a tuple. No value gives the default fields.
+    :raise: werkzeug.BadRequest: if a name is not in USER_FIELDS
+    """
+    if not fields:
+        return DEFAULT_USER_FIELDS
+    requested = tuple(dict.fromkeys(field.strip() for field in fields.split(',') if field.strip()))
+    if not requested or not all(field in USER_FIELDS for field in requested):
+        raise BadRequest(error_message)
+    return requested
+
+
+def query_users(fields, *criteria):
+    """
+    Pass field names and filter criteria to get a query selecting only those columns of the matching
+    users, after their id. Rows come back as plain tuples rather than User instances, so nothing is
+    added to the session's identity map. Serialise them with serialise_user_rows.
+    """
+    columns = [USER_FIELDS[field] for field in fields]
+    return db.session.query(User.id, *columns).filter(*criteria)
+
+
+def serialise_user_rows(rows, fields):
     return [
-        dict(username=user.username, public_id=user.public_id, email=user.email) for user in users
+        {
+            field: value.isoformat() if isinstance(value, datetime.datetime) else value
+            for field, value in zip(fields, row[SECOND:])
+        }
+        for row in rows
     ]
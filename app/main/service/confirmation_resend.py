@@ -0,0 +1,102 @@
+# pylint: disable=logging-fstring-interpolation
+
+"""
+Module for resending confirmation emails in bulk, for example to the users whose emails were lost
+while the mail server was down. Unconfirmed users are read a batch at a time in order of id. Each
+batch's emails are inserted into the email outbox with one statement and the users'
+email_confirmation_sent_on set with one UPDATE, both in one transaction. Those emails, and no others
+in the outbox, are then sent over a few SMTP sessions in parallel, the links being signed as each
+email is sent.
+"""
+
+import datetime
+import logging
+import time
+
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import InternalServerError
+
+from app.email_client import queue_confirmation_emails
+from app.i18n.base import GETTING_USERS, SAVING_TO_DATABASE
+from app.main import db, user_cache
+from app.main.model.user import User
+from app.main.service.email_outbox import run_mail_worker
+
+logger = logging.getLogger('api-skeleton')
+
+
+def resend_confirmations(since, batch_size=None, sessions=None, send=True, progress=None):
+    """
+    Pass a time to queue a new confirmation email for every unconfirmed user whose last one was
+    sent at or after it, or who has never been sent one, then send them.
+    :param since: datetime, UTC, from when confirmation emails are to be resent
+    :param batch_size: int users handled per transaction, defaults to the configured size
+    :param sessions: int SMTP sessions sending in parallel, defaults to SMTP_POOL_SIZE
+    :param send: boolean of whether to send each batch's emails now, rather than leave them to the
+    worker. Those which fail are left to the worker to retry.
+    :param progress: callable passed the running totals after each batch
+    :return: dict of the emails queued, sent and failed, and the seconds taken
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    batch_size = batch_size or current_app.config['CONFIRMATION_RESEND_BATCH_SIZE']
+    sessions = sessions or current_app.config['SMTP_POOL_SIZE']
+    start = time.perf_counter()
+    totals = dict(queued=0, sent=0, failed=0)
+
+    after_id = 0
+    while True:
+        users = _unconfirmed_users(since, after_id, batch_size)
+        if not users:
+            break
+        email_ids = _queue_batch(users)
+        totals['queued'] += len(users)
+        after_id = users[-1].id
+        if send:
+            sent, failed = run_mail_worker(workers=sessions, once=True, ids=email_ids)
+            totals['sent'] += sent
+            totals['failed'] += failed
+        if progress:
+            progress(totals)
+        if len(users) < batch_size:
+            break
+    logger.info(f"Queued {totals['queued']} confirmation email(s) sent since {since}")
+    return dict(totals, seconds=time.perf_counter() - start)
+
+
+def _unconfirmed_users(since, after_id, batch_size):
+    try:
+        return db.session.query(User.id, User.public_id, User.email).filter(
+            User.id > after_id,
+            User.email_confirmed.isnot(True),
+            # Users never sent one, such as imported users, are the likeliest to need it.
+            or_(
+                User.email_confirmation_sent_on.is_(None),
+                User.email_confirmation_sent_on >= since,
+            ),
+        ).order_by(User.id).limit(batch_size).all()
+    except SQLAlchemyError as err:
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(GETTING_USERS) from None
+
+
+def _queue_batch(users):
+    now = datetime.datetime.utcnow()
+    try:
+        email_ids = queue_confirmation_emails(user.email for user in users)
+        # Bumps the version as the ORM would, so ETags of these users change too.
+        User.query.filter(User.id.in_([user.id for user in users])).update(
+            dict(email_confirmation_sent_on=now, version=User.version + 1),
+            synchronize_session=False,
+        )
+        db.session.commit()
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(SAVING_TO_DATABASE) from None
+    finally:
+        user_cache.evict(*(
+            key for user in users for key in (f'public_id:{user.public_id}', f'email:{user.email}')
+        ))
+    return email_ids
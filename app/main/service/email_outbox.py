@@ -0,0 +1,198 @@
+# pylint: disable=logging-fstring-interpolation
+
+"""
+Module for sending the emails queued in the email outbox. The mail worker claims batches of due
+emails, composes them, signing their links as it does, and sends them from a pool of threads, so
+one slow conversation with the mail server does not hold up the rest. An email which fails is
+retried with exponential backoff until it has been tried EMAIL_OUTBOX_MAX_ATTEMPTS times. Claims
+are leases: an email claimed by a worker which then dies is picked up again once its lease runs
+out. Postgres claims with SELECT ... FOR UPDATE SKIP LOCKED; elsewhere each email is claimed by an
+UPDATE conditional on its still being due, so no two workers send the same email. prune_outbox
+deletes emails sent or given up on more than EMAIL_OUTBOX_RETENTION ago.
+"""
+
+import datetime
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import InternalServerError
+
+from app.email_client import compose_emails, send_email
+from app.i18n.base import GETTING_EMAILS, SAVING_TO_DATABASE
+from app.main import db
+from app.main.data.dao import delete_in_batches
+from app.main.model.email_outbox import EmailOutbox
+
+logger = logging.getLogger('api-skeleton')
+
+
+def deliver_inline(*emails):
+    """
+    Pass the outbox rows just committed by a request to send them before it responds, when
+    EMAIL_OUTBOX_INLINE is set, as in testing. Otherwise they are left for the mail worker. An
+    email which fails is left queued for a retry rather than failing the request.
+    :param emails: EmailOutbox rows
+    """
+    if not current_app.config['EMAIL_OUTBOX_INLINE']:
+        return
+    now = datetime.datetime.utcnow()
+    for email, message in zip(emails, compose_emails(emails)):
+        _record(email, _send(current_app, message), now)
+    _commit()
+
+
+def drain_outbox(workers=None, batch_size=None, now=None, ids=None):
+    """
+    Claim a batch of due emails and send them across a pool of threads.
+    :param workers: int threads sending emails, defaults to the configured number
+    :param batch_size: int most emails claimed at once, defaults to the configured size
+    :param now: datetime emails are due by, defaults to the current UTC time
+    :param ids: list of the ids of the only emails to send, defaults to any which are due
+    :return: tuple of the numbers of emails sent and failed
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    workers = workers or current_app.config['EMAIL_OUTBOX_WORKERS']
+    batch_size = batch_size or current_app.config['EMAIL_OUTBOX_BATCH_SIZE']
+    now = now or datetime.datetime.utcnow()
+    emails = _claim(batch_size, now, ids)
+    if not emails:
+        return 0, 0
+
+    app = current_app._get_current_object()  # pylint: disable=protected-access
+    messages = compose_emails(emails)
+    with ThreadPoolExecutor(max_workers=min(workers, len(emails))) as pool:
+        errors = list(pool.map(lambda message: _send(app, message), messages))
+    for email, error in zip(emails, errors):
+        _record(email, error, now)
+    _commit()
+
+    failed = sum(1 for error in errors if error)
+    logger.info(f"Sent {len(emails) - failed} queued email(s), {failed} failed")
+    return len(emails) - failed, failed
+
+
+def run_mail_worker(workers=None, batch_size=None, poll_interval=None, once=False, ids=None):
+    """
+    Send queued emails until stopped. Each full batch is followed straight away by the next; the
+    worker only sleeps for the poll interval when the outbox has run dry.
+    :param workers: int threads sending emails, defaults to the configured number
+    :param batch_size: int most emails claimed at once, defaults to the configured size
+    :param poll_interval: float seconds between checks of an empty outbox, defaults to the config
+    :param once: boolean of whether to stop once there is nothing due
+    :param ids: list of the ids of the only emails to send, defaults to any which are due
+    :return: tuple of the numbers of emails sent and failed
+    """
+    batch_size = batch_size or current_app.config['EMAIL_OUTBOX_BATCH_SIZE']
+    poll_interval = poll_interval or current_app.config['EMAIL_OUTBOX_POLL_INTERVAL']
+    totals = [0, 0]
+    while True:
+        sent, failed = drain_outbox(workers=workers, batch_size=batch_size, ids=ids)
+        totals[0] += sent
+        totals[1] += failed
+        if sent + failed < batch_size:
+            if once:
+                return tuple(totals)
+            time.sleep(poll_interval)
+
+
+def prune_outbox(batch_size=None, now=None):
+    """
+    Delete emails which were sent or given up on longer than EMAIL_OUTBOX_RETENTION ago, in bounded
+    batches.
+    :param batch_size: int maximum rows deleted per transaction, defaults to the configured size
+    :param now: datetime the retention is counted back from, defaults to the current UTC time
+    :return: int number of rows deleted
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    batch_size = batch_size or current_app.config['EMAIL_OUTBOX_PRUNE_BATCH_SIZE']
+    now = now or datetime.datetime.utcnow()
+    retained_from = now - datetime.timedelta(seconds=current_app.config['EMAIL_OUTBOX_RETENTION'])
+    try:
+        deleted = delete_in_batches(
+            EmailOutbox,
+            or_(EmailOutbox.sent_on < retained_from, EmailOutbox.abandoned_on < retained_from),
+            batch_size,
+        )
+    except SQLAlchemyError as err:
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(SAVING_TO_DATABASE) from None
+
+    logger.info(f"Pruned {deleted} sent or abandoned email(s)")
+    return deleted
+
+
+def _claim(batch_size, now, ids=None):
+    """
+    :return: list of the due emails, leased to this worker so others pass over them
+    """
+    leased_until = now + datetime.timedelta(seconds=current_app.config['EMAIL_OUTBOX_LEASE'])
+    due = EmailOutbox.next_attempt_at <= now
+    if ids is not None:
+        due = and_(due, EmailOutbox.id.in_(ids))
+    query = EmailOutbox.query.filter(due).order_by(EmailOutbox.next_attempt_at).limit(batch_size)
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            # Concurrent workers each claim different rows rather than waiting on one another's.
+            emails = query.with_for_update(skip_locked=True).all()
+            for email in emails:
+                email.next_attempt_at = leased_until
+        else:
+            # Another worker may have read the same rows, so each is only claimed by an UPDATE
+            # which still finds it due.
+            emails = [
+                email for email in query.all()
+                if EmailOutbox.query.filter(EmailOutbox.id == email.id, due).update(
+                    dict(next_attempt_at=leased_until), synchronize_session=False
+                )
+            ]
+        db.session.commit()
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(GETTING_EMAILS) from None
+    return emails
+
+
+def _send(app, message):
+    """
+    :return: string of why the email could not be sent, or None if it was
+    """
+    with app.app_context():
+        try:
+            send_email(**message)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.warning(f"Sending email to {message['recipients']} failed: {err}")
+            return repr(err)
+    return None
+
+
+def _record(email, error, now):
+    email.attempts += 1
+    if not error:
+        email.sent_on = now
+        email.next_attempt_at = None
+        email.last_error = None
+        return
+    email.last_error = error
+    config = current_app.config
+    if email.attempts >= config['EMAIL_OUTBOX_MAX_ATTEMPTS']:
+        logger.critical(f"Gave up sending email {email.id} after {email.attempts} attempts")
+        email.next_attempt_at = None
+        email.abandoned_on = now
+        return
+    backoff = min(config['EMAIL_OUTBOX_BACKOFF'] * 2 ** (email.attempts - 1),
+                  config['EMAIL_OUTBOX_BACKOFF_MAX'])
+    email.next_attempt_at = now + datetime.timedelta(seconds=backoff)
+
+
+def _commit():
+    try:
+        db.session.commit()
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(SAVING_TO_DATABASE) from None
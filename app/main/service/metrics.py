@@ -0,0 +1,19 @@
+# pylint: disable=missing-function-docstring
+
+"""
+Module for reading the operational metrics of this worker process.
+"""
+
+from werkzeug.exceptions import Unauthorized
+
+from app.i18n.base import ADMIN_REQUIRED
+from app.main.service.user import is_admin
+from app.metrics import metrics
+from app.responses import OK, responder
+
+
+def get_metrics():
+    user_is_admin, _ = is_admin()
+    if not user_is_admin:
+        raise Unauthorized(ADMIN_REQUIRED)
+    return responder(code=OK, data=dict(metrics=metrics.snapshot()))
@@ -0,0 +1,157 @@
+# pylint: disable=logging-fstring-interpolation
+
+"""
+Module for issuing, rotating and revoking refresh tokens. Each refresh token is a login session.
+Exchanging a refresh token for a new access JWT also rotates it: the old token stops working and a
+new one is returned. A rotated token which is presented again has been replayed, perhaps by whoever
+stole it, so its whole session is revoked. Sessions also end when revoked at logout, or when they
+expire.
+"""
+
+import datetime
+import logging
+import secrets
+
+from flask import current_app
+from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import InternalServerError, Unauthorized
+
+from app.i18n.base import GETTING_REFRESH_TOKEN, REFRESH_INVALID, SAVING_TO_DATABASE
+from app.main import db
+from app.main.data.dao import delete_in_batches, save_changes
+from app.main.model.refresh_token import RefreshToken, RotatedRefreshToken
+from app.main.model.user import User
+from app.security import digest_token
+
+REFRESH_TOKEN_BYTES = 32
+
+logger = logging.getLogger('api-skeleton')
+
+
+def issue_refresh_token(user):
+    """
+    Pass a user to start a new session for them.
+    :param user: SQLAlchemy model representing a user object
+    :return: tuple of the refresh token and the id of its session
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    token = secrets.token_urlsafe(REFRESH_TOKEN_BYTES)
+    expires_at = datetime.datetime.utcnow() + current_app.config['REFRESH_TOKEN_EXPIRES']
+    session = RefreshToken(token=token, user_id=user.id, expires_at=expires_at)
+    save_changes(session)
+    return token, session.id
+
+
+def rotate_refresh_token(token):
+    """
+    Pass a refresh token to exchange it for a new one in the same session. The swap is a single
+    conditional update, so of two concurrent requests with the same token only one succeeds. The
+    old token's digest is kept, and if it is ever presented again, or loses such a race, the token
+    has been reused and the session is revoked.
+    :param token: string containing a refresh token
+    :return: tuple of the session's user, the new refresh token and the id of the session
+    :raise: werkzeug.Unauthorized: if the token is unknown, reused, revoked or expired
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    digest = digest_token(token)
+    try:
+        session = RefreshToken.query.filter_by(token_digest=digest).first()
+        rotated_from = None if session else RotatedRefreshToken.query.filter_by(
+            token_digest=digest
+        ).first()
+    except SQLAlchemyError as err:
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(GETTING_REFRESH_TOKEN) from None
+
+    if rotated_from:
+        _revoke_reused(rotated_from.session_id)
+    if not session or not session.is_active:
+        raise Unauthorized(REFRESH_INVALID)
+
+    new_token = secrets.token_urlsafe(REFRESH_TOKEN_BYTES)
+    try:
+        rotated = RefreshToken.query.filter(
+            RefreshToken.id == session.id,
+            RefreshToken.token_digest == digest,
+            RefreshToken.revoked_on.is_(None),
+        ).update(dict(token_digest=digest_token(new_token)), synchronize_session=False)
+        if rotated:
+            db.session.add(RotatedRefreshToken(token_digest=digest, session_id=session.id))
+        db.session.commit()
+        user = User.query.get(session.user_id)
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(SAVING_TO_DATABASE) from None
+
+    if not rotated:
+        # Another request rotated the same token first.
+        _revoke_reused(session.id)
+    if not rotated or not user:
+        raise Unauthorized(REFRESH_INVALID)
+    return user, new_token, session.id
+
+
+def revoke_session(session_id):
+    """
+    Pass the id of a session to revoke its refresh token. Access JWTs already issued in the session
+    stay valid until they expire, which is soon.
+    :param session_id: int id of the session, from an access JWT's 'sid' claim
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    _revoke(RefreshToken.id == session_id)
+
+
+def revoke_user_sessions(user_id):
+    """
+    Pass the id of a user to revoke all of their sessions, for example when logging out everywhere.
+    :param user_id: int id of the user
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    _revoke(RefreshToken.user_id == user_id)
+
+
+def prune_refresh_tokens(batch_size=None, now=None):
+    """
+    Delete refresh tokens which have expired or been revoked, with the tokens their sessions rotated
+    away from, in bounded batches.
+    :param batch_size: int maximum rows deleted per transaction, defaults to the configured size
+    :param now: datetime to compare expiry against, defaults to the current UTC time
+    :return: int number of rows deleted
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    batch_size = batch_size or current_app.config['BLACKLIST_PRUNE_BATCH_SIZE']
+    now = now or datetime.datetime.utcnow()
+    ended = or_(RefreshToken.expires_at < now, RefreshToken.revoked_on.isnot(None))
+    try:
+        # Rotated tokens go first, as they refer to their sessions.
+        delete_in_batches(
+            RotatedRefreshToken,
+            RotatedRefreshToken.session_id.in_(db.session.query(RefreshToken.id).filter(ended)),
+            batch_size,
+        )
+        deleted = delete_in_batches(RefreshToken, ended, batch_size)
+    except SQLAlchemyError as err:
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(SAVING_TO_DATABASE) from None
+
+    logger.info(f"Pruned {deleted} expired or revoked refresh token(s)")
+    return deleted
+
+
+def _revoke_reused(session_id):
+    logger.warning(f"Rotated refresh token reused: revoking session {session_id}")
+    revoke_session(session_id)
+
+
+def _revoke(criterion):
+    try:
+        RefreshToken.query.filter(criterion, RefreshToken.revoked_on.is_(None)).update(
+            dict(revoked_on=datetime.datetime.utcnow()), synchronize_session=False
+        )
+        db.session.commit()
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(SAVING_TO_DATABASE) from None
@@ -5,39 +5,46 @@
 Module for performing user related operations.
 """
 
+import csv
 import datetime
+import io
+import json
 import logging
 import uuid
 
-from flask import current_app
+from flask import Response, current_app, stream_with_context
 from flask._compat import text_type as _
 from flask_jwt_simple import get_jwt
+from sqlalchemy import and_, func, or_
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.exceptions import BadRequest, Conflict, InternalServerError, NotFound, Unauthorized
 
 from app.constants import FIRST
-from app.email_client import send_confirmation_email
+from app.email_client import queue_confirmation_email
 from app.i18n.base import (
-    ACCOUNT_ALREADY_CONFIRMED, CANNOT_VIEW_OTHERS, CONFIRMATION_FAILED, EMAIL_ALREADY_EXISTS,
-    EMAIL_RESENT, EMAIL_UPDATED, GETTING_USERS, USER_EXISTS, USER_NOT_FOUND,
+    ACCOUNT_ALREADY_CONFIRMED, ADMIN_REQUIRED, CANNOT_VIEW_OTHERS, CONFIRMATION_FAILED,
+    CURSOR_INVALID, EMAIL_ALREADY_EXISTS, EMAIL_RESENT, EMAIL_UPDATED, FIELDS_INVALID,
+    GETTING_USERS, LOOKUP_TOO_LARGE, SEARCH_INVALID, USER_EXISTS, USER_NOT_FOUND,
 )
-from app.main.data.dao import save_changes
+from app.main import db
+from app.main.data.dao import insert_unique, save_changes
+from app.main.model.types import parse_guid
 from app.main.model.user import User
 from app.main.service.common import (
-    get_user_by_email, lookup_user_by_id, serialise_users, timed_serialiser,
+    DEFAULT_USER_FIELDS, decode_cursor, encode_cursor, get_user_by_email, lookup_user_by_id,
+    make_etag, parse_user_fields, query_users, serialise_user_rows, timed_serialiser,
 )
-from app.responses import CREATED, OK, responder
+from app.main.service.email_outbox import deliver_inline
+from app.responses import check_etag, CREATED, OK, responder
 from app.security import PasswordValidator
 
 logger = logging.getLogger('api-skeleton')
 
 
 def save_new_user(data):
-    filter_params = [{filter_by: data.get(filter_by)} for filter_by in ['email', 'username']]
-    user_results = [User().find_user(filter_param) for filter_param in filter_params]
-    user = [user for user in user_results if user]
-
-    if user:
+    email, username, public_id = data.get('email'), data.get('username'), str(uuid.uuid4())
+    # Checked before the password is validated and hashed, so a clash costs no hash.
+    if User.taken(email, username):
         raise Conflict(USER_EXISTS)
 
     password_invalid = PasswordValidator().validate_password(data.get('password'))
@@ -48,50 +55,240 @@ def save_new_user(data):
 
     now = datetime.datetime.utcnow()
     new_user = User(
-        email=data.get('email'),
+        email=email,
         password=data.get('password'),
-        username=data.get('username'),
-        public_id=str(uuid.uuid4()),
+        username=username,
+        public_id=public_id,
         admin=create_admin,
         registered_on=now,
         email_confirmation_sent_on=now,
         email_confirmed=False,
         email_confirmed_on=None,
     )
-    save_changes(new_user)
-    send_confirmation_email(new_user.email)
+    # The unique email and username constraints catch users registered since the check. The values
+    # are kept to hand so reading them back does not reload the row after the commit. The
+    # confirmation email is committed with the user, or not at all.
+    email_queued = queue_confirmation_email(email)
+    if not insert_unique(new_user, 'email', 'username'):
+        raise Conflict(USER_EXISTS)
+    User.users_seen = True
+    deliver_inline(email_queued)
 
     logger.info("New user successfully created")
-    logger.info(f"New user email: {new_user.email}")
-    logger.info(f"New user username: {new_user.username}")
-    logger.info(f"New user public_id: {new_user.public_id}")
+    logger.info(f"New user email: {email}")
+    logger.info(f"New user username: {username}")
+    logger.info(f"New user public_id: {public_id}")
 
-    user = dict(public_id=new_user.public_id)
+    user = dict(public_id=public_id)
     return responder(code=CREATED, data=dict(user=user))
 
 
-def get_all_users():
-    try:
-        users = User.query.all()
-    except SQLAlchemyError as err:
-        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
-        raise InternalServerError(GETTING_USERS) from None
-    else:
-        users = serialise_users(users)
-        user_is_admin, user_sub = is_admin()
-        if not user_is_admin:
-            user = User.query.filter_by(public_id=user_sub).first()
-            users = [serialise_users([user])[FIRST]]
-        return responder(code=OK, data=dict(users=users))
-
-
-def get_user_by_id(public_id):
-    user = lookup_user_by_id(public_id, deserialise=True)
+def get_all_users(limit=None, cursor=None, fields=None):
+    """
+    Admins get a page of users ordered by id. The page starts after the position in the cursor, if
+    given, and a cursor for the next page is returned while more users remain. Other users only get
+    themselves. Only the requested fields are selected, with the versions the ETag is made from.
+    :param limit: int users per page, defaulted and capped by the config
+    :param cursor: string cursor returned with the previous page
+    :param fields: string of comma separated field names, defaults to username, public_id and email
+    :return: tuple of the JSend dict with the users and next cursor, then the HTTP code
+    """
+    fields = parse_user_fields(fields, FIELDS_INVALID)
+    user_is_admin, user_sub = is_admin()
+    if not user_is_admin:
+        users = _select_users(_versioned(fields, User.public_id == user_sub).limit(1))
+        check_etag(make_etag(user_is_admin, fields, _versions(users)))
+        return responder(code=OK, data=dict(users=serialise_user_rows(users, fields), next=None))
+
+    limit, after_id = _page(limit, cursor)
+    users = _select_users(_page_query(_versioned(fields), limit, after_id))
+    # Includes the row past the page, which decides whether there is a next cursor.
+    check_etag(make_etag(user_is_admin, limit, after_id, fields, _versions(users)))
+
+    next_cursor = encode_cursor(users[limit - 1].id) if len(users) > limit else None
+    users = serialise_user_rows(users[:limit], fields)
+    return responder(code=OK, data=dict(users=users, next=next_cursor))
+
+
+def search_users(q, limit=None, cursor=None, fields=None):
+    """
+    Admins get a page of the users whose username or email starts with the query, ignoring case,
+    paged as get_all_users is. The match is on lower() of each column so it is served by their
+    functional indexes.
+    :param q: string start of the usernames or emails to match
+    :param limit: int users per page, defaulted and capped by the config
+    :param cursor: string cursor returned with the previous page
+    :param fields: string of comma separated field names, defaults to username, public_id and email
+    :return: tuple of the JSend dict with the users and next cursor, then the HTTP code
+    :raise: werkzeug.Unauthorized: if the user is not an admin
+    :raise: werkzeug.BadRequest: if the query is blank
+    """
+    user_is_admin, _ = is_admin()
+    if not user_is_admin:
+        raise Unauthorized(ADMIN_REQUIRED)
+    prefix = (q or '').strip().lower()
+    if not prefix:
+        raise BadRequest(SEARCH_INVALID)
+    fields = parse_user_fields(fields, FIELDS_INVALID)
+
+    limit, after_id = _page(limit, cursor)
+    matches = or_(_starts_with(User.username, prefix), _starts_with(User.email, prefix))
+    users = _select_users(_page_query(query_users(fields, matches), limit, after_id))
+    next_cursor = encode_cursor(users[limit - 1].id) if len(users) > limit else None
+    users = serialise_user_rows(users[:limit], fields)
+    return responder(code=OK, data=dict(users=users, next=next_cursor))
+
+
+def _starts_with(column, prefix):
+    """
+    :return: criterion that lower() of the column starts with the lower case prefix
+    """
+    lowered = func.lower(column)
+    if db.engine.dialect.name == 'postgresql':
+        # Served by the text_pattern_ops and trigram indexes. Other databases only use an index for
+        # LIKE on a plain column, so get the equivalent range below instead.
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return lowered.like(f'{escaped}%', escape='\\')
+    return and_(lowered >= prefix, lowered < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def get_user_by_id(public_id, fields=None):
+    fields = parse_user_fields(fields, FIELDS_INVALID)
     user_is_admin, user_sub = is_admin()
     if not user_is_admin:
         if public_id != user_sub:
             raise Unauthorized(CANNOT_VIEW_OTHERS)
-    return (responder(code=OK, data=dict(user=user))) if user else None
+    users = _select_users(_versioned(fields, User.public_id == public_id).limit(1))
+    if not users:
+        return None
+    check_etag(make_etag(public_id, fields, users[FIRST].version))
+    return responder(code=OK, data=dict(user=serialise_user_rows(users, fields)[FIRST]))
+
+
+def lookup_users(public_ids, fields=None):
+    """
+    Look up a batch of users by public id with one query. Admins may look up anyone, other users
+    only themselves, as with get_user_by_id.
+    :param public_ids: list of string public ids
+    :param fields: string of comma separated field names, defaults to username, public_id and email
+    :return: tuple of the JSend dict with the users keyed by public id, None for any not found, then
+    the HTTP code
+    :raise: werkzeug.BadRequest: if there are more public ids than the configured maximum
+    :raise: werkzeug.Unauthorized: if a non-admin looks up anyone but themselves
+    """
+    fields = parse_user_fields(fields, FIELDS_INVALID)
+    public_ids = list(dict.fromkeys(public_ids))
+    if len(public_ids) > current_app.config['USERS_LOOKUP_MAX_SIZE']:
+        raise BadRequest(LOOKUP_TOO_LARGE)
+    # Ids which are not UUIDs match no one, so are left out of the query rather than failing it.
+    guids = {public_id: parse_guid(public_id) for public_id in public_ids}
+    user_is_admin, user_sub = is_admin()
+    if not user_is_admin and set(guids.values()) != {user_sub}:
+        raise Unauthorized(CANNOT_VIEW_OTHERS)
+
+    found_fields = fields if 'public_id' in fields else fields + ('public_id',)
+    criterion = User.public_id.in_({guid for guid in guids.values() if guid})
+    rows = _select_users(query_users(found_fields, criterion)) if any(guids.values()) else []
+    found = {user['public_id']: user for user in serialise_user_rows(rows, found_fields)}
+    if found_fields != fields:
+        for user in found.values():
+            del user['public_id']
+    users = {public_id: found.get(guid) for public_id, guid in guids.items()}
+    return responder(code=OK, data=dict(users=users))
+
+
+def export_users(file_format, since=None):
+    """
+    Admins get every user, or those registered since a time, as NDJSON or CSV with the same fields
+    as listing users. The response is streamed from the database a chunk at a time, through a server
+    side cursor where the database has them, so memory use does not grow with the table. A database
+    error part way through aborts the response.
+    :param file_format: string 'ndjson' or 'csv'
+    :param since: datetime, only users registered at or after it are exported
+    :return: Flask streaming response
+    :raise: werkzeug.Unauthorized: if the user is not an admin
+    """
+    user_is_admin, _ = is_admin()
+    if not user_is_admin:
+        raise Unauthorized(ADMIN_REQUIRED)
+
+    if since and since.tzinfo:
+        since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    criteria = [User.registered_on >= since] if since else []
+    chunk_size = current_app.config['USERS_EXPORT_CHUNK_SIZE']
+    query = query_users(DEFAULT_USER_FIELDS, *criteria).order_by(User.id).yield_per(chunk_size)
+
+    def generate():
+        if file_format == 'csv':
+            yield _csv_line(DEFAULT_USER_FIELDS)
+        chunk = []
+        try:
+            for row in query:
+                chunk.append(row)
+                if len(chunk) == chunk_size:
+                    yield _export_chunk(chunk, file_format)
+                    chunk = []
+        except SQLAlchemyError as err:
+            # The response has started, so its status cannot change. Raising makes the server abort
+            # it before the final chunk, so the client sees a failed download, not a short export.
+            logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+            raise
+        if chunk:
+            yield _export_chunk(chunk, file_format)
+
+    logger.info(f"Exporting users as {file_format}" + (f" since {since}" if since else ""))
+    mimetype = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+
+def _export_chunk(rows, file_format):
+    users = serialise_user_rows(rows, DEFAULT_USER_FIELDS)
+    if file_format == 'csv':
+        return ''.join(_csv_line([user[field] for field in DEFAULT_USER_FIELDS]) for user in users)
+    return ''.join(json.dumps(user) + '\n' for user in users)
+
+
+def _csv_line(values):
+    line = io.StringIO()
+    csv.writer(line).writerow(values)
+    return line.getvalue()
+
+
+def _page(limit, cursor):
+    """
+    :return: tuple of the page size, defaulted and capped by the config, and the id the page starts
+    after, from the cursor, or None for the first page
+    """
+    limit = min(limit or current_app.config['USERS_PAGE_SIZE'],
+                current_app.config['USERS_PAGE_MAX_SIZE'])
+    return limit, decode_cursor(cursor, CURSOR_INVALID) if cursor else None
+
+
+def _page_query(query, limit, after_id):
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+    # One extra row shows whether another page follows.
+    return query.order_by(User.id).limit(limit + 1)
+
+
+def _versioned(fields, *criteria):
+    """
+    :return: query_users query which also selects each user's version, last so serialising the rows
+    leaves it out
+    """
+    return query_users(fields, *criteria).add_columns(User.version)
+
+
+def _versions(rows):
+    return [(row.id, row.version) for row in rows]
+
+
+def _select_users(query):
+    try:
+        return query.all()
+    except SQLAlchemyError as err:
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(GETTING_USERS) from None
 
 
 def is_admin():
@@ -111,8 +308,9 @@ def update_email(email):
     updated_user.email_confirmed_on = None
     updated_user.email_confirmation_sent_on = datetime.datetime.utcnow()
 
+    email_queued = queue_confirmation_email(updated_user.email)
     save_changes(updated_user)
-    send_confirmation_email(updated_user.email)
+    deliver_inline(email_queued)
 
     return responder(code=OK, data=dict(updated=_(EMAIL_UPDATED)))
 
@@ -141,6 +339,7 @@ def resend_confirmation_email(email):
     if user_to_resend.email_confirmed:
         raise Conflict(ACCOUNT_ALREADY_CONFIRMED)
     user_to_resend.email_confirmation_sent_on = datetime.datetime.utcnow()
+    email_queued = queue_confirmation_email(email)
     save_changes(user_to_resend)
-    send_confirmation_email(email)
+    deliver_inline(email_queued)
     return responder(code=OK, data=dict(resent=_(EMAIL_RESENT)))
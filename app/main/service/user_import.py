@@ -0,0 +1,316 @@
+# pylint: disable=logging-fstring-interpolation, missing-function-docstring
+
+"""
+Module for importing users in bulk, for example when onboarding a partner's accounts. Records are
+streamed from a NDJSON or CSV file with email, username and password fields and handled in batches:
+each batch is validated, its passwords hashed across a pool of processes and its rows inserted in
+one transaction. Postgres loads a batch with COPY, other databases with a single executemany insert.
+Unless they are imported as confirmed, the users' confirmation emails are queued in the email outbox
+in the same transaction, for the mail worker to send.
+
+Records which fail validation or clash with an existing user are written to a rejected file, without
+their passwords, once their batch is committed. A checkpoint is then written with the size of the
+rejected file, so an import which crashes can be run again to carry on from where it got to, without
+repeating the rejects of the batch it crashed in.
+"""
+
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from sqlalchemy import or_, text
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import InternalServerError
+
+from app.email_client import queue_confirmation_emails
+from app.i18n.base import GETTING_USERS, SAVING_TO_DATABASE
+from app.main import db, hashing
+from app.main.data.dto import USERNAME_EMAIL_MINIMUM_LENGTH
+from app.main.model.user import User
+from app.security import PasswordValidator
+
+FORMATS = ('ndjson', 'csv')
+IMPORT_FIELDS = ('email', 'username', 'password')
+COLUMNS = (
+    'email', 'username', 'public_id', 'password_hash', 'registered_on', 'admin',
+    'email_confirmed', 'email_confirmed_on', 'email_confirmation_sent_on', 'token_generation',
+)
+HASH_CHUNKS_PER_WORKER = 4
+# Reasons given in the rejected file. It is for operators, so is not localised.
+MALFORMED = 'Record malformed: email, username and password are required'
+USER_EXISTS = 'User exists with this email or username'
+
+logger = logging.getLogger('api-skeleton')
+
+
+def import_users(path, file_format=None, batch_size=None, workers=None, confirmed=False,
+                 rejected_path=None, checkpoint_path=None, progress=None):
+    """
+    Pass the path of a NDJSON or CSV file of users to import them.
+    :param path: string path of the file to import
+    :param file_format: 'ndjson' or 'csv', defaults to the file's extension
+    :param batch_size: int users inserted per transaction, defaults to the configured size
+    :param workers: int processes hashing passwords, defaults to HASH_WORKERS; 0 hashes inline
+    :param confirmed: boolean of whether the imported users' emails are treated as confirmed
+    :param rejected_path: string path rejected records are appended to, defaults beside the file
+    :param checkpoint_path: string path of the checkpoint, defaults beside the file
+    :param progress: callable passed the running totals after each batch
+    :return: dict of the records imported, rejected and skipped, the seconds taken and the rate
+    :raise: werkzeug.InternalServerError: if a SQLAlchemyError is caught
+    """
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.').lower()
+    if file_format not in FORMATS:
+        raise ValueError(f"Unknown import format: {file_format}")
+    batch_size = batch_size or current_app.config['USER_IMPORT_BATCH_SIZE']
+    workers = current_app.config['HASH_WORKERS'] if workers is None else workers
+    rejected_path = rejected_path or f'{path}.rejected.ndjson'
+    checkpoint_path = checkpoint_path or f'{path}.checkpoint'
+
+    totals = dict(imported=0, rejected=0, skipped=0)
+    totals.update(_read_checkpoint(checkpoint_path))
+    resume_after = totals.pop('record', 0)
+    rejected_size = totals.pop('rejected_size', None)
+    start = (time.perf_counter(), totals['imported'])
+    pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+    try:
+        with open(path, newline='') as source, open(rejected_path, 'a') as rejected:
+            if rejected_size is not None:
+                # Drops anything written after the checkpoint by the run which crashed.
+                rejected.truncate(rejected_size)
+            batch = []
+            for number, record in _read_records(source, file_format):
+                if number <= resume_after:
+                    totals['skipped'] += 1
+                    continue
+                batch.append((number, record))
+                if len(batch) == batch_size:
+                    _import_batch(batch, pool, workers, confirmed, rejected, totals)
+                    _write_checkpoint(checkpoint_path, number, totals, rejected.tell())
+                    _report(progress, totals, start)
+                    batch = []
+            if batch:
+                _import_batch(batch, pool, workers, confirmed, rejected, totals)
+                _write_checkpoint(checkpoint_path, batch[-1][0], totals, rejected.tell())
+                _report(progress, totals, start)
+    finally:
+        if pool:
+            pool.shutdown()
+
+    # Finished, so there is nothing to resume. Running the import again starts from the beginning.
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return _with_rate(totals, start)
+
+
+def _read_records(source, file_format):
+    """
+    :return: generator of (record number, dict) pairs, numbered from 1. A record which cannot be
+    parsed is None.
+    """
+    if file_format == 'csv':
+        yield from enumerate(csv.DictReader(source), start=1)
+        return
+    number = 0
+    for line in source:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+def _import_batch(batch, pool, workers, confirmed, rejected, totals):
+    accepted, seen, rejects = [], set(), []
+    for number, record in batch:
+        reason = _validate(record)
+        if not reason and (record['email'] in seen or record['username'] in seen):
+            reason = USER_EXISTS
+        if reason:
+            _reject(rejects, number, record, reason)
+            continue
+        seen.update((record['email'], record['username']))
+        accepted.append((number, record))
+
+    postgres = db.engine.dialect.name == 'postgresql'
+    if not postgres:
+        # Postgres skips clashes as it inserts. Elsewhere they are found first, so the whole batch
+        # can go in one executemany and no time is spent hashing passwords which will be rejected.
+        existing = _existing(record for _, record in accepted)
+        new = []
+        for number, record in accepted:
+            if record['email'] in existing or record['username'] in existing:
+                _reject(rejects, number, record, USER_EXISTS)
+            else:
+                new.append((number, record))
+        accepted = new
+
+    password_hashes = _hash_passwords([record['password'] for _, record in accepted], pool, workers)
+    now = datetime.datetime.utcnow()
+    rows = [
+        dict(
+            email=record['email'],
+            username=record['username'],
+            public_id=str(uuid.uuid4()),
+            password_hash=password_hash,
+            registered_on=now,
+            admin=False,
+            email_confirmed=confirmed,
+            email_confirmed_on=now if confirmed else None,
+            email_confirmation_sent_on=None if confirmed else now,
+            token_generation=0,
+        )
+        for (_, record), password_hash in zip(accepted, password_hashes)
+    ]
+
+    try:
+        inserted = _copy_rows(rows) if postgres else _insert_rows(rows)
+        if not confirmed:
+            queue_confirmation_emails(inserted)
+        db.session.commit()
+    except SQLAlchemyError as err:
+        db.session.rollback()
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(SAVING_TO_DATABASE) from None
+
+    for number, record in accepted:
+        if record['email'] not in inserted:
+            _reject(rejects, number, record, USER_EXISTS)
+    rejected.writelines(rejects)
+    rejected.flush()
+    totals['imported'] += len(inserted)
+    totals['rejected'] += len(rejects)
+    if inserted:
+        User.users_seen = True
+
+
+def _validate(record):
+    """
+    :return: string of why the record cannot be imported, or None if it can
+    """
+    if record is None or not all(isinstance(record.get(field), str) for field in IMPORT_FIELDS):
+        return MALFORMED
+    for field in ['email', 'username']:
+        if len(record[field]) < USERNAME_EMAIL_MINIMUM_LENGTH:
+            return MALFORMED
+    if len(record['username']) > User.username.type.length:
+        return MALFORMED
+    if len(record['email']) > User.email.type.length:
+        return MALFORMED
+    password_invalid = PasswordValidator().validate_password(record['password'])
+    return ' '.join(password_invalid) if password_invalid else None
+
+
+def _existing(records):
+    records = list(records)
+    if not records:
+        return set()
+    emails = [record['email'] for record in records]
+    usernames = [record['username'] for record in records]
+    try:
+        found = db.session.query(User.email, User.username).filter(
+            or_(User.email.in_(emails), User.username.in_(usernames))
+        ).all()
+    except SQLAlchemyError as err:
+        logger.critical(f"SQLAlchemyError: {err}", exc_info=True)
+        raise InternalServerError(GETTING_USERS) from None
+    return {value for row in found for value in row}
+
+
+def _hash_passwords(passwords, pool, workers):
+    if not pool:
+        return [hashing.hasher.hash(password) for password in passwords]
+    chunksize = max(len(passwords) // (workers * HASH_CHUNKS_PER_WORKER), 1)
+    return list(pool.map(hashing.hasher.hash, passwords, chunksize=chunksize))
+
+
+def _insert_rows(rows):
+    """
+    :return: set of the emails inserted
+    """
+    if rows:
+        db.session.execute(User.__table__.insert(), rows)
+    return {row['email'] for row in rows}
+
+
+def _copy_rows(rows):
+    """
+    COPY the rows into a temporary staging table, then move them across in one statement which
+    skips any that clash with existing users.
+    :return: set of the emails inserted
+    """
+    if not rows:
+        return set()
+    columns = ', '.join(COLUMNS)
+    db.session.execute(text(
+        f'CREATE TEMPORARY TABLE IF NOT EXISTS user_import ON COMMIT DELETE ROWS AS '
+        f'SELECT {columns} FROM "user" WITH NO DATA'
+    ))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in COLUMNS])  # None is written as NULL.
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(f'COPY user_import ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    inserted = db.session.execute(text(
+        f'INSERT INTO "user" ({columns}) SELECT {columns} FROM user_import '
+        f'ON CONFLICT DO NOTHING RETURNING email'
+    ))
+    return {email for (email,) in inserted}
+
+
+def _reject(rejects, number, record, reason):
+    entry = dict(record=number, reason=reason)
+    if record:
+        entry.update({field: record.get(field) for field in IMPORT_FIELDS if field != 'password'})
+    rejects.append(json.dumps(entry) + '\n')
+
+
+def _read_checkpoint(checkpoint_path):
+    """
+    :return: dict of the last committed record number, the totals up to it and the size of the
+    rejected file then, empty if none
+    """
+    if not os.path.exists(checkpoint_path):
+        return dict()
+    with open(checkpoint_path) as checkpoint:
+        saved = json.load(checkpoint)
+    logger.info(f"Resuming import after record {saved['record']}")
+    return dict(
+        record=saved['record'], imported=saved['imported'], rejected=saved['rejected'],
+        rejected_size=saved.get('rejected_size'),
+    )
+
+
+def _write_checkpoint(checkpoint_path, number, totals, rejected_size):
+    # Written to a temporary file and renamed over the old one, so a crash never leaves half of it.
+    partial = f'{checkpoint_path}.partial'
+    with open(partial, 'w') as checkpoint:
+        json.dump(dict(record=number, imported=totals['imported'], rejected=totals['rejected'],
+                       rejected_size=rejected_size), checkpoint)
+    os.replace(partial, checkpoint_path)
+
+
+def _report(progress, totals, start):
+    summary = _with_rate(totals, start)
+    logger.info(f"Imported {summary['imported']} users at {summary['rate']:.0f} users/s")
+    if progress:
+        progress(summary)
+
+
+def _with_rate(totals, start):
+    # The rate only counts this run, not users imported before resuming from a checkpoint.
+    started, imported_before = start
+    seconds = time.perf_counter() - started
+    rate = (totals['imported'] - imported_before) / seconds if seconds else 0.0
+    return dict(totals, seconds=seconds, rate=rate)
@@ -0,0 +1,112 @@
+# pylint: disable=invalid-name, missing-function-docstring
+
+"""
+A small in-process metrics registry. Counters, gauges and timings are recorded by name and a
+snapshot of everything can be taken at any time, for example by the metrics endpoint. Components
+which already keep their own statistics, such as caches, register a collector which is called when
+the snapshot is taken. Metrics are per worker process.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Upper bounds, in milliseconds, of the timing histogram buckets.
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+MS_PER_SECOND = 1000
+
+
+class Timing:
+    """Count, total, maximum and histogram of observed durations."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, seconds):
+        milliseconds = seconds * MS_PER_SECOND
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, milliseconds)] += 1
+
+    def snapshot(self):
+        labels = [f'le_{bound}ms' for bound in BUCKETS_MS] + ['le_inf']
+        return dict(
+            count=self.count,
+            mean_ms=round(self.total / self.count, 3) if self.count else 0.0,
+            max_ms=round(self.max, 3),
+            buckets=dict(zip(labels, self.buckets)),
+        )
+
+
+class Metrics:
+    """Thread safe registry of named counters, gauges, timings and collectors."""
+
+    def __init__(self):
+        self._counters = dict()
+        self._gauges = dict()
+        self._timings = dict()
+        self._collectors = dict()
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self._timings.setdefault(name, Timing()).observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def register(self, name, collector):
+        """
+        Pass a name and a callable returning a dict. The callable's result is included in every
+        snapshot under the name.
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = dict(
+                counters=dict(self._counters),
+                gauges=dict(self._gauges),
+                timings={name: timing.snapshot() for name, timing in self._timings.items()},
+            )
+            collectors = dict(self._collectors)
+        snapshot.update({name: collector() for name, collector in collectors.items()})
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timings.clear()
+
+
+metrics = Metrics()
@@ -2,14 +2,18 @@
 Consolidates all HTTP responses the app uses. The constants are named the same as the HTTP status
 codes, but this gives the ability to see at a glance all codes returned by the app. A helper
 function is called for all responses from the app. Passing the HTTP code and optionally some data
-creates a uniform dict response
+creates a uniform dict response. GET routes can be made conditional on an ETag with a decorator.
 """
 
+import functools
 from http import HTTPStatus
 
+from flask import g, Response, request
 from flask._compat import text_type as _
+from flask_restx.utils import unpack
+from werkzeug.http import quote_etag
 
-from app.i18n.base import ERROR, FAIL, SUCCESS, UNKNOWN
+from app.i18n.base import ERROR, FAIL, SUCCESS, UNAVAILABLE, UNKNOWN
 
 # HTTP codes
 # Success
@@ -17,6 +21,10 @@ from app.i18n.base import ERROR, FAIL, SUCCESS, UNKNOWN
 OK = int(HTTPStatus.OK)  # 200
 CREATED = int(HTTPStatus.CREATED)  # 201
 
+# Redirection
+# 3xx
+NOT_MODIFIED = int(HTTPStatus.NOT_MODIFIED)  # 304
+
 # Fail
 # 4xx
 BAD_REQUEST = int(HTTPStatus.BAD_REQUEST)  # 400
@@ -24,17 +32,20 @@ UNAUTHORIZED = int(HTTPStatus.UNAUTHORIZED)  # 401
 NOT_FOUND = int(HTTPStatus.NOT_FOUND)  # 404
 CONFLICT = int(HTTPStatus.CONFLICT)  # 409
 UNPROCESSABLE_ENTITY = int(HTTPStatus.UNPROCESSABLE_ENTITY)  # 422
+TOO_MANY_REQUESTS = int(HTTPStatus.TOO_MANY_REQUESTS)  # 429
 
 # Error
 # 5xx
 INTERNAL_SERVER_ERROR = int(HTTPStatus.INTERNAL_SERVER_ERROR)  # 500
+SERVICE_UNAVAILABLE = int(HTTPStatus.SERVICE_UNAVAILABLE)  # 503
 
 
 def responder(code, data=None):
     """
     Pass in the HTTP code to be returned and optionally data and a dictionary is returned. 2xx codes
     will return a success; 4xx will return a failure; 5xx will return an error. 2xx and 4xx use the
-    data, while 5xx will generate a message instead per the JSend spec.
+    data, while 5xx will generate a message instead per the JSend spec. A 503 keeps its code so
+    clients know to retry; any other 5xx is reported as a 500.
     :param code: int of a HTTP status code
     :param data: dict of data to optionally add to the response
     :return: tuple of dict containing a status message (with possible data/message), then HTTP code
@@ -43,4 +54,49 @@ def responder(code, data=None):
         return dict(status=_(SUCCESS), data=data), code
     if BAD_REQUEST <= code < INTERNAL_SERVER_ERROR:
         return dict(status=_(FAIL), data=data), code
+    if code == SERVICE_UNAVAILABLE:
+        return dict(status=_(ERROR), message=_(UNAVAILABLE)), SERVICE_UNAVAILABLE
     return dict(status=_(ERROR), message=UNKNOWN), INTERNAL_SERVER_ERROR
+
+
+class NotModified(Exception):
+    """Raised by check_etag when the client already holds the representation, for conditional."""
+
+    def __init__(self, etag):
+        super().__init__(etag)
+        self.etag = etag
+
+
+def check_etag(etag):
+    """
+    Pass the strong ETag of the rows a conditional route has read, before serialising them. The
+    ETag describes exactly what the route then returns, as both come from the same read.
+    :param etag: string ETag
+    :raise: NotModified: if the client already holds it, so the route serialises nothing
+    """
+    if request.if_none_match.contains(etag):
+        raise NotModified(etag)
+    g.etag = etag
+
+
+def conditional(func):
+    """
+    Decorator for GET routes which makes them conditional on a strong ETag. The route calls
+    check_etag once it has read its rows, so a client which already holds the current
+    representation gets a HTTP 304 before anything is serialised or marshalled. Otherwise a
+    successful response is tagged. Place it outside marshal_with so it sees the marshalled
+    response.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        g.pop('etag', None)
+        try:
+            data, code, headers = unpack(func(*args, **kwargs))
+        except NotModified as unchanged:
+            return Response(status=NOT_MODIFIED, headers=dict(ETag=quote_etag(unchanged.etag)))
+        etag = g.pop('etag', None)
+        headers = dict(headers or {})
+        if code == OK and etag is not None:
+            headers['ETag'] = quote_etag(etag)
+        return data, code, headers
+    return wrapper
@@ -4,6 +4,7 @@
 Utilities for increasing security in the package.
 """
 
+import hashlib
 import logging
 from string import ascii_lowercase, ascii_uppercase, digits
 
@@ -28,6 +29,19 @@ def remove(payload, to_remove):
     return {k: v for k, v in payload.items() if k not in to_remove}
 
 
+def digest_token(token):
+    """
+    Hash a token to a fixed width key so it can be stored and compared compactly. For example, the
+    JWT blacklist is keyed on this rather than the full token.
+
+    :param token: Token to hash e.g. a JWT
+    :type token: :class: `str`
+    :return: SHA-256 digest of the token
+    :rtype: :class: `bytes`
+    """
+    return hashlib.sha256(str(token).encode('utf-8')).digest()
+
+
 class PasswordValidator:
     # Liberally stolen from here:
     # https://codereview.stackexchange.com/questions/165187/password-checker-in-python
@@ -0,0 +1,133 @@
+# pylint: disable=logging-fstring-interpolation, missing-function-docstring
+
+"""
+Keeps a small pool of open, authenticated SMTP connections per worker process, so sending an email
+does not cost a new connection, TLS handshake and login each time. A connection which has sat idle
+for longer than SMTP_POOL_IDLE_TIMEOUT is closed rather than reused, before the server drops it,
+and one idle for more than SMTP_POOL_CHECK_AFTER is checked with a NOOP first. A send which fails
+because the connection has gone is retried once on a new connection.
+"""
+
+import logging
+import smtplib
+import threading
+import time
+from collections import deque
+
+from flask_mail import Connection
+
+from app.metrics import metrics
+
+logger = logging.getLogger('api-skeleton')
+
+SMTP_OK = 250
+# Raised when the server has dropped the connection, so sending again on a new one may succeed.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError)
+
+
+class SMTPPool:
+    """
+    Flask extension which sends Flask-Mail messages over pooled connections. At most
+    SMTP_POOL_SIZE connections are open at once; further sends wait for one to be free.
+    """
+
+    def __init__(self, app=None):
+        self.state = None
+        self.idle_timeout = None
+        self.check_after = None
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = None
+        self._stats = dict(opened=0, reused=0, reconnected=0, closed=0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Flask-Mail must be initialised first: its state holds the server and credentials.
+        self.state = app.extensions['mail']
+        self.idle_timeout = app.config['SMTP_POOL_IDLE_TIMEOUT']
+        self.check_after = app.config['SMTP_POOL_CHECK_AFTER']
+        self._slots = threading.BoundedSemaphore(app.config['SMTP_POOL_SIZE'])
+        app.extensions['smtp-pool'] = self
+        metrics.register('smtp_pool', self.stats)
+
+    def send(self, message):
+        """
+        Send a message on a pooled connection, opening one if none is free.
+        :param message: flask_mail.Message
+        :raise: smtplib.SMTPException or OSError: if the message could not be sent
+        """
+        with self._slots:
+            connection = self._checkout()
+            try:
+                connection.send(message)
+            except CONNECTION_ERRORS as err:
+                logger.info(f"SMTP connection lost, reconnecting: {err}")
+                self._close(connection)
+                self._count('reconnected')
+                connection = self._open()
+                try:
+                    connection.send(message)
+                except Exception:
+                    self._close(connection)
+                    raise
+            except Exception:
+                # The server may have been left part way through the message, so start afresh.
+                self._close(connection)
+                raise
+            with self._lock:
+                self._idle.append((connection, time.monotonic()))
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for connection, _ in idle:
+            self._close(connection)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, idle=len(self._idle))
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                # The most recently used connection is the likeliest to still be open.
+                connection, last_used = self._idle.pop()
+            idle_for = time.monotonic() - last_used
+            if idle_for > self.idle_timeout:
+                self._close(connection)
+            elif idle_for > self.check_after and not self._healthy(connection):
+                self._close(connection)
+            else:
+                self._count('reused')
+                return connection
+        return self._open()
+
+    def _open(self):
+        connection = Connection(self.state).__enter__()  # pylint: disable=unnecessary-dunder-call
+        self._count('opened')
+        return connection
+
+    @staticmethod
+    def _healthy(connection):
+        if connection.host is None:
+            return True  # Sending is suppressed, as in testing.
+        try:
+            return connection.host.noop()[0] == SMTP_OK
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _close(self, connection):
+        self._count('closed')
+        if connection.host is None:
+            return
+        try:
+            connection.host.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.host.close()
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
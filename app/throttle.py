@@ -0,0 +1,170 @@
+# pylint: disable=logging-fstring-interpolation, missing-function-docstring
+
+"""
+Throttles failed logins. Failures are counted per email address and per client IP over a sliding
+window. Once either count reaches its threshold, further logins for that email or from that IP are
+rejected with a HTTP 429 before any database query or password hash is made, so brute forcing an
+account no longer costs the server a bcrypt check per request.
+
+Counters live in a pluggable store. The memory store is per worker process. The SQLite store keeps
+them in a file, ideally on a tmpfs such as /dev/shm, so every worker on the node sees the same
+counts.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+from werkzeug.exceptions import TooManyRequests
+
+from app.cache import SQLiteConnections
+from app.i18n.base import LOGIN_THROTTLED
+from app.metrics import metrics
+
+logger = logging.getLogger('api-skeleton')
+
+# Stores are swept of expired failures every this many recorded failures.
+SWEEP_EVERY = 1000
+
+
+class MemoryStore:
+    """Failure timestamps per key, held in this worker process."""
+
+    def __init__(self):
+        self._failures = dict()
+        self._recorded = 0
+        self._lock = threading.Lock()
+
+    def record(self, key, at):
+        with self._lock:
+            self._failures.setdefault(key, deque()).append(at)
+            self._recorded += 1
+            return self._recorded % SWEEP_EVERY == 0
+
+    def window(self, key, since):
+        """
+        :return: tuple of the number of failures for the key since the given time and the oldest
+        """
+        with self._lock:
+            failures = self._failures.get(key)
+            while failures and failures[0] < since:
+                failures.popleft()
+            if not failures:
+                self._failures.pop(key, None)
+                return 0, None
+            return len(failures), failures[0]
+
+    def clear(self, key):
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def sweep(self, before):
+        with self._lock:
+            for key in list(self._failures):
+                failures = self._failures[key]
+                while failures and failures[0] < before:
+                    failures.popleft()
+                if not failures:
+                    del self._failures[key]
+
+
+class SQLiteStore:
+    """
+    Failure timestamps per key, held in a SQLite file shared by every worker process on the node.
+    Each thread opens its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._recorded = 0
+        self._execute = SQLiteConnections(path).execute
+        self._execute(
+            'CREATE TABLE IF NOT EXISTS login_failures (key TEXT NOT NULL, at REAL NOT NULL)'
+        )
+        self._execute(
+            'CREATE INDEX IF NOT EXISTS ix_login_failures_key_at ON login_failures (key, at)'
+        )
+
+    def record(self, key, at):
+        self._execute('INSERT INTO login_failures (key, at) VALUES (?, ?)', (key, at))
+        self._recorded += 1
+        return self._recorded % SWEEP_EVERY == 0
+
+    def window(self, key, since):
+        return self._execute(
+            'SELECT COUNT(*), MIN(at) FROM login_failures WHERE key = ? AND at >= ?', (key, since)
+        ).fetchone()
+
+    def clear(self, key):
+        self._execute('DELETE FROM login_failures WHERE key = ?', (key,))
+
+    def sweep(self, before):
+        self._execute('DELETE FROM login_failures WHERE at < ?', (before,))
+
+
+class LoginThrottle:
+    """
+    Flask extension which counts failed logins per email and per client IP and rejects logins once
+    either has failed too often within the window. A successful login clears its email's count.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.window = 0
+        self.max_per_email = 0
+        self.max_per_ip = 0
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['LOGIN_THROTTLE_ENABLED']
+        self.window = app.config['LOGIN_THROTTLE_WINDOW']
+        self.max_per_email = app.config['LOGIN_THROTTLE_MAX_PER_EMAIL']
+        self.max_per_ip = app.config['LOGIN_THROTTLE_MAX_PER_IP']
+        path = app.config['LOGIN_THROTTLE_STORE_PATH']
+        self.store = SQLiteStore(path) if path else MemoryStore()
+        app.extensions['login-throttle'] = self
+
+    def check(self, email, ip_address):
+        """
+        Pass the email and client IP of a login attempt to check it may go ahead.
+        :raise: werkzeug.TooManyRequests: with a retry_after in seconds, if either is throttled
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        for key, limit in self._limits(email, ip_address):
+            count, oldest = self.store.window(key, now - self.window)
+            if count >= limit:
+                metrics.increment('login_throttled')
+                logger.warning(f"Login throttled after {count} failures: {key.split(':')[0]}")
+                error = TooManyRequests(LOGIN_THROTTLED)
+                # The window slides: a slot frees up when the oldest failure in it ages out.
+                error.retry_after = max(int(oldest + self.window - now) + 1, 1)
+                raise error
+
+    def record_failure(self, email, ip_address):
+        if not self.enabled:
+            return
+        now = time.time()
+        should_sweep = False
+        for key, _ in self._limits(email, ip_address):
+            should_sweep = self.store.record(key, now) or should_sweep
+        if should_sweep:
+            self.store.sweep(now - self.window)
+
+    def reset(self, email):
+        if self.enabled:
+            self.store.clear(self._email_key(email))
+
+    def _limits(self, email, ip_address):
+        return [
+            (self._email_key(email), self.max_per_email),
+            (f'ip:{ip_address}', self.max_per_ip),
+        ]
+
+    @staticmethod
+    def _email_key(email):
+        return f"email:{str(email or '').strip().lower()}"
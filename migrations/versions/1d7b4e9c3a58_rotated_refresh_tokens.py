@@ -0,0 +1,36 @@
+"""Keep rotated refresh tokens
+
+Revision ID: 1d7b4e9c3a58
+Revises: 8b5d3f7a2e69
+Create Date: 2026-10-18 23:12:05.518930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d7b4e9c3a58'
+down_revision = '8b5d3f7a2e69'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'rotated_refresh_tokens',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('token_digest', sa.LargeBinary(length=32), nullable=False),
+        sa.Column('session_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['session_id'], ['refresh_tokens.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('token_digest'),
+    )
+    op.create_index(
+        'ix_rotated_refresh_tokens_session_id', 'rotated_refresh_tokens', ['session_id']
+    )
+
+
+def downgrade():
+    op.drop_index('ix_rotated_refresh_tokens_session_id', table_name='rotated_refresh_tokens')
+    op.drop_table('rotated_refresh_tokens')
@@ -0,0 +1,132 @@
+"""Add blacklist expiry and partition by day on Postgres
+
+Revision ID: 2c8d2d175b0c
+Revises: 2dfa742af9c8
+Create Date: 2026-10-18 10:03:17.228406
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c8d2d175b0c'
+down_revision = '2dfa742af9c8'
+branch_labels = None
+depends_on = None
+
+# Tokens blacklisted before this revision were issued with the one day lifetime in force then.
+LEGACY_JWT_EXPIRES = datetime.timedelta(days=1)
+PARTITION_DAYS_AHEAD = 7
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        _partition_postgres()
+        return
+
+    op.add_column('blacklist_tokens', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    # Worked out in Python, as each database writes date arithmetic differently.
+    bind = op.get_bind()
+    rows = bind.execute(sa.text('SELECT id, blacklisted_on FROM blacklist_tokens').columns(
+        id=sa.Integer(), blacklisted_on=sa.DateTime()
+    )).fetchall()
+    set_expiry = sa.text(
+        'UPDATE blacklist_tokens SET expires_at = :expires_at WHERE id = :id'
+    ).bindparams(sa.bindparam('expires_at', type_=sa.DateTime()))
+    if rows:
+        bind.execute(set_expiry, [
+            dict(id=row_id, expires_at=blacklisted_on + LEGACY_JWT_EXPIRES)
+            for row_id, blacklisted_on in rows
+        ])
+    with op.batch_alter_table('blacklist_tokens') as batch_op:
+        batch_op.alter_column('expires_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_index('ix_blacklist_tokens_expires_at', ['expires_at'])
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        _unpartition_postgres()
+        return
+
+    with op.batch_alter_table('blacklist_tokens') as batch_op:
+        batch_op.drop_index('ix_blacklist_tokens_expires_at')
+        batch_op.drop_column('expires_at')
+
+
+def _partition_postgres():
+    # A partitioned table's unique constraints must include the partition key. A token has a single
+    # expiry, so uniqueness of (token_digest, expires_at) still means one row per token.
+    _rename_table('blacklist_tokens', 'blacklist_tokens_old')
+    op.execute(
+        'CREATE TABLE blacklist_tokens ('
+        'id SERIAL NOT NULL, '
+        'token_digest BYTEA NOT NULL, '
+        'blacklisted_on TIMESTAMP WITHOUT TIME ZONE NOT NULL, '
+        'expires_at TIMESTAMP WITHOUT TIME ZONE NOT NULL, '
+        'PRIMARY KEY (id, expires_at), '
+        'CONSTRAINT uq_blacklist_tokens_token_digest UNIQUE (token_digest, expires_at)'
+        ') PARTITION BY RANGE (expires_at)'
+    )
+    op.execute('CREATE TABLE blacklist_tokens_default PARTITION OF blacklist_tokens DEFAULT')
+    op.create_index('ix_blacklist_tokens_expires_at', 'blacklist_tokens', ['expires_at'])
+
+    today = datetime.datetime.utcnow().date()
+    for offset in range(PARTITION_DAYS_AHEAD):
+        day = today + datetime.timedelta(days=offset)
+        next_day = day + datetime.timedelta(days=1)
+        op.execute(
+            f'CREATE TABLE blacklist_tokens_p{day.strftime("%Y%m%d")} '
+            f'PARTITION OF blacklist_tokens '
+            f"FOR VALUES FROM ('{day.isoformat()}') TO ('{next_day.isoformat()}')"
+        )
+
+    # Rows whose tokens have already expired are not worth carrying over.
+    expires_at = f"blacklisted_on + interval '{LEGACY_JWT_EXPIRES.days} days'"
+    op.execute(
+        'INSERT INTO blacklist_tokens (id, token_digest, blacklisted_on, expires_at) '
+        f'SELECT id, token_digest, blacklisted_on, {expires_at} FROM blacklist_tokens_old '
+        f"WHERE {expires_at} > now() at time zone 'utc'"
+    )
+    op.execute(
+        "SELECT setval('blacklist_tokens_id_seq', "
+        '(SELECT COALESCE(MAX(id), 0) + 1 FROM blacklist_tokens_old), false)'
+    )
+    op.execute('DROP TABLE blacklist_tokens_old')
+
+
+def _unpartition_postgres():
+    _rename_table('blacklist_tokens', 'blacklist_tokens_partitioned')
+    op.execute(
+        'ALTER INDEX ix_blacklist_tokens_expires_at RENAME TO ix_blacklist_tokens_p_expires_at'
+    )
+    op.create_table(
+        'blacklist_tokens',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('blacklisted_on', sa.DateTime(), nullable=False),
+        sa.Column('token_digest', sa.LargeBinary(length=32), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('token_digest', name='uq_blacklist_tokens_token_digest'),
+    )
+    op.execute(
+        'INSERT INTO blacklist_tokens (id, blacklisted_on, token_digest) '
+        'SELECT id, blacklisted_on, token_digest FROM blacklist_tokens_partitioned'
+    )
+    op.execute(
+        "SELECT setval('blacklist_tokens_id_seq', "
+        '(SELECT COALESCE(MAX(id), 0) + 1 FROM blacklist_tokens_partitioned), false)'
+    )
+    op.execute('DROP TABLE blacklist_tokens_partitioned')
+
+
+def _rename_table(old, new):
+    # Index, constraint and sequence names are not renamed with their table. Rename them too so the
+    # replacement table can reuse the original names.
+    op.execute(f'ALTER TABLE {old} RENAME TO {new}')
+    op.execute(f'ALTER SEQUENCE {old}_id_seq RENAME TO {new}_id_seq')
+    op.execute(f'ALTER TABLE {new} RENAME CONSTRAINT {old}_pkey TO {new}_pkey')
+    op.execute(
+        f'ALTER TABLE {new} RENAME CONSTRAINT uq_{old}_token_digest TO uq_{new}_token_digest'
+    )
@@ -0,0 +1,74 @@
+"""Key blacklist on token digest
+
+Revision ID: 2dfa742af9c8
+Revises: cae0c3896e4a
+Create Date: 2026-10-18 09:12:41.503118
+
+"""
+import hashlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2dfa742af9c8'
+down_revision = 'cae0c3896e4a'
+branch_labels = None
+depends_on = None
+
+TOKEN_DIGEST_SIZE = 32
+
+blacklist_tokens = sa.table(
+    'blacklist_tokens',
+    sa.column('id', sa.Integer()),
+    sa.column('token', sa.String(length=500)),
+    sa.column('token_digest', sa.LargeBinary(length=TOKEN_DIGEST_SIZE)),
+)
+
+
+def upgrade():
+    op.add_column(
+        'blacklist_tokens',
+        sa.Column('token_digest', sa.LargeBinary(length=TOKEN_DIGEST_SIZE), nullable=True)
+    )
+
+    # Backfill the digest of every existing token before the full tokens are dropped.
+    connection = op.get_bind()
+    rows = connection.execute(sa.select([blacklist_tokens.c.id, blacklist_tokens.c.token]))
+    for row_id, token in rows.fetchall():
+        connection.execute(
+            blacklist_tokens.update()
+            .where(blacklist_tokens.c.id == row_id)
+            .values(token_digest=hashlib.sha256(token.encode('utf-8')).digest())
+        )
+
+    with op.batch_alter_table('blacklist_tokens') as batch_op:
+        batch_op.alter_column(
+            'token_digest', existing_type=sa.LargeBinary(length=TOKEN_DIGEST_SIZE), nullable=False
+        )
+        batch_op.create_unique_constraint('uq_blacklist_tokens_token_digest', ['token_digest'])
+        batch_op.drop_column('token')
+
+
+def downgrade():
+    # Full tokens cannot be recovered from their digest. The hex digest is stored instead so the
+    # unique, non-null constraint holds; those rows will simply never match a presented token.
+    op.add_column('blacklist_tokens', sa.Column('token', sa.String(length=500), nullable=True))
+
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select([blacklist_tokens.c.id, blacklist_tokens.c.token_digest])
+    )
+    for row_id, digest in rows.fetchall():
+        connection.execute(
+            blacklist_tokens.update()
+            .where(blacklist_tokens.c.id == row_id)
+            .values(token=bytes(digest).hex())
+        )
+
+    with op.batch_alter_table('blacklist_tokens') as batch_op:
+        batch_op.alter_column('token', existing_type=sa.String(length=500), nullable=False)
+        batch_op.create_unique_constraint('uq_blacklist_tokens_token', ['token'])
+        batch_op.drop_constraint('uq_blacklist_tokens_token_digest', type_='unique')
+        batch_op.drop_column('token_digest')
@@ -0,0 +1,28 @@
+"""Add user token generation
+
+Revision ID: 3e7a9c2d5f10
+Revises: 9f4c1a8e2b6d
+Create Date: 2026-10-18 14:02:31.904117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e7a9c2d5f10'
+down_revision = '9f4c1a8e2b6d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'user',
+        sa.Column('token_generation', sa.Integer(), server_default='0', nullable=False),
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('token_generation')
@@ -0,0 +1,45 @@
+"""Add user search indexes
+
+Revision ID: 4a8f2c6e1b93
+Revises: 7d2e4b6a1c85
+Create Date: 2026-10-18 18:12:44.905126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a8f2c6e1b93'
+down_revision = '7d2e4b6a1c85'
+branch_labels = None
+depends_on = None
+
+SEARCHED_COLUMNS = ('username', 'email')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # text_pattern_ops lets LIKE 'prefix%' use the B-tree whatever the database's collation.
+        # The trigram indexes also serve LIKE, and leave room for matching within values later.
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in SEARCHED_COLUMNS:
+            op.execute(
+                f'CREATE INDEX ix_user_{column}_lower ON "user" (lower({column}) text_pattern_ops)'
+            )
+            op.execute(
+                f'CREATE INDEX ix_user_{column}_trgm ON "user" '
+                f'USING gin (lower({column}) gin_trgm_ops)'
+            )
+        return
+
+    for column in SEARCHED_COLUMNS:
+        op.create_index(f'ix_user_{column}_lower', 'user', [sa.text(f'lower({column})')])
+
+
+def downgrade():
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    for column in SEARCHED_COLUMNS:
+        if postgres:
+            op.drop_index(f'ix_user_{column}_trgm', table_name='user')
+        op.drop_index(f'ix_user_{column}_lower', table_name='user')
@@ -0,0 +1,36 @@
+"""Widen password hash for encoded algorithm parameters
+
+Revision ID: 5b1e7d3c9a42
+Revises: 2c8d2d175b0c
+Create Date: 2026-10-18 11:42:05.613927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e7d3c9a42'
+down_revision = '2c8d2d175b0c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column(
+            'password_hash',
+            existing_type=sa.String(length=100),
+            type_=sa.String(length=255),
+            existing_nullable=True,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column(
+            'password_hash',
+            existing_type=sa.String(length=255),
+            type_=sa.String(length=100),
+            existing_nullable=True,
+        )
@@ -0,0 +1,93 @@
+"""Store user public id as a UUID
+
+Revision ID: 6c3f9e1a7b24
+Revises: 4a8f2c6e1b93
+Create Date: 2026-10-18 19:27:05.613840
+
+"""
+import uuid
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6c3f9e1a7b24'
+down_revision = '4a8f2c6e1b93'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+UUID_BYTES = 16
+PUBLIC_ID_LENGTH = 100
+# Batch mode does not carry expression indexes over to the rebuilt table, so they are made again.
+LOWER_INDEXED_COLUMNS = ('username', 'email')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE "user" ALTER COLUMN public_id TYPE uuid USING public_id::uuid')
+        return
+
+    # SQLite keeps whatever is stored in a column, so the values are rewritten as bytes first and
+    # the table rebuilt with the new column type after. Batch mode's copy leaves the bytes alone.
+    _rewrite_public_ids(lambda public_id: uuid.UUID(public_id).bytes)
+    _drop_lower_indexes()
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column(
+            'public_id',
+            existing_type=sa.String(length=PUBLIC_ID_LENGTH),
+            type_=sa.LargeBinary(length=UUID_BYTES),
+        )
+    _create_lower_indexes()
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            f'ALTER TABLE "user" ALTER COLUMN public_id TYPE varchar({PUBLIC_ID_LENGTH}) '
+            f'USING public_id::text'
+        )
+        return
+
+    _rewrite_public_ids(lambda public_id: str(uuid.UUID(bytes=bytes(public_id))))
+    _drop_lower_indexes()
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.alter_column(
+            'public_id',
+            existing_type=sa.LargeBinary(length=UUID_BYTES),
+            type_=sa.String(length=PUBLIC_ID_LENGTH),
+        )
+    _create_lower_indexes()
+
+
+def _rewrite_public_ids(convert):
+    connection = op.get_bind()
+    user = sa.table('user', sa.column('id', sa.Integer), sa.column('public_id'))
+    update = user.update().where(user.c.id == sa.bindparam('user_id')).values(
+        public_id=sa.bindparam('new_public_id')
+    )
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select([user.c.id, user.c.public_id])
+            .where(sa.and_(user.c.id > last_id, user.c.public_id.isnot(None)))
+            .order_by(user.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        connection.execute(update, [
+            dict(user_id=user_id, new_public_id=convert(public_id)) for user_id, public_id in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def _drop_lower_indexes():
+    for column in LOWER_INDEXED_COLUMNS:
+        op.drop_index(f'ix_user_{column}_lower', table_name='user')
+
+
+def _create_lower_indexes():
+    for column in LOWER_INDEXED_COLUMNS:
+        op.create_index(f'ix_user_{column}_lower', 'user', [sa.text(f'lower({column})')])
@@ -0,0 +1,28 @@
+"""Add user version
+
+Revision ID: 7d2e4b6a1c85
+Revises: 3e7a9c2d5f10
+Create Date: 2026-10-18 16:40:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e4b6a1c85'
+down_revision = '3e7a9c2d5f10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'user',
+        sa.Column('version', sa.Integer(), server_default='1', nullable=False),
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('user') as batch_op:
+        batch_op.drop_column('version')
@@ -0,0 +1,39 @@
+"""Add email outbox
+
+Revision ID: 8b5d3f7a2e69
+Revises: 6c3f9e1a7b24
+Create Date: 2026-10-18 20:41:36.072419
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b5d3f7a2e69'
+down_revision = '6c3f9e1a7b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('kind', sa.String(length=32), nullable=False),
+        sa.Column('recipient', sa.String(length=255), nullable=False),
+        sa.Column('locale', sa.String(length=16), nullable=True),
+        sa.Column('created_on', sa.DateTime(), nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+        sa.Column('sent_on', sa.DateTime(), nullable=True),
+        sa.Column('abandoned_on', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_email_outbox_next_attempt_at', 'email_outbox', ['next_attempt_at'])
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_next_attempt_at', table_name='email_outbox')
+    op.drop_table('email_outbox')
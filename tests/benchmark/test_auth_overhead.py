@@ -0,0 +1,42 @@
+import time
+
+import pytest
+
+from app.main import claims_cache
+from app.main.service.auth import jwt_authenticated
+from tests.conftest import app
+
+REQUESTS = 5000
+
+
+@jwt_authenticated
+def protected():
+    return None
+
+
+def time_requests(headers):
+    with app.test_request_context('/', headers=headers):
+        protected()  # Warm up: with the cache enabled this populates it.
+        start = time.perf_counter()
+        for _ in range(REQUESTS):
+            protected()
+        return (time.perf_counter() - start) / REQUESTS
+
+
+@pytest.mark.benchmark
+@pytest.mark.usefixtures('database')
+def test_auth_overhead_with_claims_cache(headers):
+    """Per request cost of authenticating the same bearer token, with and without the cache."""
+    enabled = claims_cache.enabled
+    try:
+        claims_cache.enabled = False
+        uncached = time_requests(headers)
+        claims_cache.enabled = True
+        cached = time_requests(headers)
+    finally:
+        claims_cache.enabled = enabled
+        claims_cache.clear()
+
+    print(f"\nAuth overhead per request: {uncached * 1e6:.1f} us uncached, "
+          f"{cached * 1e6:.1f} us cached ({uncached / cached:.1f}x)")
+    assert cached < uncached
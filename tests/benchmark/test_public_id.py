@@ -0,0 +1,66 @@
+import os
+import random
+import time
+import uuid
+
+import pytest
+import sqlalchemy as sa
+
+from app.main.model.types import GUID
+
+# Set BENCHMARK_PUBLIC_IDS=10000000 for the full size comparison. It takes a while.
+ROWS = int(os.environ.get('BENCHMARK_PUBLIC_IDS') or 200000)
+INSERT_BATCH = 50000
+LOOKUPS = 2000
+# Lookups are dominated by per statement overhead at this size, so only a clear slowdown fails.
+TOLERANCE = 1.5
+
+
+def build_table(path, column_type):
+    """
+    :return: tuple of the engine, table, the bytes taken by the public id index and some of the ids
+    """
+    engine = sa.create_engine(f'sqlite:///{path}')
+    table = sa.Table(
+        'user', sa.MetaData(),
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('public_id', column_type),
+    )
+    table.create(engine)
+    sample = []
+    with engine.begin() as connection:
+        for start in range(0, ROWS, INSERT_BATCH):
+            public_ids = [str(uuid.uuid4()) for _ in range(min(INSERT_BATCH, ROWS - start))]
+            connection.execute(table.insert(), [dict(public_id=value) for value in public_ids])
+            sample.extend(public_ids[::max(ROWS // LOOKUPS, 1)])
+    page_size = engine.execute('PRAGMA page_size').scalar()
+    before = engine.execute('PRAGMA page_count').scalar()
+    engine.execute('CREATE UNIQUE INDEX ix_user_public_id ON user (public_id)')
+    index_bytes = (engine.execute('PRAGMA page_count').scalar() - before) * page_size
+    random.shuffle(sample)
+    return engine, table, index_bytes, sample
+
+
+def time_lookups(engine, table, public_ids):
+    query = sa.select([table.c.id]).where(table.c.public_id == sa.bindparam('public_id'))
+    with engine.connect() as connection:
+        start = time.perf_counter()
+        for public_id in public_ids:
+            assert connection.execute(query, public_id=public_id).scalar() is not None
+    return (time.perf_counter() - start) / len(public_ids)
+
+
+@pytest.mark.benchmark
+def test_guid_public_id_index_is_compact(tmp_path):
+    """The 16 byte public id index is smaller than the text one and no slower to look up in."""
+    results = {}
+    for name, column_type in [('text', sa.String(100)), ('guid', GUID())]:
+        engine, table, index_bytes, sample = build_table(tmp_path / f'{name}.db', column_type)
+        results[name] = index_bytes, time_lookups(engine, table, sample)
+        engine.dispose()
+
+    for name, (index_bytes, latency) in results.items():
+        print(f"\n{name}: public id index {index_bytes / 2 ** 20:.1f} MiB for {ROWS} rows, "
+              f"lookup {latency * 1e6:.1f} us")
+    assert results['guid'][0] < results['text'][0]
+    assert results['guid'][1] < results['text'][1] * TOLERANCE
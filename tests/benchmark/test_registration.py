@@ -0,0 +1,57 @@
+import datetime
+import time
+import uuid
+
+import pytest
+
+from app.main import db
+from app.main.model.user import User
+from tests.conftest import app
+from tests.data_factory import user_attributes
+from tests.helpers import register_user
+
+SEEDED_USERS = 100000
+SEED_BATCH = 10000
+REGISTRATIONS = 20
+TOLERANCE = 1.5
+
+
+def seed_users(count):
+    now = datetime.datetime.utcnow()
+    for start in range(0, count, SEED_BATCH):
+        db.session.execute(User.__table__.insert(), [
+            dict(
+                email=f'seeded-{idx}@foomail.com',
+                username=f'seeded-{idx}',
+                public_id=str(uuid.uuid4()),
+                password_hash='not-a-hash',
+                registered_on=now,
+                admin=False,
+                token_generation=0,
+            )
+            for idx in range(start, min(start + SEED_BATCH, count))
+        ])
+    db.session.commit()
+
+
+def time_registrations(client):
+    start = time.perf_counter()
+    for _ in range(REGISTRATIONS):
+        register_user(user_attributes(), client=client)
+    return (time.perf_counter() - start) / REGISTRATIONS
+
+
+@pytest.mark.benchmark
+@pytest.mark.usefixtures('database')
+def test_registration_latency_is_flat():
+    """Registering a user costs the same whether the table holds a few users or a lot."""
+    client = app.test_client()
+    with client:
+        register_user(user_attributes(), client=client)  # The first user, who becomes Admin.
+        small = time_registrations(client)
+        seed_users(SEEDED_USERS)
+        large = time_registrations(client)
+
+    print(f"\nRegistration latency: {small * 1e3:.1f} ms with a few users, "
+          f"{large * 1e3:.1f} ms with {SEEDED_USERS} users ({large / small:.2f}x)")
+    assert large < small * TOLERANCE
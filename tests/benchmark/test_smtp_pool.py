@@ -0,0 +1,35 @@
+import time
+
+import pytest
+from flask_mail import Message
+
+from tests.helpers import local_smtp_server, make_smtp_pool
+
+MESSAGES = 50
+# Stands in for the TLS handshake and login a real mail server costs on each new connection.
+SETUP_DELAY = 0.02
+SPEEDUP = 2
+
+
+def time_sends(send):
+    start = time.perf_counter()
+    for idx in range(MESSAGES):
+        send(Message('Subject', recipients=[f'user-{idx}@foomail.com'], body='Body'))
+    return (time.perf_counter() - start) / MESSAGES
+
+
+@pytest.mark.benchmark
+def test_pooled_smtp_sends_are_faster():
+    """Sending over pooled connections skips the connection setup every unpooled send pays."""
+    with local_smtp_server(setup_delay=SETUP_DELAY) as server:
+        app, pool = make_smtp_pool(server.port)
+        mail = app.extensions['mail']
+        with app.app_context():
+            unpooled = time_sends(mail.send)  # A new connection per message.
+            pooled = time_sends(pool.send)
+            pool.close_all()
+
+    print(f"\nSMTP send latency: {unpooled * 1e3:.1f} ms unpooled, {pooled * 1e3:.1f} ms pooled "
+          f"({unpooled / pooled:.1f}x) with {SETUP_DELAY * 1e3:.0f} ms connection setup")
+    assert server.connections == MESSAGES + 1
+    assert pooled * SPEEDUP < unpooled
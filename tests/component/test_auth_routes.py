@@ -1,9 +1,18 @@
 import pytest
 
-from app.responses import BAD_REQUEST, OK, UNAUTHORIZED
+from app.constants import FIRST, SECOND
+from app.hashing import BcryptHasher
+from app.main import login_throttle
+from app.main.data.dao import save_changes
+from app.main.model.blacklist import BlacklistToken
+from app.main.model.refresh_token import RotatedRefreshToken
+from app.main.model.user import User
+from app.main.service import auth
+from app.main.service.refresh_token import prune_refresh_tokens
+from app.responses import BAD_REQUEST, OK, TOO_MANY_REQUESTS, UNAUTHORIZED
 from tests.data_factory import CRAP_PASSWORD, random_email, random_password, random_text
 from tests.helpers import (
-    authenticate_user, check_endpoint_denied, client_post, confirm_and_login_user,
+    authenticate_user, check_endpoint_denied, client_get, client_post, confirm_and_login_user,
     confirm_email_token, get_email_token, register_user,
 )
 
@@ -40,6 +49,70 @@ def test_user_logout(client, user_data):
         check_endpoint_denied('/auth/logout', method='post', client=client)
 
 
+@pytest.mark.usefixtures('database')
+def test_token_refresh(client, user_data):
+    """Test refresh tokens rotate on use, and sessions end on logout or when a token is reused."""
+    with client:
+        register_user(user_data, client=client)
+        confirm_email_token(get_email_token(user_data), client=client)
+        data = authenticate_user('login', data=user_data, client=client).json.get('data')
+
+        refreshed = client_post(client, '/auth/refresh', data=dict(
+            refresh_token=data.get('refresh_token')
+        ))
+        assert refreshed.status_code == OK
+        tokens = refreshed.json.get('data')
+        assert tokens.get('token') and tokens.get('refresh_token') != data.get('refresh_token')
+
+        for refresh_token in [random_text(), data.get('refresh_token')]:  # Unknown, then reused
+            response = client_post(client, '/auth/refresh', data=dict(refresh_token=refresh_token))
+            assert response.status_code == UNAUTHORIZED
+        # Reusing the rotated token revoked its session, so the token it was swapped for is dead.
+        response = client_post(client, '/auth/refresh', data=dict(
+            refresh_token=tokens.get('refresh_token')
+        ))
+        assert response.status_code == UNAUTHORIZED
+
+        tokens = authenticate_user('login', data=user_data, client=client).json.get('data')
+        headers = dict(Authorization=f"Bearer {tokens.get('token')}")
+        authenticate_user('logout', headers=headers, client=client)
+        response = client_post(client, '/auth/refresh', data=dict(
+            refresh_token=tokens.get('refresh_token')
+        ))
+        assert response.status_code == UNAUTHORIZED
+
+        # Both sessions have ended, so they go, with the token rotated away from, when pruned.
+        assert RotatedRefreshToken.query.count() == 1
+        assert prune_refresh_tokens() == 2
+        assert RotatedRefreshToken.query.count() == 0
+
+
+@pytest.mark.usefixtures('database')
+def test_logout_all(client, user_data):
+    """Test logging out everywhere revokes every access and refresh token of the user."""
+    with client:
+        register_user(user_data, client=client)
+        confirm_email_token(get_email_token(user_data), client=client)
+        sessions = [
+            authenticate_user('login', data=user_data, client=client).json.get('data')
+            for _ in range(2)
+        ]
+        headers = [dict(Authorization=f"Bearer {session.get('token')}") for session in sessions]
+        assert client_get(client, '/users', headers=headers[SECOND]).status_code == OK
+
+        authenticate_user('logout/all', headers=headers[FIRST], client=client)
+        for header in headers:
+            assert client_get(client, '/users', headers=header).status_code == UNAUTHORIZED
+        response = client_post(client, '/auth/refresh', data=dict(
+            refresh_token=sessions[SECOND].get('refresh_token')
+        ))
+        assert response.status_code == UNAUTHORIZED
+
+        token = authenticate_user('login', data=user_data, client=client).json['data']['token']
+        headers = dict(Authorization=f"Bearer {token}")
+        assert client_get(client, '/users', headers=headers).status_code == OK
+
+
 @pytest.mark.usefixtures('database')
 def test_password_reset(client, user_data):
     """Test for password reset."""
@@ -97,9 +170,75 @@ def test_password_change(client, user_data):
             response = client_post(client, request_url, headers=headers, data=user_data)
             assert response.status_code == expected[idx]
 
+        # Changing the password revokes the tokens issued before it.
+        response = client_post(client, request_url, headers=headers, data=user_data)
+        assert response.status_code == UNAUTHORIZED
+
         authenticate_user('login', data=user_data, client=client)
         user_data['password'] = old_password
         authenticate_user('login', data=user_data, expected=UNAUTHORIZED, client=client)
 
         data = dict(password=random_password())
         check_endpoint_denied(request_url, method='post', data=data, client=client)
+
+
+@pytest.mark.usefixtures('database')
+def test_login_rehashes_outdated_password(client, user_data):
+    """Test a password hashed with out of date costs is rehashed at login."""
+    with client:
+        register_user(user_data, client=client)
+        user = User().find_user(dict(email=user_data.get('email')))
+        user.password_hash = BcryptHasher(rounds=4).hash(user_data.get('password'))
+        save_changes(user)
+        assert user.password_needs_rehash()
+
+        confirm_and_login_user(user_data, client=client)
+        user = User().find_user(dict(email=user_data.get('email')))
+        assert not user.password_needs_rehash()
+        assert user.check_password(user_data.get('password'))
+
+
+@pytest.mark.usefixtures('database')
+def test_single_pass_authentication(client, user_data, monkeypatch):
+    """Test a protected request decodes and blacklist checks its JWT once."""
+    with client:
+        register_user(user_data, client=client)
+        headers = confirm_and_login_user(user_data, client=client)
+
+        calls = []
+        monkeypatch.setattr(auth, 'decode_jwt', _recorded(calls, auth.decode_jwt))
+        monkeypatch.setattr(
+            BlacklistToken, 'check_blacklist', _recorded(calls, BlacklistToken.check_blacklist)
+        )
+
+        authenticate_user('logout', headers=headers, client=client)
+        token = headers.get('Authorization').split()[-1]
+        assert calls == [token, token]
+
+
+@pytest.mark.usefixtures('database')
+def test_login_throttled(client, user_data, monkeypatch):
+    """Test repeated failed logins are rejected before the user is looked up."""
+    with client:
+        register_user(user_data, client=client)
+        confirm_email_token(get_email_token(user_data), client=client)
+        password = user_data.get('password')
+        user_data['password'] = random_password()
+        for _ in range(login_throttle.max_per_email):
+            authenticate_user('login', data=user_data, expected=UNAUTHORIZED, client=client)
+
+        calls = []
+        monkeypatch.setattr(User, 'find_user', _recorded(calls, User.find_user))
+        user_data['password'] = password
+        response = authenticate_user(
+            'login', data=user_data, expected=TOO_MANY_REQUESTS, client=client
+        )
+        assert int(response.headers.get('Retry-After')) > 0
+        assert not calls
+
+
+def _recorded(calls, func):
+    def recorder(*args):
+        calls.append(args[-1])
+        return func(*args)
+    return recorder
@@ -0,0 +1,27 @@
+import pytest
+
+from app.responses import OK, UNAUTHORIZED
+from tests.helpers import (
+    check_endpoint_denied, client_get, confirm_and_login_user, register_user,
+)
+
+
+@pytest.mark.usefixtures('database')
+def test_get_metrics(client, user_data, headers, admin_headers):
+    """Test for listing metrics."""
+    with client:
+        register_user(user_data, client=client)
+        confirm_and_login_user(user_data, client=client)
+
+        endpoint = '/metrics'
+        expected = [UNAUTHORIZED, OK]
+        for idx, header in enumerate([headers, admin_headers]):
+            response = client_get(client, endpoint, headers=header)
+            assert response.status_code == expected[idx]
+
+        metrics = response.json.get('data').get('metrics')
+        assert metrics['timings']['login']['count']
+        assert 'in_flight' in metrics['hashing']
+        assert 'hits' in metrics['blacklist_cache']
+
+        check_endpoint_denied(endpoint, client=client)
@@ -2,12 +2,16 @@ import datetime
 
 import pytest
 from freezegun import freeze_time
-from werkzeug.exceptions import Unauthorized
+from werkzeug.exceptions import InternalServerError, Unauthorized
 
+from app.main import db
+from app.main.data.dao import insert_unique
+from app.main.model.blacklist import BlacklistToken
 from app.main.service.auth import Auth
-from tests.data_factory import random_text
+from app.main.service.blacklist import prune_blacklist
+from tests.data_factory import random_text, user_attributes, user_model
 from tests.helpers import (
-    authenticate_user, confirm_email_token, get_email_token, register_user,
+    add_to_database, authenticate_user, confirm_email_token, get_email_token, register_user,
 )
 
 
@@ -16,6 +20,8 @@ def test_encode_auth_token(database_user):
     # TODO: make a better test to see structure of JWT
     auth_token = Auth.encode_auth_token(database_user)
     assert isinstance(auth_token, str)
+    # Every token carries a unique 'jti' so blacklisting one never revokes another.
+    assert Auth.encode_auth_token(database_user) != auth_token
 
 
 @pytest.mark.usefixtures('database')
@@ -40,3 +46,30 @@ def test_decode_auth_token(client, database_user, user_data):
     authenticate_user('logout', headers=headers, client=client)
     with pytest.raises(Unauthorized):
         Auth.validate_token_blacklist(token)
+
+
+@pytest.mark.usefixtures('database')
+def test_prune_blacklist():
+    now = datetime.datetime.utcnow()
+    expired = [now - datetime.timedelta(minutes=minutes) for minutes in range(1, 4)]
+    for expires_at in expired + [now + datetime.timedelta(hours=1)]:
+        add_to_database(db, BlacklistToken(random_text(length=64), expires_at=expires_at))
+
+    assert prune_blacklist(batch_size=2, now=now) == len(expired)
+    remaining = db.session.query(BlacklistToken.expires_at).all()
+    assert [expires_at for (expires_at,) in remaining] == [now + datetime.timedelta(hours=1)]
+
+
+@pytest.mark.usefixtures('database')
+def test_insert_unique(database_user):
+    for clash in ['email', 'username']:
+        user = user_attributes()
+        user[clash] = getattr(database_user, clash)
+        assert not insert_unique(user_model(user), 'email', 'username')
+
+    # A clash on any other unique column is not an existing user.
+    user = user_attributes()
+    user['public_id'] = database_user.public_id
+    with pytest.raises(InternalServerError):
+        insert_unique(user_model(user), 'email', 'username')
+    assert insert_unique(user_model(user_attributes()), 'email', 'username')
@@ -1,17 +1,24 @@
 import copy
 import json
+import uuid
 
 import pytest
-
-from app.constants import FIRST, SEVEN_ITEMS
-from app.responses import BAD_REQUEST, CONFLICT, NOT_FOUND, OK, UNAUTHORIZED
+from sqlalchemy.exc import OperationalError
+
+from app.constants import FIRST, SECOND, SEVEN_ITEMS
+from app.main import blacklist_cache, db, hashing
+from app.main.model.user import User
+from app.main.service import user as user_service
+from app.main.service.common import DEFAULT_USER_FIELDS, query_users
+from app.responses import BAD_REQUEST, CONFLICT, NOT_FOUND, NOT_MODIFIED, OK, UNAUTHORIZED
 from tests.data_factory import (
     CRAP_EMAIL, NUM_GENERIC_USERS, NUM_STANDARD_CLIENT_USERS, random_email, random_text,
     TOTAL_USERS, user_attributes,
 )
 from tests.helpers import (
     authenticate_user, bad_username_and_email, check_endpoint_denied, client_get, client_post,
-    confirm_and_login_user, confirm_email_token, get_email_token, register_user, remove_jwt,
+    confirm_and_login_user, confirm_email_token, get_email_token, recorded_statements,
+    register_user, remove_jwt,
 )
 
 
@@ -40,6 +47,112 @@ def test_list_users(client, headers, admin_headers):
         check_endpoint_denied(endpoint, client=client)
 
 
+@pytest.mark.usefixtures('database')
+def test_list_users_paginated(client, headers, admin_headers):
+    """Test admins page through users with cursors, and bad cursors and limits are rejected."""
+    with client:
+        for _ in range(NUM_GENERIC_USERS):
+            register_user(user_attributes(), client=client)
+
+        emails, cursor, pages = [], None, 0
+        while True:
+            query = f'?limit=2&cursor={cursor}' if cursor else '?limit=2'
+            response = client_get(client, f'/users{query}', headers=admin_headers)
+            assert response.status_code == OK
+            data = response.json.get('data')
+            assert len(data.get('users')) <= 2
+            emails.extend(item.get('email') for item in data.get('users'))
+            pages += 1
+            cursor = data.get('next')
+            if not cursor:
+                break
+        assert pages == -(-TOTAL_USERS // 2)
+        assert len(set(emails)) == TOTAL_USERS
+
+        response = client_get(client, '/users?limit=1', headers=headers)
+        assert len(response.json.get('data').get('users')) == NUM_STANDARD_CLIENT_USERS
+        for query in ['?cursor=forged', '?limit=0', '?limit=lots']:
+            response = client_get(client, f'/users{query}', headers=admin_headers)
+            assert response.status_code == BAD_REQUEST
+
+
+@pytest.mark.usefixtures('database')
+def test_export_users(client, headers, admin_headers):
+    """Test admins can stream every user as NDJSON or CSV, optionally only recent registrations."""
+    with client:
+        for _ in range(NUM_GENERIC_USERS):
+            register_user(user_attributes(), client=client)
+
+        response = client_get(client, '/users/export', headers=admin_headers)
+        assert response.status_code == OK
+        assert response.is_streamed
+        assert response.mimetype == 'application/x-ndjson'
+        users = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert len(users) == TOTAL_USERS
+        assert all(set(item) == {'username', 'public_id', 'email'} for item in users)
+
+        response = client_get(client, '/users/export?format=csv', headers=admin_headers)
+        assert response.mimetype == 'text/csv'
+        lines = response.get_data(as_text=True).splitlines()
+        assert lines[FIRST] == 'username,public_id,email'
+        assert len(lines) == TOTAL_USERS + 1
+
+        since = (User.query.order_by(User.id.desc()).first().registered_on).isoformat()
+        response = client_get(client, f'/users/export?since={since}', headers=admin_headers)
+        assert len(response.get_data(as_text=True).splitlines()) == 1
+
+        response = client_get(client, '/users/export', headers=headers)
+        assert response.status_code == UNAUTHORIZED
+        response = client_get(client, '/users/export?format=xml', headers=admin_headers)
+        assert response.status_code == BAD_REQUEST
+
+
+@pytest.mark.usefixtures('database')
+def test_export_users_aborts_on_database_error(client, admin_headers, monkeypatch):
+    """Test an export which fails part way through is aborted rather than ending as if complete."""
+    monkeypatch.setitem(client.application.config, 'USERS_EXPORT_CHUNK_SIZE', 1)
+
+    class LostConnectionQuery:
+        """Yields the first user, then loses its connection."""
+        def __init__(self, *args):
+            self.rows = query_users(*args).limit(1).all()
+
+        def order_by(self, *_args):
+            return self
+
+        def yield_per(self, _size):
+            return self
+
+        def __iter__(self):
+            yield from self.rows
+            raise OperationalError('SELECT', {}, ConnectionError('Connection lost'))
+
+    monkeypatch.setattr(user_service, 'query_users', LostConnectionQuery)
+    with client:
+        response = client_get(client, '/users/export', headers=admin_headers)
+        assert response.status_code == OK  # Sent with the first chunk, before the error.
+        chunks = response.response
+        assert set(json.loads(next(chunks))) == set(DEFAULT_USER_FIELDS)
+        with pytest.raises(OperationalError):
+            next(chunks)
+
+
+@pytest.mark.usefixtures('database')
+def test_list_users_skips_blacklist_query(client, headers, monkeypatch):
+    """Test the blacklist cache answers for tokens which were never blacklisted."""
+    monkeypatch.setitem(client.application.config, 'JWT_ACCESS_REVOCATION', True)
+    with client:
+        client_get(client, '/users', headers=headers)  # Warm the cache.
+
+        hits = blacklist_cache.hits
+        with recorded_statements() as statements:
+            for _ in range(3):
+                assert client_get(client, '/users', headers=headers).status_code == OK
+        assert blacklist_cache.hits == hits + 3
+        assert statements
+        assert not any('blacklist_tokens' in statement for statement in statements)
+
+
 @pytest.mark.usefixtures('database')
 def test_create_user(client):
     """Test for creating a new user."""
@@ -65,6 +178,36 @@ def test_create_user(client):
             register_user(user, expected=expected[idx], client=client)
 
 
+@pytest.mark.usefixtures('database')
+def test_create_user_single_statement(client, monkeypatch):
+    """Test registering is one EXISTS check then a single user insert, committed with its queued
+    confirmation email, and that existing users are turned away before a password is hashed."""
+    with client:
+        remove_jwt()
+        existing = user_attributes()
+        register_user(existing, client=client)
+
+        with recorded_statements() as statements:
+            register_user(user_attributes(), client=client)
+        user_statements = [statement for statement in statements if 'user' in statement]
+        assert len(user_statements) == 2
+        assert 'EXISTS' in user_statements[FIRST]
+        assert user_statements[SECOND].startswith('INSERT INTO user')
+        assert statements[1:3] == [
+            statement for statement in statements if statement.startswith('INSERT INTO')
+        ]
+
+        hashed = []
+        monkeypatch.setattr(hashing, 'hash_password', hashed.append)
+        for clash in ['email', 'username']:
+            user = user_attributes()
+            user[clash] = existing[clash]
+            register_user(user, expected=CONFLICT, client=client)
+            user['password'] = 'weak'
+            register_user(user, expected=CONFLICT, client=client)
+        assert not hashed
+
+
 @pytest.mark.usefixtures('database')
 def test_get_user_by_id(client, user_data, headers, admin_headers):
     """Test for specific registered user."""
@@ -85,13 +228,144 @@ def test_get_user_by_id(client, user_data, headers, admin_headers):
                 assert 'password' not in user
             assert response.status_code == expected[idx]
 
-        fake_id = random_text()
-        response = client_get(client, f'/users/{fake_id}', headers=admin_headers)
-        assert response.status_code == NOT_FOUND
+        # Ids in any case are accepted. Ones which are not UUIDs are refused without a query.
+        response = client_get(
+            client, f'/users/{user.get("public_id").upper()}', headers=admin_headers
+        )
+        assert response.json.get('data').get('user').get('public_id') == user.get('public_id')
+        for fake_id in [random_text(), str(uuid.uuid4())]:
+            response = client_get(client, f'/users/{fake_id}', headers=admin_headers)
+            assert response.status_code == NOT_FOUND
 
         check_endpoint_denied(endpoint, client=client)
 
 
+@pytest.mark.usefixtures('database')
+def test_get_user_fields(client, user_data, admin_headers):
+    """Test only the requested user fields are selected and returned."""
+    with client:
+        response = register_user(user_data, client=client)
+        public_id = response.json.get('data').get('user').get('public_id')
+
+        response = client_get(
+            client, f'/users/{public_id}?fields=email,registered_on', headers=admin_headers
+        )
+        assert response.status_code == OK
+        assert set(response.json.get('data').get('user')) == {'email', 'registered_on'}
+
+        response = client_get(client, '/users?fields=public_id', headers=admin_headers)
+        assert response.status_code == OK
+        assert all(set(item) == {'public_id'} for item in response.json.get('data').get('users'))
+
+        for query in ['?fields=password_hash', '?fields=email,admin', '?fields=,']:
+            response = client_get(client, f'/users/{public_id}{query}', headers=admin_headers)
+            assert response.status_code == BAD_REQUEST
+
+        assert 'password_hash' not in str(User.query)
+
+
+@pytest.mark.usefixtures('database')
+def test_search_users(client, headers, admin_headers):
+    """Test users are found by the start of their username or email, using the lower() indexes."""
+    with client:
+        user = User.query.filter_by(admin=False).first()
+
+        with recorded_statements(with_parameters=True) as executed:
+            for prefix in [user.username[:4].upper(), user.email[:4]]:
+                response = client_get(client, f'/users/search?q={prefix}', headers=admin_headers)
+                assert response.status_code == OK
+                assert user.public_id in [
+                    match.get('public_id') for match in response.json.get('data').get('users')
+                ]
+
+        searches = [(statement, params) for statement, params in executed if 'lower(' in statement]
+        statement, parameters = searches[FIRST]
+        cursor = db.session.connection().connection.cursor()
+        plan = str(cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall())
+        assert 'ix_user_username_lower' in plan and 'ix_user_email_lower' in plan
+
+        response = client_get(client, '/users/search?q=zzzzzzzz', headers=admin_headers)
+        assert response.json.get('data').get('users') == []
+        response = client_get(client, '/users/search?q=%20', headers=admin_headers)
+        assert response.status_code == BAD_REQUEST
+        response = client_get(client, f'/users/search?q={user.username}', headers=headers)
+        assert response.status_code == UNAUTHORIZED
+
+
+@pytest.mark.usefixtures('database')
+def test_lookup_users(client, headers, admin_headers):
+    """Test a batch of users is looked up in one query and keyed by public id, misses included."""
+    with client:
+        public_ids = [user.public_id for user in User.query.limit(3)]
+        own_id = User.query.filter_by(admin=False).first().public_id
+        admin_id = User.query.filter_by(admin=True).first().public_id
+        missing = 'not-a-public-id'
+
+        with recorded_statements() as executed:
+            response = client_post(
+                client, '/users/lookup?fields=email', headers=admin_headers,
+                data=dict(public_ids=public_ids + [missing, public_ids[FIRST]]),
+            )
+        statements = [statement for statement in executed if 'FROM user' in statement]
+        assert response.status_code == OK
+        users = response.json.get('data').get('users')
+        assert list(users) == public_ids + [missing]
+        assert users[missing] is None
+        assert all(set(users[public_id]) == {'email'} for public_id in public_ids)
+        assert len([statement for statement in statements if ' IN (' in statement]) == 1
+
+        response = client_post(
+            client, '/users/lookup', headers=headers, data=dict(public_ids=[own_id])
+        )
+        assert response.status_code == OK
+        assert response.json.get('data').get('users').get(own_id).get('public_id') == own_id
+
+        for data, code in [
+                (dict(public_ids=[own_id, admin_id]), UNAUTHORIZED),
+                (dict(public_ids=[]), BAD_REQUEST),
+                (dict(public_ids=[str(number) for number in range(101)]), BAD_REQUEST),
+        ]:
+            response = client_post(client, '/users/lookup', headers=headers, data=data)
+            assert response.status_code == code
+
+
+@pytest.mark.usefixtures('database')
+def test_get_users_conditionally(client, headers, admin_headers):
+    """Test user reads are tagged with ETags and unchanged ones are answered with a 304 early."""
+    with client:
+        public_id = User.query.filter_by(admin=False).first().public_id
+        requests = [('/users', admin_headers), (f'/users/{public_id}', headers)]
+        etags = []
+        for endpoint, header in requests:
+            response = client_get(client, endpoint, headers=header)
+            assert response.status_code == OK
+            etag = response.headers.get('ETag')
+            assert etag
+            etags.append(etag)
+
+            with recorded_statements() as statements:
+                response = client_get(client, endpoint, headers=dict(header, **{
+                    'If-None-Match': etag
+                }))
+            assert response.status_code == NOT_MODIFIED
+            assert not response.data
+            # The ETag comes from the same read as the body would, so the two always agree.
+            assert len([statement for statement in statements if 'version' in statement]) == 1
+
+            other_fields = client_get(client, f'{endpoint}?fields=email', headers=dict(header, **{
+                'If-None-Match': etag
+            }))
+            assert other_fields.status_code == OK
+
+        user = User.query.filter_by(public_id=public_id).first()
+        user.email_confirmed = not user.email_confirmed
+        db.session.commit()
+        for (endpoint, header), etag in zip(requests, etags):
+            response = client_get(client, endpoint, headers=dict(header, **{'If-None-Match': etag}))
+            assert response.status_code == OK
+            assert response.headers.get('ETag') != etag
+
+
 @pytest.mark.usefixtures('database')
 def test_email_confirm(client, user_data):
     """Test for email confirmation."""
@@ -16,19 +16,25 @@ def pytest_addoption(parser):
     parser.addoption(
         '--runlocal', action='store_true', default=False, help='run integration tests locally'
     )
+    parser.addoption(
+        '--runbenchmark', action='store_true', default=False, help='run performance benchmarks'
+    )
 
 
 def pytest_configure(config):
     config.addinivalue_line('markers', 'local: mark integration test as local to run')
+    config.addinivalue_line('markers', 'benchmark: mark test as a benchmark to run')
 
 
 def pytest_collection_modifyitems(config, items):
-    if config.getoption('--runlocal'):  # --runlocal given in cli: do not skip local tests
-        return
     skip_local = pytest.mark.skip(reason='need --runlocal option to run')
+    skip_benchmark = pytest.mark.skip(reason='need --runbenchmark option to run')
     for item in items:
-        if 'local' in item.keywords:
+        # --runlocal or --runbenchmark given in cli: do not skip those tests
+        if 'local' in item.keywords and not config.getoption('--runlocal'):
             item.add_marker(skip_local)
+        if 'benchmark' in item.keywords and not config.getoption('--runbenchmark'):
+            item.add_marker(skip_benchmark)
 
 
 @pytest.fixture(scope='function')
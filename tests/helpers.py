@@ -1,19 +1,98 @@
+import asyncore
 import json
 import os
+import threading
+import time
+from contextlib import contextmanager
 
 import requests
-from flask import _app_ctx_stack as ctx_stack
+from flask import Flask, _app_ctx_stack as ctx_stack
+from flask_mail import Mail
+from sqlalchemy import event
 
 from app.config import CONFIG_BY_NAME
 from app.constants import FIFTH, FIRST, FOURTH, SECOND, SEVENTH, SIXTH, THIRD
+from app.main import db
 from app.main.service.auth import Auth
 from app.responses import BAD_REQUEST, CONFLICT, CREATED, OK, UNAUTHORIZED, UNPROCESSABLE_ENTITY
+from app.smtp import SMTPPool
 from tests.data_factory import random_email, random_text, user_model
+from tools.email_server import CustomSMTPServer
 
 CONFIG_OBJECT = CONFIG_BY_NAME['test-deployed']
 API_BASE_URL = f'{CONFIG_OBJECT.PREFERRED_URL_SCHEME}://{CONFIG_OBJECT.SERVER_NAME}'
 JSON = 'application/json'
 
+SMTP_POLL_TIMEOUT = 0.01
+
+
+class LocalSMTPServer(CustomSMTPServer):
+    """
+    The development SMTP server, counting messages rather than writing them out. Each new
+    connection is held for setup_delay seconds first, to stand in for a TLS handshake and login.
+    """
+
+    def __init__(self, setup_delay=0.0):
+        super().__init__(('localhost', 0), None)
+        self.port = self.socket.getsockname()[SECOND]
+        self.setup_delay = setup_delay
+        self.connections = 0
+        self.received = []
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        time.sleep(self.setup_delay)
+        super().handle_accepted(conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        self.received.extend(rcpttos)
+
+
+@contextmanager
+def local_smtp_server(setup_delay=0.0):
+    server = LocalSMTPServer(setup_delay=setup_delay)
+    loop = threading.Thread(
+        target=asyncore.loop, kwargs=dict(timeout=SMTP_POLL_TIMEOUT), daemon=True
+    )
+    loop.start()
+    try:
+        yield server
+    finally:
+        asyncore.close_all()
+        loop.join()
+
+
+@contextmanager
+def recorded_statements(with_parameters=False):
+    """
+    Record the SQL statements run on the database within the block, in order.
+    :param with_parameters: boolean of whether to record (statement, parameters) tuples instead
+    :return: list the statements are appended to
+    """
+    statements = []
+
+    def listener(_conn, _cursor, statement, parameters, *_args):
+        statements.append((statement, parameters) if with_parameters else statement)
+
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+
+def make_smtp_pool(port, check_after=60, idle_timeout=60):
+    """
+    :return: tuple of a bare Flask app mailing through the local SMTP server and its SMTP pool
+    """
+    app = Flask(__name__)
+    app.config.update(
+        MAIL_SERVER='localhost', MAIL_PORT=port, MAIL_DEFAULT_SENDER='admin@foomail.com',
+        SMTP_POOL_SIZE=2, SMTP_POOL_CHECK_AFTER=check_after, SMTP_POOL_IDLE_TIMEOUT=idle_timeout,
+    )
+    Mail(app)
+    return app, SMTPPool(app)
+
 
 def set_up_database(db):
     db.create_all()
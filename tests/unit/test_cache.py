@@ -0,0 +1,156 @@
+import datetime
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.cache import (
+    BlacklistCache, BloomFilter, ClaimsCache, SQLiteTTLCache, TTLCache, UserCache,
+)
+from app.main import db
+from app.main.data.dao import save_changes
+from app.main.model.user import User
+from tests.data_factory import random_email, random_text
+from tests.helpers import recorded_statements
+
+CAPACITY = 1000
+ERROR_RATE = 0.01
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(CAPACITY, ERROR_RATE)
+    added = [random_text(length=32) for _ in range(CAPACITY)]
+    for item in added:
+        bloom.add(item)
+    assert all(item in bloom for item in added)
+    assert not bloom.overflowed
+
+    false_positives = sum(random_text(length=33) in bloom for _ in range(CAPACITY))
+    assert false_positives < CAPACITY * ERROR_RATE * 5
+
+    bloom.clear()
+    assert not any(item in bloom for item in added)
+
+
+def test_blacklist_cache_reloads_beside_the_old_filter():
+    config = dict(
+        BLACKLIST_CACHE_ENABLED=True, BLACKLIST_CACHE_SYNC_INTERVAL=0, BLACKLIST_BLOOM_CAPACITY=4,
+        BLACKLIST_BLOOM_ERROR_RATE=ERROR_RATE, BLACKLIST_CACHE_SIZE=10, BLACKLIST_CACHE_TTL=60,
+    )
+    cache = BlacklistCache(SimpleNamespace(config=config, extensions=dict()))
+    now = datetime.datetime.utcnow()
+    rows = [(random_text(length=32), now) for _ in range(2)]
+    answers_during_reload, loaded_since = [], []
+
+    def loader(since):
+        loaded_since.append(since)
+        for key, blacklisted_on in list(rows):
+            # Another thread asking mid reload: a blacklisted key must not be reported as valid.
+            answers_during_reload.append(cache.get(rows[0][0]))
+            yield key, blacklisted_on
+
+    cache.sync(loader)
+    for _ in range(4):
+        rows.append((random_text(length=32), now))
+        cache.add(rows[-1][0])
+    assert cache.bloom.overflowed
+
+    answers_during_reload.clear()
+    cache.sync(loader)  # A full reload, into a filter with room to spare.
+    assert answers_during_reload == [None] * len(rows)
+    assert cache.bloom.capacity == len(rows) * 2
+    assert not cache.bloom.overflowed
+    assert all(cache.get(key) is not False for key, _ in rows)
+
+    cache.sync(loader)
+    assert loaded_since[0] is None and loaded_since[1] is None
+    assert loaded_since[2] is not None  # Not overflowed, so only new rows are loaded.
+
+
+def test_ttl_cache():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)  # 'b' is least recently used.
+    assert cache.get('b') is None
+    assert cache.stats() == dict(size=2, hits=1, misses=1, evictions=1)
+
+    cache.set('a', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('a') is None
+    assert cache.pop('c') == 3
+    assert not cache
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_ttl_cache_pop(shared, tmp_path):
+    """Test both backends pop the stored value, unless it has expired."""
+    cache = SQLiteTTLCache(str(tmp_path / 'cache.db'), 2, 60) if shared else TTLCache(2, 60)
+    cache.set('a', dict(b=1))
+    cache.set('c', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.pop('a') == dict(b=1)
+    assert cache.pop('a', 'gone') == 'gone'
+    assert cache.pop('c') is None
+    assert cache.get('c') is None
+
+
+def test_claims_cache():
+    config = dict(JWT_CLAIMS_CACHE_ENABLED=True, JWT_CLAIMS_CACHE_SIZE=10, JWT_CLAIMS_CACHE_TTL=60)
+    cache = ClaimsCache(SimpleNamespace(config=config, extensions=dict()))
+    claims = dict(sub='foo', exp=time.time() + 0.1)
+    cache.set('a', claims)
+    cache.set('b', dict(sub='bar', exp=time.time() - 1))  # Already expired: never cached.
+    assert cache.get('a') == claims
+    assert cache.get('b') is None
+
+    cache.evict('a')  # Token blacklisted.
+    assert cache.get('a') is None
+
+    cache.set('a', claims)
+    time.sleep(0.2)  # Entry expires with its token, before the configured TTL.
+    assert cache.get('a') is None
+
+
+def test_user_cache_shared_tier(tmp_path):
+    config = dict(
+        USER_CACHE_ENABLED=True, USER_CACHE_SIZE=10, USER_CACHE_TTL=60,
+        USER_CACHE_SHARED_PATH=str(tmp_path / 'users.db'),
+    )
+    writer, reader = [UserCache(SimpleNamespace(config=config, extensions=dict())) for _ in '12']
+    writer.set('public_id:foo', dict(public_id='foo'))
+    assert reader.get('public_id:foo') == dict(public_id='foo')  # From the shared tier.
+    assert reader.local.get('public_id:foo') == dict(public_id='foo')  # Now held locally too.
+
+    writer.evict('public_id:foo')
+    assert writer.get('public_id:foo') is None
+    assert reader.shared.get('public_id:foo') is None
+    assert writer.stats().get('shared').get('hits') == 0
+
+
+@pytest.mark.usefixtures('database')
+def test_user_cache_reads_through_and_evicts_on_write(database_user):
+    public_id, email = database_user.public_id, database_user.email
+    User.lookup(public_id=public_id)  # Warm the cache.
+    db.session.remove()  # As at the end of a request.
+    with recorded_statements() as statements:
+        user = User.lookup(public_id=public_id)
+        assert User.lookup(email=email) is user
+    # Each hit only checks the row's version; the row itself is not read.
+    assert len(statements) == 2
+    assert not any('email' in statement for statement in statements)
+    assert user.token_generation == 0
+
+    user.email = random_email()
+    save_changes(user)
+    assert User.lookup(email=email) is None
+    assert User.lookup(public_id=public_id).email == user.email
+
+    # As another worker would: the row changes but this worker's entries are not evicted.
+    User.query.filter_by(public_id=public_id).update(
+        dict(email_confirmed=True, version=User.version + 1), synchronize_session=False
+    )
+    db.session.commit()
+    db.session.remove()
+    assert User.lookup(public_id=public_id).email_confirmed
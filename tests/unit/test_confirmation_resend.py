@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+
+from app.main import db
+from app.main.model.email_outbox import EmailOutbox
+from app.main.model.user import User
+from app.main.service import email_outbox
+from app.main.service.confirmation_resend import resend_confirmations
+from tests.data_factory import random_email, user_attributes, user_model
+from tests.helpers import recorded_statements
+
+SINCE = datetime.datetime(2020, 6, 1)
+
+
+def add_users(count, sent_on, confirmed=False):
+    users = [user_model(user_attributes()) for _ in range(count)]
+    for user in users:
+        user.email_confirmation_sent_on = sent_on
+        user.email_confirmed = confirmed
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.email for user in users]
+
+
+@pytest.mark.usefixtures('database')
+def test_resend_confirmations(monkeypatch):
+    sent_to = []
+    monkeypatch.setattr(
+        email_outbox, 'send_email', lambda recipients, **_message: sent_to.extend(recipients)
+    )
+    unconfirmed = add_users(4, sent_on=SINCE + datetime.timedelta(hours=1))
+    unconfirmed += add_users(1, sent_on=None)  # As for imported users.
+    add_users(2, sent_on=SINCE + datetime.timedelta(hours=1), confirmed=True)
+    add_users(2, sent_on=SINCE - datetime.timedelta(hours=1))
+    # Other emails already in the outbox are left to the mail worker.
+    db.session.add(EmailOutbox(kind='password_reset', recipient=random_email()))
+    db.session.commit()
+
+    batches = []
+    with recorded_statements() as statements:
+        totals = resend_confirmations(
+            SINCE, batch_size=2, sessions=2, progress=lambda totals: batches.append(dict(totals)),
+        )
+    updates = [statement for statement in statements if statement.startswith('UPDATE user ')]
+
+    assert (totals['queued'], totals['sent'], totals['failed']) == (5, 5, 0)
+    assert [(batch['queued'], batch['sent']) for batch in batches] == [(2, 2), (4, 4), (5, 5)]
+    assert len(updates) == 3  # One per batch, not one per user.
+    assert sorted(sent_to) == sorted(unconfirmed)
+    assert EmailOutbox.query.filter(EmailOutbox.sent_on.isnot(None)).count() == 5
+    assert EmailOutbox.query.filter_by(kind='password_reset').one().sent_on is None
+
+    resent = User.query.filter(User.email.in_(unconfirmed)).all()
+    assert all(user.email_confirmation_sent_on > SINCE + datetime.timedelta(hours=1)
+               for user in resent)
+    assert all(user.version == 2 for user in resent)
@@ -0,0 +1,20 @@
+from flask import render_template
+
+from app.email_client import EMAIL_TEMPLATES, _compose_email
+from tests.conftest import app
+
+URL = 'http://localhost/confirm/token?a=1&b=2'
+
+
+def test_compose_email_matches_full_render(monkeypatch):
+    """Splicing the link into the cached fragments gives what rendering from scratch does."""
+    monkeypatch.setattr('app.email_client.url_for', lambda *_args, **_kwargs: URL)
+    with app.test_request_context(headers={'Accept-Language': 'en-AU'}):
+        for template, subject, plain_body in EMAIL_TEMPLATES:
+            composed = _compose_email('endpoint', 'user@foomail.com', 'salt', template, subject,
+                                      plain_body)
+            assert composed == (
+                str(subject),
+                render_template(f'{template}.html', url=URL),
+                plain_body.format(url=URL, email=app.config['ADMIN']),
+            )
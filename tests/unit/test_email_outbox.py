@@ -0,0 +1,129 @@
+import datetime
+
+import pytest
+from freezegun import freeze_time
+from sqlalchemy import event
+
+from app.main import db
+from app.main.model.email_outbox import EmailOutbox
+from app.main.service import email_outbox
+from app.main.service.common import MAX_TOKEN_AGE, timed_serialiser
+from app.main.service.email_outbox import drain_outbox, prune_outbox
+from tests.conftest import app
+from tests.data_factory import random_email
+
+MAX_ATTEMPTS = 3
+
+
+def queue_emails(count):
+    emails = [
+        EmailOutbox(kind='email_confirmation', recipient=random_email()) for _ in range(count)
+    ]
+    db.session.add_all(emails)
+    db.session.commit()
+    return [email.id for email in emails]
+
+
+@pytest.mark.usefixtures('database')
+def test_drain_outbox_retries_with_backoff(monkeypatch):
+    monkeypatch.setitem(app.config, 'EMAIL_OUTBOX_MAX_ATTEMPTS', MAX_ATTEMPTS)
+    sent_to, failing = [], set()
+
+    def send_email(recipients, **_message):
+        if recipients[0] in failing:
+            raise ConnectionError('Mail server went away')
+        sent_to.extend(recipients)
+
+    monkeypatch.setattr(email_outbox, 'send_email', send_email)
+    first, second, third = queue_emails(3)
+    failing.add(EmailOutbox.query.get(third).recipient)
+
+    now = datetime.datetime.utcnow()
+    assert drain_outbox(workers=2, now=now) == (2, 1)
+    assert drain_outbox(workers=2, now=now) == (0, 0)  # Nothing due until the backoff passes.
+    assert set(sent_to) == {EmailOutbox.query.get(sent).recipient for sent in (first, second)}
+
+    backoff = app.config['EMAIL_OUTBOX_BACKOFF']
+    retried = EmailOutbox.query.get(third)
+    assert retried.next_attempt_at == now + datetime.timedelta(seconds=backoff)
+    assert 'Mail server went away' in retried.last_error
+
+    for attempt in range(2, MAX_ATTEMPTS + 1):
+        now += datetime.timedelta(seconds=backoff * 2 ** attempt)
+        assert drain_outbox(now=now) == (0, 1)
+    given_up = EmailOutbox.query.get(third)
+    assert (given_up.attempts, given_up.next_attempt_at, given_up.sent_on) == (
+        MAX_ATTEMPTS, None, None
+    )
+    assert given_up.abandoned_on == now
+    assert drain_outbox(now=now + datetime.timedelta(days=1)) == (0, 0)
+
+
+@pytest.mark.usefixtures('database')
+def test_drain_outbox_skips_emails_claimed_by_another_worker(monkeypatch):
+    sent_to = []
+    monkeypatch.setattr(
+        email_outbox, 'send_email', lambda recipients, **_message: sent_to.extend(recipients)
+    )
+    mine, taken = queue_emails(2)
+    leased_until = datetime.datetime.utcnow() + datetime.timedelta(minutes=5)
+
+    claimed = []
+
+    def other_worker(_conn, cursor, statement, *_args):
+        # Claims one of the rows this worker has read, before this worker's UPDATE.
+        if statement.startswith('UPDATE email_outbox') and not claimed:
+            claimed.append(cursor.connection.execute(
+                'UPDATE email_outbox SET next_attempt_at = ? WHERE id = ?',
+                (leased_until.strftime('%Y-%m-%d %H:%M:%S.%f'), taken),
+            ))
+
+    event.listen(db.engine, 'before_cursor_execute', other_worker)
+    try:
+        assert drain_outbox() == (1, 0)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', other_worker)
+    assert sent_to == [EmailOutbox.query.get(mine).recipient]
+    assert EmailOutbox.query.get(taken).next_attempt_at == leased_until
+
+
+@pytest.mark.usefixtures('database')
+def test_drain_outbox_signs_links_when_sent(monkeypatch):
+    sent = []
+    monkeypatch.setattr(email_outbox, 'send_email', lambda **message: sent.append(message))
+    queued_on = datetime.datetime.utcnow()
+    with freeze_time(queued_on):
+        queue_emails(1)
+
+    # Sent long after it was queued, as after a backlog or retries, its link is still good.
+    with freeze_time(queued_on + datetime.timedelta(seconds=MAX_TOKEN_AGE * 10)):
+        assert drain_outbox() == (1, 0)
+        token = sent[0]['plain_body'].split('/users/email/confirm/')[1].split()[0]
+        salt = app.config['EMAIL_CONFIRMATION_SALT']
+        assert timed_serialiser(token, salt, 'Expired') == sent[0]['recipients'][0]
+
+
+@pytest.mark.usefixtures('database')
+def test_prune_outbox(monkeypatch):
+    monkeypatch.setitem(app.config, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 1)
+    failing = set()
+
+    def send_email(recipients, **_message):
+        if recipients[0] in failing:
+            raise ConnectionError('Mail server went away')
+
+    monkeypatch.setattr(email_outbox, 'send_email', send_email)
+    sent, abandoned, pending = queue_emails(3)
+    failing.add(EmailOutbox.query.get(abandoned).recipient)
+    EmailOutbox.query.get(pending).next_attempt_at = datetime.datetime.max
+    db.session.commit()
+
+    # Finished long after they were queued, they are kept for the retention from then.
+    retention = datetime.timedelta(seconds=app.config['EMAIL_OUTBOX_RETENTION'])
+    finished = datetime.datetime.utcnow() + retention * 2
+    assert drain_outbox(now=finished) == (1, 1)
+    assert prune_outbox(now=finished + retention / 2) == 0
+    assert prune_outbox(batch_size=1, now=finished + retention * 2) == 2
+    assert EmailOutbox.query.get(sent) is None
+    assert EmailOutbox.query.get(abandoned) is None
+    assert EmailOutbox.query.get(pending) is not None
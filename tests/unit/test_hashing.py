@@ -0,0 +1,67 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from werkzeug.exceptions import ServiceUnavailable
+
+from app.hashing import (
+    BCRYPT_MIN_ROUNDS, Argon2Hasher, BcryptHasher, HashingExecutor, calibrate,
+)
+
+SLOW = 0.5
+
+
+def hashing_executor(workers, queue_size, **config):
+    config.setdefault('PASSWORD_HASH_ALGORITHM', 'bcrypt')
+    config.update(
+        HASH_WORKERS=workers, HASH_QUEUE_SIZE=queue_size, HASH_RETRY_AFTER=3, BCRYPT_LOG_ROUNDS=4,
+        ARGON2_TIME_COST=1, ARGON2_MEMORY_COST=1024, ARGON2_PARALLELISM=1,
+    )
+    return HashingExecutor(SimpleNamespace(config=config, extensions=dict()))
+
+
+def test_hashing_runs_in_pool():
+    executor = hashing_executor(workers=1, queue_size=0)
+    try:
+        assert executor.run(pow, 2, 10) == 1024
+    finally:
+        executor.shutdown()
+
+
+def test_hashing_rejects_when_saturated():
+    executor = hashing_executor(workers=0, queue_size=0)
+    busy = threading.Thread(target=executor.run, args=(time.sleep, SLOW))
+    busy.start()
+    time.sleep(SLOW / 5)
+    assert executor.stats().get('in_flight') == 1
+    with pytest.raises(ServiceUnavailable) as err:
+        executor.run(pow, 2, 10)
+    assert err.value.retry_after == 3
+    busy.join()
+    assert executor.run(pow, 2, 10) == 1024
+
+
+@pytest.mark.parametrize('hasher', [BcryptHasher(rounds=4), Argon2Hasher(1, 1024, 1)])
+def test_hasher_encodes_algorithm_and_costs(hasher):
+    password_hash = hasher.hash('Passw0rd!')
+    assert hasher.identifies(password_hash)
+    assert hasher.verify(password_hash, 'Passw0rd!')
+    assert not hasher.verify(password_hash, 'Wr0ngPassw0rd!')
+    assert not hasher.needs_rehash(password_hash)
+    assert hasher.with_cost(5).needs_rehash(password_hash)
+
+
+def test_hashing_verifies_and_upgrades_other_algorithm():
+    executor = hashing_executor(workers=0, queue_size=0, PASSWORD_HASH_ALGORITHM='argon2id')
+    old_hash = BcryptHasher(rounds=4).hash('Passw0rd!')
+    assert executor.check_password(old_hash, 'Passw0rd!')
+    assert executor.needs_rehash(old_hash)
+    assert not executor.needs_rehash(executor.hash_password('Passw0rd!'))
+    assert not executor.check_password('$unknown$hash', 'Passw0rd!')
+
+
+def test_calibrate():
+    hasher, elapsed = calibrate(BcryptHasher(rounds=12), target_seconds=0.01)
+    assert hasher.rounds >= BCRYPT_MIN_ROUNDS
+    assert elapsed <= 0.01 or hasher.rounds == BCRYPT_MIN_ROUNDS
@@ -0,0 +1,21 @@
+from app.metrics import Metrics
+
+
+def test_metrics_snapshot():
+    metrics = Metrics()
+    metrics.increment('logins')
+    metrics.increment('logins', amount=2)
+    metrics.gauge('depth', 4)
+    metrics.observe('login', 0.02)
+    metrics.observe('login', 2)
+    metrics.register('cache', lambda: dict(hits=1))
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters'] == dict(logins=3)
+    assert snapshot['gauges'] == dict(depth=4)
+    assert snapshot['cache'] == dict(hits=1)
+    timing = snapshot['timings']['login']
+    assert timing['count'] == 2
+    assert timing['max_ms'] == 2000
+    assert timing['buckets']['le_25ms'] == 1
+    assert timing['buckets']['le_2500ms'] == 1
@@ -1,4 +1,5 @@
-from app.security import PasswordValidator
+from app.constants import TOKEN_DIGEST_SIZE
+from app.security import PasswordValidator, digest_token
 
 
 def test_password_validator():
@@ -10,3 +11,10 @@ def test_password_validator():
         for password, error in combo.items():
             password_invalid = PasswordValidator().validate_password(password)
             assert any(error in s for s in password_invalid)
+
+
+def test_digest_token():
+    digest = digest_token('foo.bar.baz')
+    assert len(digest) == TOKEN_DIGEST_SIZE
+    assert digest == digest_token('foo.bar.baz')
+    assert digest != digest_token('foo.bar.qux')
@@ -0,0 +1,53 @@
+import socket
+
+import pytest
+from flask_mail import Message
+
+from tests.data_factory import random_email
+from tests.helpers import local_smtp_server, make_smtp_pool
+
+
+def send(pool, count=1):
+    recipients = [random_email() for _ in range(count)]
+    for recipient in recipients:
+        pool.send(Message('Subject', recipients=[recipient], body='Body'))
+    return recipients
+
+
+@pytest.fixture(scope='function')
+def smtp_server():
+    with local_smtp_server() as server:
+        yield server
+
+
+def test_smtp_pool_reuses_connections(smtp_server):
+    app, pool = make_smtp_pool(smtp_server.port)
+    with app.app_context():
+        recipients = send(pool, count=3)
+        assert smtp_server.connections == 1
+        assert pool.stats() == dict(opened=1, reused=2, reconnected=0, closed=0, idle=1)
+
+        # The server has dropped the idle connection: the send is retried on a new one.
+        idle, _ = pool._idle[0]  # pylint: disable=protected-access
+        idle.host.sock.shutdown(socket.SHUT_RDWR)
+        recipients += send(pool)
+        assert pool.stats()['reconnected'] == 1
+
+        pool.idle_timeout = 0  # Every idle connection is now too old to reuse.
+        recipients += send(pool)
+        pool.close_all()
+    assert smtp_server.connections == 3
+    assert smtp_server.received == recipients
+
+
+def test_smtp_pool_checks_idle_connections(smtp_server):
+    app, pool = make_smtp_pool(smtp_server.port, check_after=0)
+    with app.app_context():
+        send(pool)
+        idle, _ = pool._idle[0]  # pylint: disable=protected-access
+        idle.host.sock.shutdown(socket.SHUT_RDWR)
+        send(pool)
+        pool.close_all()
+    # The dead connection failed its NOOP, so a new one was opened without a failed send.
+    assert pool.stats()['reconnected'] == 0
+    assert smtp_server.connections == 2
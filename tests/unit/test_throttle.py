@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+import pytest
+from werkzeug.exceptions import TooManyRequests
+
+from app.throttle import LoginThrottle
+
+WINDOW = 60
+IP_ADDRESS = '10.0.0.1'
+
+
+def login_throttle(store_path=None):
+    config = dict(
+        LOGIN_THROTTLE_ENABLED=True, LOGIN_THROTTLE_WINDOW=WINDOW, LOGIN_THROTTLE_MAX_PER_EMAIL=2,
+        LOGIN_THROTTLE_MAX_PER_IP=3, LOGIN_THROTTLE_STORE_PATH=store_path,
+    )
+    return LoginThrottle(SimpleNamespace(config=config, extensions=dict()))
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_login_throttle(shared, tmp_path):
+    store_path = str(tmp_path / 'throttle.db') if shared else None
+    throttle = login_throttle(store_path)
+    for _ in range(2):
+        throttle.check('Foo@Example.com', IP_ADDRESS)
+        throttle.record_failure('Foo@Example.com', IP_ADDRESS)
+
+    with pytest.raises(TooManyRequests) as err:
+        throttle.check('foo@example.com ', '10.0.0.2')  # Email is normalised before counting.
+    assert 0 < err.value.retry_after <= WINDOW + 1
+
+    throttle.reset('foo@example.com')
+    throttle.check('foo@example.com', IP_ADDRESS)
+    throttle.record_failure('bar@example.com', IP_ADDRESS)
+    with pytest.raises(TooManyRequests):
+        throttle.check('baz@example.com', IP_ADDRESS)  # IP has now failed 3 times.
+
+    if shared:  # Another worker on the node sees the same counts.
+        with pytest.raises(TooManyRequests):
+            login_throttle(store_path).check('baz@example.com', IP_ADDRESS)
@@ -0,0 +1,117 @@
+import csv
+import json
+import os
+
+import pytest
+
+from app.hashing import BCRYPT_MIN_ROUNDS, BcryptHasher
+from app.main import hashing
+from app.main.model.email_outbox import EmailOutbox
+from app.main.model.user import User
+from app.main.service import user_import
+from app.main.service.user_import import import_users
+from tests.data_factory import CRAP_PASSWORD, user_attributes
+
+
+@pytest.fixture(scope='function')
+def cheap_hashing(monkeypatch):
+    monkeypatch.setattr(hashing, 'hasher', BcryptHasher(rounds=BCRYPT_MIN_ROUNDS))
+
+
+def write_ndjson(path, records):
+    with open(path, 'w') as ndjson:
+        for record in records:
+            ndjson.write((record if isinstance(record, str) else json.dumps(record)) + '\n')
+
+
+@pytest.mark.usefixtures('database', 'cheap_hashing')
+def test_import_users(tmp_path):
+    existing = user_attributes()
+    import_users_from = tmp_path / 'users.ndjson'
+    write_ndjson(import_users_from, [existing])
+    assert import_users(str(import_users_from), workers=0)['imported'] == 1
+
+    good = [user_attributes() for _ in range(3)]
+    weak = dict(user_attributes(), password=CRAP_PASSWORD)
+    write_ndjson(import_users_from, [
+        good[0], weak, '{not json', existing, good[1], dict(good[1]), good[2],
+    ])
+    rejected_path = tmp_path / 'rejected.ndjson'
+    totals = import_users(
+        str(import_users_from), batch_size=2, workers=2, confirmed=True,
+        rejected_path=str(rejected_path),
+    )
+    assert (totals['imported'], totals['rejected'], totals['skipped']) == (3, 4, 0)
+    assert totals['rate'] > 0
+
+    rejected = [json.loads(line) for line in rejected_path.read_text().splitlines()]
+    assert [entry['record'] for entry in rejected] == [2, 3, 4, 6]
+    assert all('password' not in entry for entry in rejected)
+    assert not (tmp_path / 'users.ndjson.checkpoint').exists()
+
+    for record in good:
+        user = User().find_user(dict(email=record['email']), with_password=True)
+        assert user.email_confirmed
+        assert user.check_password(record['password'])
+
+
+@pytest.mark.usefixtures('database', 'cheap_hashing')
+def test_import_users_resumes_from_checkpoint(tmp_path):
+    weak = dict(user_attributes(), password=CRAP_PASSWORD)
+    records = [user_attributes() for _ in range(3)] + [weak]
+    import_users_from = tmp_path / 'users.csv'
+    with open(import_users_from, 'w', newline='') as users_csv:
+        writer = csv.DictWriter(
+            users_csv, fieldnames=['email', 'username', 'password'], extrasaction='ignore'
+        )
+        writer.writeheader()
+        writer.writerows(records)
+    # As left by a run which committed the first two records, then crashed after writing a reject
+    # from its next batch.
+    committed = json.dumps(dict(record=1, reason='Committed before the crash')) + '\n'
+    rejected_path = tmp_path / 'users.csv.rejected.ndjson'
+    rejected_path.write_text(committed + json.dumps(dict(record=4, reason='Not committed')) + '\n')
+    checkpoint = tmp_path / 'users.csv.checkpoint'
+    checkpoint.write_text(json.dumps(
+        dict(record=2, imported=2, rejected=1, rejected_size=len(committed))
+    ))
+
+    totals = import_users(str(import_users_from), workers=0)
+    assert (totals['imported'], totals['rejected'], totals['skipped']) == (3, 2, 2)
+    assert not checkpoint.exists()
+    rejected = rejected_path.read_text().splitlines(keepends=True)
+    assert rejected[0] == committed
+    assert [json.loads(line)['record'] for line in rejected] == [1, 4]
+
+    assert [bool(User().find_user(dict(email=record['email']))) for record in records] == [
+        False, False, True, False
+    ]
+    # Imported unconfirmed, so sent a confirmation email and findable by resend-confirmations.
+    user = User.query.filter_by(email=records[2]['email']).one()
+    assert user.email_confirmation_sent_on is not None
+    assert EmailOutbox.query.filter_by(recipient=user.email, kind='email_confirmation').count() == 1
+
+
+@pytest.mark.usefixtures('database', 'cheap_hashing')
+def test_import_users_checkpoints_the_last_batch(tmp_path, monkeypatch):
+    import_users_from = tmp_path / 'users.ndjson'
+    write_ndjson(import_users_from, [user_attributes() for _ in range(3)])
+    rejected_path = tmp_path / 'rejected.ndjson'
+    remove = os.remove
+
+    def crash(_path):
+        raise OSError('Killed')
+
+    # Dies after committing the last, partial batch, before removing the checkpoint.
+    monkeypatch.setattr(user_import.os, 'remove', crash)
+    with pytest.raises(OSError):
+        import_users(
+            str(import_users_from), batch_size=2, workers=0, rejected_path=str(rejected_path)
+        )
+    monkeypatch.setattr(user_import.os, 'remove', remove)
+
+    totals = import_users(
+        str(import_users_from), batch_size=2, workers=0, rejected_path=str(rejected_path)
+    )
+    assert (totals['imported'], totals['rejected'], totals['skipped']) == (3, 0, 3)
+    assert rejected_path.read_text() == ''